@@ -2,16 +2,32 @@ import sys
 import os
 from dotenv import load_dotenv
 
+# Переменные окружения нужны модулям уже при импорте (например, адрес хранилища LYSSA_STATE)
+load_dotenv()
 sys.path.append(os.path.join(os.path.dirname(__file__), 'modules'))
 import logging
-from modules.captcha import (captcha_command, handle_new_members,
-    handle_left_members, button_callback, handle_text_messages, Update
+from captcha import (captcha_command, handle_new_members,
+    handle_left_members, button_callback, handle_text_messages, captcha_pool, captcha_renderer, captcha_deadlines,
+    recover_pending_captchas, stop_recovery, pending_users, pending_captchas, Update
 )
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, \
-    filters
-from modules.lock import has_permission, lock_command
-from modules.time_limit import time_limit_command
-from modules.banUser import set_ban_mode
+    ChatMemberHandler, CallbackContext, Defaults, TypeHandler, filters
+from lock import has_permission, lock_command
+from time_limit import time_limit_command
+from banUser import set_ban_mode, kick_pipeline
+from config import flush_config
+from chat_config import flush_chat_configs, known_chat_ids
+from media_cache import media_cache
+from member_cache import track_member_changes
+from admin_roster import admin_roster, track_admin_changes
+from outbound import outbound_scheduler
+from delete_batcher import delete_batcher
+from captcha_journal import captcha_journal
+from shared_state import pending_store, verified_users
+from state_backend import SHARED_STATE, state_backend
+from sharding import ShardRouter, configure_shard, owns_chat, run_shard_application
+import sharding
+from metrics import MetricsServer, loop_lag_monitor, registry
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,7 +35,6 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
-load_dotenv()
 # Ваш токен
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")  # Рекомендуется хранить токен в переменной окружения
 
@@ -27,6 +42,40 @@ if not TOKEN:
     logger.error("TELEGRAM_BOT_TOKEN не установлена. Пожалуйста, установите переменную окружения.")
     exit(1)
 
+# Адрес Bot API вместо https://api.telegram.org/bot, например локальная замена для нагрузочных тестов
+# (benchmarks/bot_api_server.py): http://127.0.0.1:8081/bot
+BASE_URL = os.getenv("TELEGRAM_BASE_URL")
+
+# Режим вебхука включается, если задан публичный адрес, иначе бот работает через long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+# Сколько обновлений обрабатывается одновременно; по умолчанию в вебхуке 256, в polling — по одному
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "256" if WEBHOOK_URL else "1"))
+# Число процессов-шардов; обновления распределяются между ними по chat_id
+SHARDS = int(os.getenv("SHARDS", "1"))
+# Порт метрик Prometheus (/metrics); без него метрики собираются, но не отдаются.
+# Шард N слушает METRICS_PORT + N
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+
+# Текущие размеры очередей и состояний, читаются при каждом запросе /metrics
+registry.gauge("lyssa_pending_captchas", "Незавершённые капчи", lambda: len(pending_captchas))
+registry.gauge("lyssa_captcha_timers", "Взведённые таймеры предупреждений и киков", lambda: len(captcha_deadlines))
+registry.gauge("lyssa_kick_queue_depth", "Пользователи, ожидающие разбана после кика",
+               lambda: kick_pipeline.queue_depth)
+registry.gauge("lyssa_kick_unban_lag_seconds", "Опоздание последнего разбана", lambda: kick_pipeline.unban_lag)
+registry.gauge("lyssa_delete_queue_depth", "Сообщения, ожидающие удаления", lambda: delete_batcher.queue_depth)
+registry.gauge("lyssa_outbound_queue_depth", "Запросы к Bot API в очереди планировщика",
+               lambda: outbound_scheduler.queue_depth())
+registry.gauge("lyssa_outbound_retries", "Повторы запросов после RetryAfter", lambda: outbound_scheduler.retries)
+registry.gauge("lyssa_render_queue_depth", "Задачи отрисовки в пуле процессов", lambda: captcha_renderer.queue_depth)
+registry.gauge("lyssa_captcha_pool_size", "Готовые image капчи в пуле", lambda: len(captcha_pool))
+registry.gauge("lyssa_event_loop_lag_last_seconds", "Последнее измеренное опоздание event loop",
+               lambda: loop_lag_monitor.last_lag)
+metrics_server = MetricsServer(registry, METRICS_LISTEN, int(METRICS_PORT)) if METRICS_PORT else None
+
 
 async def some_command(update, context):
     if not await has_permission(update, context, "admin"):
@@ -86,9 +135,73 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.info(f"Update content: {update}")
 
 
-def main():
-    """Запуск бота."""
-    app = ApplicationBuilder().token(TOKEN).build()
+async def post_init(application) -> None:
+    """Запускает фоновые задачи после инициализации приложения."""
+    loop_lag_monitor.start()
+    if metrics_server is not None:
+        metrics_server.port += sharding.SHARD
+        await metrics_server.start()
+    captcha_renderer.start()
+    captcha_pool.start()
+    # Списки администраторов чатов шарда загружаются параллельно, не задерживая запуск
+    chat_ids = [chat_id for chat_id in known_chat_ids() if owns_chat(chat_id)]
+    admin_roster.start(application.bot, chat_ids)
+    kick_pipeline.start(application.bot)
+    delete_batcher.start(application.bot)
+    verified_users.load()
+    context = CallbackContext(application)
+    captcha_deadlines.start(context)
+    # Незавершённые капчи из журнала: таймеры взводятся заново, просроченные обрабатываются пачкой
+    recover_pending_captchas(context)
+
+
+async def post_stop(application) -> None:
+    """Снимает оставшиеся временные баны и удаляет сообщения из очереди, пока бот ещё может обращаться к API."""
+    await admin_roster.stop()
+    await stop_recovery()
+    await captcha_deadlines.stop()
+    await kick_pipeline.stop()
+    await delete_batcher.stop()
+    await loop_lag_monitor.stop()
+    if metrics_server is not None:
+        await metrics_server.stop()
+
+
+async def post_shutdown(application) -> None:
+    """Дописывает на диск отложенные изменения конфигурации перед выходом."""
+    await captcha_pool.stop()
+    captcha_renderer.shutdown()
+    flush_config()
+    flush_chat_configs()
+    media_cache.flush()
+    verified_users.flush()
+    pending_store.close()
+    state_backend.close()
+
+
+def application_builder():
+    """ApplicationBuilder с токеном и адресом Bot API."""
+    builder = ApplicationBuilder().token(TOKEN)
+    if BASE_URL:
+        builder = builder.base_url(BASE_URL)
+    return builder
+
+
+def build_application(updater: bool = True):
+    """Собирает приложение бота со всеми обработчиками."""
+    builder = (
+        application_builder()
+        .concurrent_updates(max(1, CONCURRENT_UPDATES))
+        .rate_limiter(outbound_scheduler)  # Все запросы к Bot API идут через общий планировщик
+        # Обработчики выполняются отдельными задачами: сообщение, ждущее лимита одного чата в планировщике,
+        # не задерживает разбор обновлений других чатов (в polling обновления разбираются по одному)
+        .defaults(Defaults(block=False))
+        .post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+    )
+    if not updater:
+        # Шард получает обновления от маршрутизатора, а не от Telegram
+        builder = builder.updater(None)
+    app = builder.build()
     # Обработчики команд и сообщений
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("captcha", captcha_command))
@@ -98,14 +211,68 @@ def main():
     app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, handle_new_members))
     app.add_handler(MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, handle_left_members))
     app.add_handler(CallbackQueryHandler(button_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_messages))
+    # Сначала дешёвая проверка по множеству ожидающих ответа, остальные сообщения отсекаются сразу
+    app.add_handler(MessageHandler(pending_users & filters.TEXT & ~filters.COMMAND, handle_text_messages))
+    # Изменения статуса участников обновляют кэш get_chat_member до обработчиков группы 0, поэтому блокирующие
+    app.add_handler(ChatMemberHandler(track_member_changes, ChatMemberHandler.ANY_CHAT_MEMBER, block=True), group=-1)
+    app.add_handler(ChatMemberHandler(track_admin_changes, ChatMemberHandler.ANY_CHAT_MEMBER, block=True), group=-2)
 
     # Обработчик ошибок
     app.add_error_handler(error_handler)
+    return app
+
+
+def run(app):
+    """Получает обновления через вебхук или long polling."""
+    # chat_member приходят только при явной подписке
+    if WEBHOOK_URL:
+        from webhook import run_webhook  # aiohttp нужен только в режиме вебхука
+        run_webhook(
+            app, WEBHOOK_URL,
+            listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, secret=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES, max_connections=CONCURRENT_UPDATES,
+        )
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
+
+
+def run_shard(shard: int, shards: int, updates):
+    """Точка входа процесса-шарда: обрабатывает обновления своих чатов, полученные от маршрутизатора."""
+    configure_shard(shard, shards)
+    if not SHARED_STATE:
+        # Без общего хранилища у каждого шарда свой журнал, поэтому число шардов менять нельзя
+        captcha_journal.path = f"lyssa_pending.{shard}.jsonl"
+    # Лимит запросов к Bot API общий на бота, шарды делят его поровну
+    outbound_scheduler.set_global_rate(outbound_scheduler.global_rate / shards)
+    run_shard_application(build_application(updater=False), updates)
+
+
+def run_router():
+    """Запускает процессы-шарды и раздаёт им обновления по chat_id."""
+    router = ShardRouter(SHARDS, run_shard)
+
+    async def start_shards(application):
+        router.start()
 
+    async def stop_shards(application):
+        # Шарды дорабатывают полученные обновления после остановки приёма новых
+        await router.stop()
+
+    app = application_builder().post_init(start_shards).post_stop(stop_shards).build()
+    app.add_handler(TypeHandler(Update, router.route))
+    app.add_error_handler(error_handler)
+    logger.info(f"Маршрутизатор запущен, шардов: {SHARDS}.")
+    run(app)
+
+
+def main():
+    """Запуск бота."""
+    if SHARDS > 1:
+        run_router()
+        return
+    app = build_application()
     logger.info("Бот запущен и ожидает новых сообщений.")
-    # Запуск бота
-    app.run_polling()
+    run(app)
 
 
 if __name__ == "__main__":
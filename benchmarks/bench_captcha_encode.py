@@ -0,0 +1,62 @@
+"""
+Бенчмарк кодирования image-капчи: время кодирования против размера файла
+для всех форматов и настроек encode_image.
+
+Запуск: python benchmarks/bench_captcha_encode.py [--images 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+from PIL import Image
+from captcha_image import encode_image, generate_captcha_code, generate_captcha_image
+
+# (формат, параметры encode_image)
+VARIANTS = [
+    ("png", {"compress_level": 1}),
+    ("png", {"compress_level": 6}),
+    ("png", {"compress_level": 9}),
+    ("png8", {"colors": 16, "compress_level": 6}),
+    ("png8", {"colors": 32, "compress_level": 1}),
+    ("png8", {"colors": 32, "compress_level": 6}),
+    ("png8", {"colors": 32, "compress_level": 9}),
+    ("png8", {"colors": 64, "compress_level": 6}),
+    ("webp", {"quality": 50}),
+    ("webp", {"quality": 75}),
+    ("webp", {"quality": 90}),
+    ("jpeg", {"quality": 50}),
+    ("jpeg", {"quality": 75}),
+    ("jpeg", {"quality": 90}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200, help="количество капч для замера")
+    args = parser.parse_args()
+
+    # Один и тот же набор изображений для всех вариантов
+    images = []
+    for _ in range(args.images):
+        image = Image.open(generate_captcha_image(generate_captcha_code()))
+        image.load()
+        images.append(image)
+
+    print(f"{'формат':<8} {'параметры':<32} {'мс/изобр.':>10} {'байт/изобр.':>12}")
+    for image_format, options in VARIANTS:
+        total_bytes = 0
+        started = time.perf_counter()
+        for image in images:
+            total_bytes += len(encode_image(image, image_format, **options))
+        elapsed = time.perf_counter() - started
+        params = ", ".join(f"{key}={value}" for key, value in options.items())
+        print(f"{image_format:<8} {params:<32} {elapsed / len(images) * 1000:>10.3f} "
+              f"{total_bytes / len(images):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Микробенчмарк отрисовки image-капчи: старый конвейер (точки через draw.point,
+N проходов ImageFilter.BLUR) против текущего generate_captcha_image.
+
+Запуск: python benchmarks/bench_captcha_render.py [--seconds 3] [--rounds 5] [--noise 600] [--blur 2]
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from captcha_image import generate_captcha_code, generate_captcha_image
+
+FONT_PATH = os.path.join(os.path.dirname(__file__), '..', 'Fonts', 'arial.ttf')
+
+
+def legacy_generate_captcha_image(text, font_path=FONT_PATH, size=(200, 80), noise_points=50, blur_intensity=0):
+    """Копия прежней реализации generate_captcha_image для сравнения."""
+    width, height = size
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.truetype(font_path, 36)
+
+    text_color = (random.randint(0, 100), random.randint(0, 100), random.randint(0, 100))
+    bbox = font.getbbox(text)
+    text_x = (width - (bbox[2] - bbox[0])) // 2
+    text_y = (height - (bbox[3] - bbox[1])) // 2
+    draw.text((text_x, text_y), text, font=font, fill=text_color)
+
+    for _ in range(5):
+        start = (random.randint(0, width), random.randint(0, height))
+        end = (random.randint(0, width), random.randint(0, height))
+        line_color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+        draw.line([start, end], fill=line_color, width=2)
+
+    for _ in range(noise_points):
+        x = random.randint(0, width)
+        y = random.randint(0, height)
+        draw.point((x, y), fill=(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+
+    for _ in range(blur_intensity):
+        image = image.filter(ImageFilter.BLUR)
+
+    byte_io = io.BytesIO()
+    image.save(byte_io, 'PNG')
+    byte_io.seek(0)
+    return byte_io
+
+
+def images_per_second(func, seconds, **kwargs):
+    """Вызывает func, пока не пройдёт seconds секунд, и возвращает число изображений в секунду."""
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        func(generate_captcha_code(), **kwargs)
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def best_of(funcs, seconds, rounds, **kwargs):
+    """Замеряет функции поочерёдно в несколько раундов и берёт лучший результат каждой."""
+    best = [0.0] * len(funcs)
+    for _ in range(rounds):
+        for i, func in enumerate(funcs):
+            best[i] = max(best[i], images_per_second(func, seconds / rounds, **kwargs))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=3.0, help="длительность замера каждой реализации")
+    parser.add_argument("--rounds", type=int, default=5, help="количество чередующихся раундов")
+    parser.add_argument("--noise", type=int, default=600, help="количество точек шума")
+    parser.add_argument("--blur", type=int, default=2, help="интенсивность размытия")
+    args = parser.parse_args()
+
+    kwargs = {"font_path": FONT_PATH, "noise_points": args.noise, "blur_intensity": args.blur}
+    before, after = best_of(
+        [legacy_generate_captcha_image, generate_captcha_image], args.seconds, args.rounds, **kwargs
+    )
+
+    print(f"noise_points={args.noise} blur_intensity={args.blur}")
+    print(f"до:     {before:8.1f} изобр./с")
+    print(f"после:  {after:8.1f} изобр./с")
+    print(f"ускорение: x{after / before:.2f}")
+
+
+if __name__ == "__main__":
+    main()
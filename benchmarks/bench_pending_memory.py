@@ -0,0 +1,92 @@
+"""
+Бенчмарк памяти незавершённых капч: прежняя раскладка (несколько словарей
+со вложенными словарями по user_id) против записей PendingCaptcha по (chat_id, user_id).
+
+Запуск: python benchmarks/bench_pending_memory.py [--users 100000] [--type image]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+from pending import PendingCaptcha
+
+CHAT_ID = -1001234567890
+
+
+def captcha_answer(captcha_type, rng):
+    if captcha_type == "math":
+        return rng.randint(-19, 40)
+    if captcha_type == "image":
+        return "".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ23456789") for _ in range(5))
+    return None
+
+
+def build_legacy(users, captcha_type, rng):
+    """Прежняя раскладка состояния из modules/captcha.py."""
+    user_math_captcha = {}
+    user_captcha_code = {}
+    user_captcha_messages = {}
+    deadlines = {}  # Вместо заданий JobQueue учитываем только сроки
+    now = time.time()
+    for i in range(users):
+        user_id = 5_000_000_000 + i
+        answer = captcha_answer(captcha_type, rng)
+        if captcha_type == "math":
+            user_math_captcha[user_id] = answer
+        elif captcha_type == "image":
+            user_captcha_code[user_id] = {"code": answer, "current_index": 0}
+        user_captcha_messages[user_id] = {'captcha': 100_000 + i, 'warning': 200_000 + i}
+        deadlines[user_id] = {'warning': now + 30.0, 'kick': now + 60.0}
+    return user_math_captcha, user_captcha_code, user_captcha_messages, deadlines
+
+
+def build_pending(users, captcha_type, rng):
+    """Записи PendingCaptcha в одном словаре по (chat_id, user_id)."""
+    pending_captchas = {}
+    now = time.time()
+    for i in range(users):
+        user_id = 5_000_000_000 + i
+        pending = PendingCaptcha(CHAT_ID, user_id, captcha_type, captcha_answer(captcha_type, rng))
+        pending.captcha_message_id = 100_000 + i
+        pending.warning_message_id = 200_000 + i
+        pending.warn_at = now + 30.0
+        pending.deadline = now + 60.0
+        pending_captchas[pending.key] = pending
+    return pending_captchas
+
+
+def measure(build, users, captcha_type):
+    """Возвращает (байт всего, секунд на построение)."""
+    rng = random.Random(0)
+    tracemalloc.start()
+    started = time.perf_counter()
+    state = build(users, captcha_type, rng)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del state
+    return current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000, help="количество незавершённых капч")
+    parser.add_argument("--type", default="image", choices=["button", "math", "fruits", "image"],
+                        help="тип капчи")
+    args = parser.parse_args()
+
+    print(f"users={args.users} type={args.type}")
+    print(f"{'раскладка':<16} {'МБ':>8} {'байт/польз.':>12} {'построение, с':>14}")
+    for name, build in (("словари", build_legacy), ("PendingCaptcha", build_pending)):
+        total, elapsed = measure(build, args.users, args.type)
+        print(f"{name:<16} {total / 2**20:>8.1f} {total / args.users:>12.0f} {elapsed:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
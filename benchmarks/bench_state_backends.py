@@ -0,0 +1,121 @@
+"""
+Бенчмарк хранилищ общего состояния (memory, sqlite, redis): скорость записи
+незавершённых капч, прошедших капчу и настроек чатов, а также загрузки состояния
+шарда при запуске. Заодно проверяет, что каждая запись загружается ровно одним шардом.
+Redis проверяется на локальной заглушке benchmarks/resp_stub.py, если не указан --redis.
+
+Запуск: python benchmarks/bench_state_backends.py [--records 20000] [--shards 4] [--redis redis://...]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+from resp_stub import RespStub
+from state_backend import create_backend
+
+CHATS = 200
+
+
+def make_records(count, rng):
+    chats = [-1001000000000 - i for i in range(CHATS)]
+    records = []
+    for i in range(count):
+        record = {
+            "chat": rng.choice(chats),
+            "user": 5_000_000_000 + i,
+            "type": "image",
+            "answer": "A7K2P",
+            "index": 0,
+            "captcha": 100_000 + i,
+            "warning": None,
+            "batch": None,
+            "deadline": time.time() + 60,
+            "warn_at": time.time() + 30,
+        }
+        records.append(record)
+    return records
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def run_backend(name, backend, records, shards):
+    results = {}
+
+    def put_pending():
+        for record in records:
+            backend.put_pending(record["chat"], record["user"], record)
+
+    def add_verified():
+        for record in records:
+            backend.set_verified(record["chat"], record["user"], True)
+
+    def set_chat_configs():
+        for i in range(CHATS):
+            backend.set_chat_config(-1001000000000 - i, {"captcha_type": "math", "time_limit": 90})
+
+    def get_chat_configs():
+        for i in range(CHATS):
+            backend.get_chat_config(-1001000000000 - i)
+
+    def load_shards():
+        pending = sum(len(backend.load_pending(shard, shards)) for shard in range(shards))
+        verified = sum(len(backend.load_verified(shard, shards)) for shard in range(shards))
+        return pending, verified
+
+    def remove_pending():
+        for record in records:
+            backend.remove_pending(record["chat"], record["user"])
+
+    _, results["put_pending"] = timed(put_pending)
+    _, results["set_verified"] = timed(add_verified)
+    _, results["set_chat_config"] = timed(set_chat_configs)
+    _, results["get_chat_config"] = timed(get_chat_configs)
+    (pending, verified), results["load_shards"] = timed(load_shards)
+    _, results["remove_pending"] = timed(remove_pending)
+    left = sum(len(backend.load_pending(shard, shards)) for shard in range(shards))
+
+    ok = pending == len(records) and verified == len(records) and left == 0
+    ops = {"put_pending": len(records), "set_verified": len(records), "set_chat_config": CHATS,
+           "get_chat_config": CHATS, "load_shards": 2 * len(records), "remove_pending": len(records)}
+    for op, elapsed in results.items():
+        print(f"{name:<8} {op:<16} {ops[op] / elapsed:>12.0f} оп/с {elapsed:>9.3f} с")
+    print(f"{name:<8} {'проверка':<16} {'OK' if ok else 'ОШИБКА'} "
+          f"(загружено {pending} капч, {verified} прошедших, осталось {left})")
+    backend.close()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20_000, help="количество записей каждого вида")
+    parser.add_argument("--shards", type=int, default=4, help="количество шардов при загрузке")
+    parser.add_argument("--redis", help="адрес Redis вместо локальной заглушки")
+    args = parser.parse_args()
+
+    records = make_records(args.records, random.Random(0))
+    redis_url = args.redis
+    if not redis_url:
+        stub = RespStub(port=0).start_in_thread()
+        redis_url = f"redis://127.0.0.1:{stub.port}/0"
+
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        for name, url in (("memory", "memory://"),
+                          ("sqlite", f"sqlite:///{os.path.join(directory, 'state.db')}"),
+                          ("redis", redis_url)):
+            ok &= run_backend(name, create_backend(url), records, args.shards)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Набор бенчмарков горячих путей бота без сети, на поддельном Bot API (benchmarks/fake_bot_api.py)
+с заданной задержкой и долей ошибок:
+
+- render   — generate_captcha_image, изображений в секунду (в одном процессе);
+- config   — стоимость get_config, load_config и чтения файла конфигурации;
+- handlers — задержка обработки одного обновления: handle_new_members, button_callback,
+             handle_text_messages (через Application.process_update);
+- raid     — рейд из --raid-joins входов в --raid-chats групп через очередь обновлений
+             с concurrent_updates: входов в секунду и задержка от постановки в очередь до конца обработки.
+
+Запросы идут через OutboundScheduler, по умолчанию с лимитами, которые не тормозят бенчмарк
+(--global-rate, --group-per-minute). Результат — JSON (stdout или --output); --compare сравнивает
+его с прошлым результатом, например, предыдущего релиза.
+
+Запуск: python benchmarks/bench_suite.py [--latency 0.01] [--error-rate 0] [--retry-rate 0]
+        [--samples 1000] [--raid-joins 5000] [--output result.json] [--compare baseline.json]
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+import telegram
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, MessageHandler, TypeHandler, filters
+
+from fake_bot_api import FakeBotApi, FakeRequest, make_chat, make_user
+
+SECTIONS = ("render", "config", "handlers", "raid")
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Идентификаторы участников, уникальные на весь прогон
+_user_ids = itertools.count(5_000_000_000)
+_update_ids = itertools.count(1)
+
+
+def percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def latency_stats(samples) -> dict:
+    """Задержки в миллисекундах."""
+    if not samples:
+        return {"samples": 0}
+    return {
+        "samples": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": percentile(samples, 0.5) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def join_update(bot, chat_id: int, user_ids) -> Update:
+    data = {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": make_chat(chat_id),
+            "from": make_user(user_ids[0]),
+            "new_chat_members": [make_user(user_id) for user_id in user_ids],
+        },
+    }
+    return Update.de_json(data, bot)
+
+
+def callback_update(bot, chat_id: int, user_id: int, message_id: int, callback_data: str) -> Update:
+    data = {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": make_user(user_id),
+            "chat_instance": str(chat_id),
+            "data": callback_data,
+            "message": {"message_id": message_id, "date": int(time.time()), "chat": make_chat(chat_id)},
+        },
+    }
+    return Update.de_json(data, bot)
+
+
+def text_update(bot, chat_id: int, user_id: int, text: str) -> Update:
+    data = {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": make_chat(chat_id),
+            "from": make_user(user_id),
+            "text": text,
+        },
+    }
+    return Update.de_json(data, bot)
+
+
+def bench_render(seconds: float) -> dict:
+    from captcha_image import generate_captcha_code, generate_captcha_image
+    from config import DEFAULT_CONFIG, get_config
+
+    config = get_config()
+    image_format = config.get("captcha_image_format", DEFAULT_CONFIG["captcha_image_format"])
+    kwargs = {
+        "image_format": image_format,
+        "quality": config.get("captcha_image_quality", DEFAULT_CONFIG["captcha_image_quality"]),
+        "compress_level": config.get("captcha_png_compress_level", DEFAULT_CONFIG["captcha_png_compress_level"]),
+        "colors": config.get("captcha_palette_colors", DEFAULT_CONFIG["captcha_palette_colors"]),
+    }
+    generate_captcha_image(generate_captcha_code(), **kwargs)  # Атлас символов строится при первом вызове
+    count = 0
+    size = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        size += len(generate_captcha_image(generate_captcha_code(), **kwargs).getvalue())
+        count += 1
+    elapsed = time.perf_counter() - started
+    return {"format": image_format, "images": count, "images_per_second": count / elapsed,
+            "mean_bytes": size / count}
+
+
+def bench_config(iterations: int) -> dict:
+    import config
+
+    def per_call_us(func, count):
+        started = time.perf_counter()
+        for _ in range(count):
+            func()
+        return (time.perf_counter() - started) / count * 1e6
+
+    config.flush_config()  # Файл конфигурации должен существовать на диске
+    return {
+        "get_config_us": per_call_us(config.get_config, iterations),
+        "load_config_us": per_call_us(config.load_config, iterations),
+        # Перечитывание после изменения файла на диске
+        "read_config_file_us": per_call_us(config._read_config_file, max(1, iterations // 100)),
+    }
+
+
+def build_app(args, api: FakeBotApi, concurrency: int = 1):
+    from captcha import button_callback, handle_new_members, handle_text_messages, pending_users
+    from outbound import OutboundScheduler
+
+    scheduler = OutboundScheduler(global_rate=args.global_rate, group_per_minute=args.group_per_minute)
+    app = (
+        ApplicationBuilder().token("123:bench")
+        .request(FakeRequest(api)).get_updates_request(FakeRequest(api))
+        .rate_limiter(scheduler).concurrent_updates(concurrency).updater(None)
+        .build()
+    )
+    app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, handle_new_members))
+    app.add_handler(CallbackQueryHandler(button_callback))
+    app.add_handler(MessageHandler(pending_users & filters.TEXT & ~filters.COMMAND, handle_text_messages))
+    return app, scheduler
+
+
+async def timed_updates(app, updates) -> list:
+    samples = []
+    for update in updates:
+        started = time.perf_counter()
+        await app.process_update(update)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def bench_handlers(args, api: FakeBotApi) -> dict:
+    from callback_token import callback_expiry, sign_callback
+    from captcha import pending_captchas
+    from chat_config import set_chat_config
+    from delete_batcher import delete_batcher
+
+    app, _ = build_app(args, api)
+    await app.initialize()
+    delete_batcher.start(app.bot)
+    button_chats = [-1002000000000 - i for i in range(args.chats)]
+    math_chats = [-1003000000000 - i for i in range(args.chats)]
+    for chat_id in math_chats:
+        set_chat_config(chat_id, captcha_type="math")
+
+    # Входы в группы с button капчей
+    joins = [(button_chats[i % args.chats], next(_user_ids)) for i in range(args.samples)]
+    new_members = await timed_updates(app, (join_update(app.bot, chat_id, [user_id]) for chat_id, user_id in joins))
+
+    # Нажатия на кнопку тех же пользователей
+    expires = callback_expiry(60)
+    callbacks = []
+    for chat_id, user_id in joins:
+        pending = pending_captchas.get((chat_id, user_id))
+        if pending is not None and pending.captcha_message_id is not None:
+            data = sign_callback("button", chat_id, user_id, 1, expires)
+            callbacks.append(callback_update(app.bot, chat_id, user_id, pending.captcha_message_id, data))
+    button = await timed_updates(app, callbacks)
+
+    # Ответы текстом на math капчу; сами входы в замер не попадают
+    math_joins = [(math_chats[i % args.chats], next(_user_ids)) for i in range(args.samples)]
+    for chat_id, user_id in math_joins:
+        await app.process_update(join_update(app.bot, chat_id, [user_id]))
+    answers = []
+    for chat_id, user_id in math_joins:
+        pending = pending_captchas.get((chat_id, user_id))
+        if pending is not None and pending.answer is not None:
+            answers.append(text_update(app.bot, chat_id, user_id, str(pending.answer)))
+    text = await timed_updates(app, answers)
+
+    await delete_batcher.stop()
+    await app.shutdown()
+    return {
+        "handle_new_members": latency_stats(new_members),
+        "button_callback": latency_stats(button),
+        "handle_text_messages": latency_stats(text),
+    }
+
+
+async def bench_raid(args, api: FakeBotApi) -> dict:
+    from delete_batcher import delete_batcher
+
+    app, scheduler = build_app(args, api, args.concurrency)
+    chats = [-1004000000000 - i for i in range(args.raid_chats)]
+    updates = [join_update(app.bot, chats[i % len(chats)], [next(_user_ids) for _ in range(args.raid_join_size)])
+               for i in range(args.raid_joins)]
+    enqueued = {}
+    latencies = []
+    errors = 0
+    finished = asyncio.Event()
+
+    async def done(update, context):
+        # Группа 1 выполняется после обработчиков группы 0 для того же обновления
+        latencies.append(time.perf_counter() - enqueued.pop(update.update_id))
+        if len(latencies) == len(updates):
+            finished.set()
+
+    async def count_error(update, context):
+        nonlocal errors
+        errors += 1
+
+    app.add_handler(TypeHandler(Update, done), group=1)
+    app.add_error_handler(count_error)
+    await app.initialize()
+    await app.start()
+    delete_batcher.start(app.bot)
+    requests_before = api.total_requests
+
+    started = time.perf_counter()
+    for update in updates:
+        enqueued[update.update_id] = time.perf_counter()
+        await app.update_queue.put(update)
+    await finished.wait()
+    elapsed = time.perf_counter() - started
+    requests = api.total_requests - requests_before
+
+    await delete_batcher.stop()
+    await app.stop()
+    await app.shutdown()
+    joins = args.raid_joins * args.raid_join_size
+    return {
+        "updates": len(updates),
+        "joins": joins,
+        "chats": len(chats),
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "joins_per_second": joins / elapsed,
+        "api_requests": requests,
+        "api_requests_per_second": requests / elapsed,
+        "outbound_retries": scheduler.retries,
+        "handler_errors": errors,
+        "latency": latency_stats(latencies),
+    }
+
+
+async def run_async(args, api: FakeBotApi, sections) -> dict:
+    # Всё асинхронное выполняется в одном event loop: модульные планировщики привязываются к нему
+    results = {}
+    if "handlers" in sections:
+        results["handlers"] = await bench_handlers(args, api)
+    if "raid" in sections:
+        results["raid"] = await bench_raid(args, api)
+    return results
+
+
+def flatten(data, prefix=""):
+    """Числовые значения вложенного словаря с ключами вида handlers.button_callback.p99_ms."""
+    values = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(result: dict, baseline_path: str):
+    """Печатает в stderr изменения относительно прошлого результата."""
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+    old = flatten({key: value for key, value in baseline.items() if key != "meta"})
+    new = flatten({key: value for key, value in result.items() if key != "meta"})
+    print(f"{'метрика':<48} {'было':>12} {'стало':>12} {'изменение':>10}", file=sys.stderr)
+    for name in sorted(old.keys() & new.keys()):
+        change = f"{(new[name] / old[name] - 1) * 100:+.1f}%" if old[name] else "—"
+        print(f"{name:<48} {old[name]:>12.3f} {new[name]:>12.3f} {change:>10}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", nargs="+", choices=SECTIONS, default=list(SECTIONS), help="какие замеры выполнять")
+    parser.add_argument("--latency", type=float, default=0.01, help="задержка ответа Bot API, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, до N с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 400 Bad Request")
+    parser.add_argument("--retry-rate", type=float, default=0.0, help="доля ответов 429 RetryAfter")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--global-rate", type=float, default=1e6, help="общий лимит планировщика, запросов/с")
+    parser.add_argument("--group-per-minute", type=float, default=1e8, help="лимит сообщений в группу в минуту")
+    parser.add_argument("--render-seconds", type=float, default=3.0, help="длительность замера отрисовки")
+    parser.add_argument("--config-iterations", type=int, default=100_000, help="вызовов get_config и load_config")
+    parser.add_argument("--samples", type=int, default=1000, help="обновлений на каждый обработчик")
+    parser.add_argument("--chats", type=int, default=50, help="групп в замере обработчиков")
+    parser.add_argument("--raid-joins", type=int, default=5000, help="событий входа в рейде")
+    parser.add_argument("--raid-join-size", type=int, default=1, help="участников в одном событии входа")
+    parser.add_argument("--raid-chats", type=int, default=1, help="групп под рейдом")
+    parser.add_argument("--concurrency", type=int, default=256, help="concurrent_updates во время рейда")
+    parser.add_argument("--seed", type=int, default=0, help="seed ошибок и задержек")
+    parser.add_argument("--output", help="файл для JSON вместо stdout")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--log-level", default="CRITICAL", help="уровень логов бота")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    # Пути из аргументов относительно каталога запуска, до смены текущего каталога
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    # Модули бота при импорте создают файлы конфигурации и состояния в текущем каталоге
+    os.chdir(tempfile.mkdtemp(prefix="lyssa-bench-"))
+    import captcha  # noqa: F401 — импорт модулей бота до замеров
+
+    api = FakeBotApi(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                     retry_rate=args.retry_rate, retry_after=args.retry_after, seed=args.seed)
+    result = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "python_telegram_bot": telegram.__version__,
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+    }
+    if "render" in args.sections:
+        result["render"] = bench_render(args.render_seconds)
+    if "config" in args.sections:
+        result["config"] = bench_config(args.config_iterations)
+    result.update(asyncio.run(run_async(args, api, args.sections)))
+    result["api"] = {
+        "requests": dict(api.requests),
+        "errors": {f"{method}:{status}": count for (method, status), count in api.errors.items()},
+    }
+
+    from shared_state import pending_store, verified_users
+    from state_backend import state_backend
+    verified_users.flush()
+    pending_store.close()
+    state_backend.close()
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    if baseline:
+        compare(result, baseline)
+
+
+if __name__ == "__main__":
+    main()
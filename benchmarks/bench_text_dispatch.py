@@ -0,0 +1,103 @@
+"""
+Бенчмарк диспетчеризации текстовых сообщений: сколько обновлений в секунду проходит
+через Application.process_update с прежним обработчиком handle_text_messages
+(filters.TEXT & ~filters.COMMAND) и с предварительным фильтром pending_users.
+Поток — синтетические сообщения в группах; среди отправителей есть пользователи
+с незавершённой капчей, но сами их сообщения в поток не попадают (иначе ушли бы запросы к API).
+
+Запуск: python benchmarks/bench_text_dispatch.py [--messages 100000] [--pending 10000] [--chats 500]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+from telegram import Update, User
+from telegram.ext import ApplicationBuilder, ExtBot, MessageHandler, filters
+
+
+class OfflineBot(ExtBot):
+    """Бот без сети: getMe отвечает локально, чтобы приложение можно было инициализировать."""
+
+    async def get_me(self, *args, **kwargs):
+        self._bot_user = User(id=123, is_bot=True, first_name="Lyssa", username="lyssa_bench_bot")
+        return self._bot_user
+
+
+def make_updates(count, chats, rng, bot):
+    updates = []
+    now = int(time.time())
+    for i in range(count):
+        data = {
+            "update_id": i,
+            "message": {
+                "message_id": i,
+                "date": now,
+                "chat": {"id": rng.choice(chats), "type": "supergroup", "title": "chat"},
+                "from": {"id": 1_000_000 + rng.randrange(1_000_000), "is_bot": False, "first_name": "user"},
+                "text": "обычное сообщение в чате",
+            },
+        }
+        updates.append(Update.de_json(data, bot))
+    return updates
+
+
+async def dispatch(text_filter, handler, updates):
+    """Возвращает (обновлений в секунду, сколько обновлений дошло до обработчика)."""
+    app = ApplicationBuilder().bot(OfflineBot("123:bench")).updater(None).build()
+    await app.initialize()
+    reached = 0
+
+    async def counting_handler(update, context):
+        nonlocal reached
+        reached += 1
+        await handler(update, context)
+
+    app.add_handler(MessageHandler(text_filter, counting_handler))
+    started = time.perf_counter()
+    for update in updates:
+        await app.process_update(update)
+    elapsed = time.perf_counter() - started
+    await app.shutdown()
+    return len(updates) / elapsed, reached
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100_000, help="сообщений в потоке")
+    parser.add_argument("--pending", type=int, default=10_000, help="пользователей с незавершённой капчей")
+    parser.add_argument("--chats", type=int, default=500, help="количество групп")
+    args = parser.parse_args()
+
+    # Модуль капчи при импорте создаёт файлы конфигурации в текущем каталоге
+    os.chdir(tempfile.mkdtemp(prefix="lyssa-bench-"))
+    from captcha import handle_text_messages, pending_captchas, pending_users
+    from pending import PendingCaptcha
+
+    rng = random.Random(0)
+    chats = [-1001000000000 - i for i in range(args.chats)]
+    for i in range(args.pending):
+        chat_id = rng.choice(chats)
+        user_id = 5_000_000_000 + i  # Не пересекаются с отправителями сообщений
+        pending_captchas[(chat_id, user_id)] = PendingCaptcha(chat_id, user_id, rng.choice(["math", "image"]), "0")
+
+    updates = make_updates(args.messages, chats, rng, None)
+    print(f"messages={args.messages} pending={len(pending_users)} chats={args.chats}")
+    print(f"{'фильтр':<32} {'обновлений/с':>14} {'дошло до обработчика':>22}")
+    variants = (
+        ("TEXT & ~COMMAND", filters.TEXT & ~filters.COMMAND),
+        ("pending_users & TEXT & ~COMMAND", pending_users & filters.TEXT & ~filters.COMMAND),
+    )
+    for name, text_filter in variants:
+        rate, reached = asyncio.run(dispatch(text_filter, handle_text_messages, updates))
+        print(f"{name:<32} {rate:>14.0f} {reached:>22}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,527 @@
+"""
+Локальная замена Bot API для нагрузочного тестирования бота целиком (сеть PTB, long polling, таймеры капч).
+Методы — как в benchmarks/fake_bot_api.py, плюс getUpdates с long polling.
+
+Режимы:
+  serve  — HTTP-сервер на /bot<token>/<метод>. Проигрывает записанный поток обновлений (--replay)
+           в N раз быстрее (--speed), начиная с первого getUpdates бота, добавляет ответы 429 RetryAfter
+           (--retry-rate) и считает частоту запросов бота и задержку реакции (p50/p99) — время от выдачи
+           обновления в getUpdates до первого запроса бота по этому обновлению. С --press-rate нажимает
+           кнопку в капче за вошедшего пользователя через --press-delay секунд.
+  record — записывает обновления настоящего бота через getUpdates (сам бот в это время должен быть остановлен).
+  synth  — синтетический рейд: --joins входов в --chats групп с частотой --rate в секунду.
+
+Поток обновлений — JSONL, в каждой строке {"t": секунды от начала, "update": {...}}.
+
+Бот направляется на сервер переменной окружения:
+    TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot python Lyssa.py
+Запуск: python benchmarks/bot_api_server.py synth --joins 5000 --rate 500 --output raid.jsonl
+        python benchmarks/bot_api_server.py serve --replay raid.jsonl --speed 1 [--retry-rate 0.01] [--report r.json]
+        python benchmarks/bot_api_server.py record --token ... --output stream.jsonl [--duration 600]
+"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+from aiohttp import web
+
+from fake_bot_api import FakeBotApi, make_chat, make_user
+from lifecycle import wait_for_stop_signal
+
+# Сколько секунд держать запрос getUpdates, если клиент не передал timeout
+DEFAULT_POLL_TIMEOUT = 10
+REPORT_INTERVAL = 5.0
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _json_param(value):
+    """Сложные параметры в форме приходят JSON-строкой, в JSON-теле — объектом."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return None
+    return value
+
+
+def display_name(user: dict) -> str:
+    """Имя пользователя так, как его упоминает бот."""
+    if user.get("username"):
+        return f"@{user['username']}"
+    return " ".join(filter(None, (user.get("first_name"), user.get("last_name"))))
+
+
+class UpdateFeed:
+    """Очередь обновлений для getUpdates: номера выдаются по порядку, offset подтверждает получение."""
+
+    def __init__(self):
+        self._updates = collections.deque()
+        self._next_id = 1
+        self._arrived = asyncio.Event()
+        self.pushed = 0
+        self.delivered = 0
+        self._delivered_upto = 0  # Наибольший update_id, уже выданный боту
+
+    def __len__(self):
+        return len(self._updates)
+
+    def push(self, update: dict):
+        update = dict(update, update_id=self._next_id)
+        self._next_id += 1
+        message = update.get("message")
+        if message is not None:
+            # Дата — момент выдачи, иначе записанный поток выглядел бы устаревшим
+            update["message"] = dict(message, date=int(time.time()))
+        self._updates.append(update)
+        self.pushed += 1
+        self._arrived.set()
+
+    async def get(self, offset: int, limit: int, timeout: float) -> tuple:
+        """Возвращает (обновления, впервые выданные из них)."""
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout > 0:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = list(itertools.islice(self._updates, limit))
+        fresh = [update for update in batch if update["update_id"] > self._delivered_upto]
+        if fresh:
+            self._delivered_upto = fresh[-1]["update_id"]
+            self.delivered += len(fresh)
+        return batch, fresh
+
+
+class ReactionTracker:
+    """
+    Сопоставляет запросы бота с выданными обновлениями. Отслеживаются входы в чат,
+    сообщения вошедших пользователей (ответы на капчу) и нажатия кнопок.
+    """
+
+    def __init__(self):
+        self._outstanding = collections.defaultdict(list)  # chat_id -> [ожидающие реакции записи]
+        self._callbacks = {}  # callback_query_id -> время выдачи
+        self._joined = set()  # (chat_id, user_id) вошедших пользователей
+        self._captchas = collections.defaultdict(list)  # chat_id -> записи входов одного пользователя без капчи
+        self.latencies = []
+
+    @property
+    def unanswered(self) -> int:
+        return sum(len(entries) for entries in self._outstanding.values()) + len(self._callbacks)
+
+    def delivered(self, update: dict, now: float):
+        callback = update.get("callback_query")
+        if callback is not None:
+            self._callbacks[callback["id"]] = now
+            return
+        message = update.get("message")
+        if message is None:
+            return
+        chat = message["chat"]
+        members = message.get("new_chat_members")
+        if members:
+            for user in members:
+                self._joined.add((chat["id"], user["id"]))
+            users = members
+        elif message.get("from") and (chat["id"], message["from"]["id"]) in self._joined:
+            users = [message["from"]]
+        else:
+            return
+        entry = {"at": now, "chat": chat, "message_id": message.get("message_id"), "users": users, "join": bool(members)}
+        self._outstanding[chat["id"]].append(entry)
+        if members and len(members) == 1:
+            self._captchas[chat["id"]].append(entry)
+
+    def _match(self, entries, params: dict):
+        """Индекс записи, к которой относится запрос: по участнику, по сообщению, на которое отвечает бот,
+        или по упоминанию в тексте. Запросы без таких признаков (например, удаление) не считаются реакцией."""
+        user_id = _int(params.get("user_id"))
+        if user_id is not None:
+            for index, entry in enumerate(entries):
+                if any(user["id"] == user_id for user in entry["users"]):
+                    return index
+            return None
+        reply = _json_param(params.get("reply_parameters")) or {}
+        reply_to = _int(reply.get("message_id") if isinstance(reply, dict) else None,
+                        _int(params.get("reply_to_message_id")))
+        if reply_to is not None:
+            for index, entry in enumerate(entries):
+                if entry["message_id"] == reply_to:
+                    return index
+        text = params.get("text") or params.get("caption")
+        if text:
+            for index, entry in enumerate(entries):
+                if any(display_name(user) in text for user in entry["users"]):
+                    return index
+        return None
+
+    def captcha(self, params: dict):
+        """Запись входа, капчей для которого стало сообщение с кнопками (по упоминанию пользователя), или None."""
+        chat_id = _int(params.get("chat_id"))
+        text = params.get("text") or params.get("caption")
+        entries = self._captchas.get(chat_id)
+        if not entries or not text or _json_param(params.get("reply_markup")) is None:
+            return None
+        for index, entry in enumerate(entries):
+            if display_name(entry["users"][0]) in text:
+                del entries[index]
+                if not entries:
+                    del self._captchas[chat_id]
+                return entry
+        return None
+
+    def request(self, params: dict, now: float):
+        """Запрос бота; возвращает запись обновления, на которое он стал реакцией, или None."""
+        callback_id = params.get("callback_query_id")
+        if callback_id is not None:
+            delivered_at = self._callbacks.pop(callback_id, None)
+            if delivered_at is not None:
+                self.latencies.append(now - delivered_at)
+            return None
+        chat_id = _int(params.get("chat_id"))
+        entries = self._outstanding.get(chat_id)
+        if not entries:
+            return None
+        index = self._match(entries, params)
+        if index is None:
+            return None
+        entry = entries.pop(index)
+        if not entries:
+            del self._outstanding[chat_id]
+        self.latencies.append(now - entry["at"])
+        return entry
+
+
+class BotApiServer:
+    """HTTP-сервер Bot API поверх FakeBotApi с очередью обновлений и статистикой запросов бота."""
+
+    def __init__(self, api: FakeBotApi, feed: UpdateFeed, press_rate: float = 0.0, press_delay: float = 1.0,
+                 seed=None):
+        self.api = api
+        self.feed = feed
+        self.tracker = ReactionTracker()
+        self.press_rate = press_rate
+        self.press_delay = press_delay
+        self.presses = 0
+        self._rng = random.Random(seed)
+        self._request_times = []  # monotonic-время запросов бота, кроме getUpdates
+        self._first_poll = asyncio.Event()
+        self._started = time.monotonic()
+        self._last_request = self._started
+        self._tasks = set()
+        self._runner = None
+
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._app = app
+
+    async def _params(self, request: web.Request) -> dict:
+        params = dict(request.query)
+        if request.method == "POST" and request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                # Файлы из multipart не нужны, остаются только поля формы
+                form = await request.post()
+                params.update({key: value for key, value in form.items() if isinstance(value, str)})
+        return params
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        try:
+            params = await self._params(request)
+        except (json.JSONDecodeError, ValueError):
+            return web.json_response({"ok": False, "error_code": 400, "description": "Bad Request: invalid body"},
+                                     status=400)
+        if method == "getUpdates":
+            return await self._get_updates(params)
+
+        now = time.monotonic()
+        self._request_times.append(now)
+        self._last_request = now
+        self.tracker.request(params, now)
+        status, payload = await self.api.call(method, params)
+        if status == 200:
+            # Бот может сначала ограничить вошедшего и только потом прислать капчу
+            entry = self.tracker.captcha(params)
+            if entry is not None:
+                self._maybe_press(entry, params, payload["result"])
+        return web.json_response(payload, status=status)
+
+    async def _get_updates(self, params: dict) -> web.Response:
+        self._first_poll.set()
+        error = self.api.injected_error("getUpdates")
+        if error is not None:
+            status, payload = error
+            return web.json_response(payload, status=status)
+        batch, fresh = await self.feed.get(
+            _int(params.get("offset"), 0), min(100, _int(params.get("limit"), 100)),
+            _int(params.get("timeout"), DEFAULT_POLL_TIMEOUT),
+        )
+        now = time.monotonic()
+        for update in fresh:
+            self.tracker.delivered(update, now)
+        return web.json_response({"ok": True, "result": batch})
+
+    def _maybe_press(self, entry: dict, params: dict, result):
+        """Нажимает кнопку капчи за вошедшего пользователя."""
+        markup = _json_param(params.get("reply_markup"))
+        if not isinstance(result, dict) or not isinstance(markup, dict) or self._rng.random() >= self.press_rate:
+            return
+        buttons = [button["callback_data"] for row in markup.get("inline_keyboard", ())
+                   for button in row if "callback_data" in button]
+        if not buttons:
+            return
+        update = {
+            "callback_query": {
+                "id": f"press-{self.presses}",
+                "from": entry["users"][0],
+                "chat_instance": str(entry["chat"]["id"]),
+                "data": self._rng.choice(buttons),
+                "message": {"message_id": result["message_id"], "date": int(time.time()), "chat": entry["chat"]},
+            },
+        }
+        self.presses += 1
+        self._spawn(self._press_later(update))
+
+    async def _press_later(self, update: dict):
+        await asyncio.sleep(self.press_delay)
+        self.feed.push(update)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def wait_for_bot(self):
+        await self._first_poll.wait()
+
+    def idle_for(self) -> float:
+        return time.monotonic() - self._last_request
+
+    def report(self) -> dict:
+        elapsed = time.monotonic() - self._started
+        per_second = collections.Counter(int(at - self._started) for at in self._request_times)
+        latencies = self.tracker.latencies
+        reaction = {"samples": len(latencies)}
+        if latencies:
+            reaction.update({
+                "mean_ms": sum(latencies) / len(latencies) * 1000,
+                "p50_ms": percentile(latencies, 0.5) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "max_ms": max(latencies) * 1000,
+            })
+        return {
+            "seconds": elapsed,
+            "updates": {"queued": self.feed.pushed, "delivered": self.feed.delivered,
+                        "unanswered": self.tracker.unanswered, "presses": self.presses},
+            "requests": dict(self.api.requests),
+            "requests_total": len(self._request_times),
+            "request_rate": len(self._request_times) / elapsed if elapsed else 0.0,
+            "request_rate_peak": max(per_second.values(), default=0),
+            "errors": {f"{method}:{status}": count for (method, status), count in self.api.errors.items()},
+            "reaction": reaction,
+        }
+
+    async def start(self, listen: str, port: int):
+        self._runner = web.AppRunner(self._app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, listen, port).start()
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def read_stream(path: str) -> list:
+    records = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                records.append((float(record.get("t", 0.0)), record["update"]))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+async def replay(feed: UpdateFeed, records: list, speed: float):
+    """Выдаёт обновления с интервалами из записи, ускоренными в speed раз."""
+    started = time.monotonic()
+    first = records[0][0] if records else 0.0
+    for at, update in records:
+        delay = (at - first) / speed - (time.monotonic() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        feed.push(update)
+
+
+async def serve(args):
+    api = FakeBotApi(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                     retry_rate=args.retry_rate, retry_after=args.retry_after, seed=args.seed)
+    feed = UpdateFeed()
+    server = BotApiServer(api, feed, args.press_rate, args.press_delay, seed=args.seed)
+    records = read_stream(args.replay) if args.replay else []
+    await server.start(args.listen, args.port)
+    print(f"Bot API: http://{args.listen}:{args.port}/bot, обновлений для проигрывания: {len(records)}",
+          file=sys.stderr)
+
+    async def progress():
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            report = server.report()
+            reaction = report["reaction"]
+            print(f"{report['seconds']:7.1f} с: запросов {report['requests_total']} "
+                  f"({report['request_rate']:.0f}/с), выдано {report['updates']['delivered']}/"
+                  f"{report['updates']['queued']}, реакция p50 {reaction.get('p50_ms', 0):.0f} мс "
+                  f"p99 {reaction.get('p99_ms', 0):.0f} мс", file=sys.stderr)
+
+    async def play():
+        await server.wait_for_bot()
+        await replay(feed, records, args.speed)
+        # После проигрывания ждём, пока бот не затихнет на --linger секунд (0 — до сигнала остановки)
+        while not args.linger or server.idle_for() < args.linger:
+            await asyncio.sleep(0.5)
+
+    progress_task = asyncio.create_task(progress())
+    tasks = {asyncio.create_task(play()), asyncio.create_task(wait_for_stop_signal())}
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks | {progress_task}:
+            task.cancel()
+        await server.stop()
+
+    text = json.dumps(server.report(), ensure_ascii=False, indent=2)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    print(text)
+
+
+async def record(args):
+    """Записывает обновления настоящего бота с отметками времени."""
+    import httpx
+
+    url = f"{args.base_url}{args.token}/getUpdates"
+    offset = None
+    count = 0
+    started = time.monotonic()
+    async with httpx.AsyncClient(timeout=args.poll_timeout + 10) as client:
+        with open(args.output, "a", encoding="utf-8") as file:
+            while not args.duration or time.monotonic() - started < args.duration:
+                params = {"timeout": args.poll_timeout, "allowed_updates": json.dumps(args.allowed_updates)}
+                if offset is not None:
+                    params["offset"] = offset
+                payload = (await client.post(url, data=params)).json()
+                if not payload.get("ok"):
+                    print(f"getUpdates: {payload.get('description')}", file=sys.stderr)
+                    await asyncio.sleep(payload.get("parameters", {}).get("retry_after", 1))
+                    continue
+                for update in payload["result"]:
+                    offset = update["update_id"] + 1
+                    file.write(json.dumps({"t": round(time.monotonic() - started, 3), "update": update},
+                                          ensure_ascii=False) + "\n")
+                    count += 1
+                file.flush()
+    print(f"Записано обновлений: {count}", file=sys.stderr)
+
+
+def synth(args):
+    """Рейд: входы по одному пользователю с постоянной частотой."""
+    rng = random.Random(args.seed)
+    chats = [-1005000000000 - i for i in range(args.chats)]
+    with open(args.output, "w", encoding="utf-8") as file:
+        for i in range(args.joins):
+            chat_id = rng.choice(chats)
+            user = make_user(6_000_000_000 + i)
+            update = {
+                "message": {
+                    "message_id": i + 1,
+                    "date": 0,
+                    "chat": make_chat(chat_id),
+                    "from": user,
+                    "new_chat_members": [user],
+                },
+            }
+            file.write(json.dumps({"t": round(i / args.rate, 4), "update": update}) + "\n")
+    print(f"Записано входов: {args.joins} за {args.joins / args.rate:.1f} с", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="запустить замену Bot API")
+    serve_parser.add_argument("--listen", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8081)
+    serve_parser.add_argument("--replay", help="JSONL-поток обновлений")
+    serve_parser.add_argument("--speed", type=float, default=1.0, help="ускорение проигрывания, раз")
+    serve_parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа на запрос, с")
+    serve_parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, до N с")
+    serve_parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 400 Bad Request")
+    serve_parser.add_argument("--retry-rate", type=float, default=0.0, help="доля ответов 429 RetryAfter")
+    serve_parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    serve_parser.add_argument("--press-rate", type=float, default=0.0, help="доля капч, кнопку которых нажать")
+    serve_parser.add_argument("--press-delay", type=float, default=1.0, help="через сколько секунд нажимать")
+    serve_parser.add_argument("--linger", type=float, default=10.0,
+                              help="завершиться после проигрывания, если бот молчит N с (0 — ждать Ctrl+C или SIGTERM)")
+    serve_parser.add_argument("--seed", type=int, default=0)
+    serve_parser.add_argument("--report", help="файл для JSON-отчёта (он же печатается в stdout)")
+
+    record_parser = commands.add_parser("record", help="записать обновления настоящего бота")
+    record_parser.add_argument("--token", required=True)
+    record_parser.add_argument("--base-url", default="https://api.telegram.org/bot")
+    record_parser.add_argument("--output", required=True)
+    record_parser.add_argument("--duration", type=float, default=0.0, help="сколько секунд записывать (0 — до Ctrl+C)")
+    record_parser.add_argument("--poll-timeout", type=int, default=30)
+    record_parser.add_argument("--allowed-updates", nargs="+",
+                               default=["message", "callback_query", "chat_member", "my_chat_member"])
+
+    synth_parser = commands.add_parser("synth", help="создать поток синтетического рейда")
+    synth_parser.add_argument("--joins", type=int, default=5000)
+    synth_parser.add_argument("--chats", type=int, default=1)
+    synth_parser.add_argument("--rate", type=float, default=500.0, help="входов в секунду")
+    synth_parser.add_argument("--seed", type=int, default=0)
+    synth_parser.add_argument("--output", required=True)
+
+    args = parser.parse_args()
+    try:
+        if args.command == "serve":
+            asyncio.run(serve(args))
+        elif args.command == "record":
+            asyncio.run(record(args))
+        else:
+            synth(args)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Поддельный Bot API для бенчмарков: отвечает на методы, которые вызывает Lyssa,
+с заданной задержкой и долей ошибок (400 Bad Request и 429 RetryAfter).
+FakeRequest подключает его к боту PTB без сети:
+
+    api = FakeBotApi(latency=0.02, error_rate=0.01)
+    ApplicationBuilder().token("123:bench").request(FakeRequest(api)).get_updates_request(FakeRequest(api))
+"""
+
+import asyncio
+import collections
+import json
+import random
+import time
+
+from telegram.request import BaseRequest
+
+BOT_ID = 123
+BOT_USER = {"id": BOT_ID, "is_bot": True, "first_name": "Lyssa", "username": "lyssa_bench_bot"}
+
+
+def make_user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def make_chat(chat_id: int) -> dict:
+    # Отрицательные идентификаторы — группы, положительные — личные чаты
+    if chat_id < 0:
+        return {"id": chat_id, "type": "supergroup", "title": f"chat{chat_id}"}
+    return {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"}
+
+
+def _int(value, default=0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class FakeBotApi:
+    """
+    Состояние поддельного Bot API: счётчики message_id по чатам и забаненные участники.
+    call() возвращает (HTTP-статус, тело ответа) так же, как настоящий сервер.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 retry_rate: float = 0.0, retry_after: int = 1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_rate = retry_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._message_ids = collections.defaultdict(int)  # chat_id -> последний message_id
+        self._banned = set()  # (chat_id, user_id)
+        self.requests = collections.Counter()  # метод -> количество запросов
+        self.errors = collections.Counter()  # (метод, статус) -> количество ошибок
+        self.handlers = {
+            "getMe": self._get_me,
+            "sendMessage": self._send_message,
+            "sendPhoto": self._send_message,
+            "editMessageText": self._edit_message,
+            "editMessageCaption": self._edit_message,
+            "editMessageReplyMarkup": self._edit_message,
+            "restrictChatMember": self._ok,
+            "banChatMember": self._ban_chat_member,
+            "unbanChatMember": self._unban_chat_member,
+            "deleteMessage": self._ok,
+            "deleteMessages": self._ok,
+            "answerCallbackQuery": self._ok,
+            "getChatMember": self._get_chat_member,
+            "getChatAdministrators": self._get_chat_administrators,
+            "setWebhook": self._ok,
+            "deleteWebhook": self._ok,
+        }
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.requests.values())
+
+    def reset_counters(self):
+        self.requests.clear()
+        self.errors.clear()
+
+    def _error(self, method: str, status: int, description: str, **parameters) -> tuple:
+        self.errors[(method, status)] += 1
+        payload = {"ok": False, "error_code": status, "description": description}
+        if parameters:
+            payload["parameters"] = parameters
+        return status, payload
+
+    def injected_error(self, method: str):
+        """Случайная ошибка по заданным долям или None."""
+        if method == "getMe":
+            return None
+        roll = self._rng.random()
+        if roll < self.retry_rate:
+            return self._error(method, 429, f"Too Many Requests: retry after {self.retry_after}",
+                               retry_after=self.retry_after)
+        if roll < self.retry_rate + self.error_rate:
+            return self._error(method, 400, "Bad Request: simulated error")
+        return None
+
+    async def call(self, method: str, params: dict) -> tuple:
+        self.requests[method] += 1
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        error = self.injected_error(method)
+        if error is not None:
+            return error
+        handler = self.handlers.get(method)
+        if handler is None:
+            return self._error(method, 404, "Not Found: method not found")
+        return 200, {"ok": True, "result": handler(params)}
+
+    def _ok(self, params):
+        return True
+
+    def _get_me(self, params):
+        return BOT_USER
+
+    def _message(self, chat_id: int, params: dict, message_id=None) -> dict:
+        if message_id is None:
+            self._message_ids[chat_id] += 1
+            message_id = self._message_ids[chat_id]
+        message = {"message_id": message_id, "date": int(time.time()), "chat": make_chat(chat_id), "from": BOT_USER}
+        if "text" in params:
+            message["text"] = params["text"]
+        if "photo" in params:
+            message["photo"] = [{"file_id": f"photo-{chat_id}-{message_id}", "file_unique_id": f"u{message_id}",
+                                 "width": 200, "height": 80}]
+            if "caption" in params:
+                message["caption"] = params["caption"]
+        return message
+
+    def _send_message(self, params):
+        return self._message(_int(params.get("chat_id")), params)
+
+    def _edit_message(self, params):
+        return self._message(_int(params.get("chat_id")), params, _int(params.get("message_id")))
+
+    def _ban_chat_member(self, params):
+        self._banned.add((_int(params.get("chat_id")), _int(params.get("user_id"))))
+        return True
+
+    def _unban_chat_member(self, params):
+        self._banned.discard((_int(params.get("chat_id")), _int(params.get("user_id"))))
+        return True
+
+    def _get_chat_member(self, params):
+        chat_id, user_id = _int(params.get("chat_id")), _int(params.get("user_id"))
+        if (chat_id, user_id) in self._banned:
+            return {"status": "kicked", "user": make_user(user_id), "until_date": 0}
+        return {"status": "member", "user": make_user(user_id)}
+
+    def _get_chat_administrators(self, params):
+        return [{"status": "administrator", "user": BOT_USER, "can_be_edited": False, "is_anonymous": False,
+                 "can_manage_chat": True, "can_delete_messages": True, "can_manage_video_chats": False,
+                 "can_restrict_members": True, "can_promote_members": False, "can_change_info": False,
+                 "can_invite_users": True, "can_post_stories": False, "can_edit_stories": False,
+                 "can_delete_stories": False}]
+
+
+class FakeRequest(BaseRequest):
+    """Транспорт PTB, который вместо HTTP вызывает FakeBotApi в том же процессе."""
+
+    def __init__(self, api: FakeBotApi):
+        self.api = api
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        # url вида https://api.telegram.org/bot<token>/<метод>
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        status, payload = await self.api.call(api_method, params)
+        return status, json.dumps(payload).encode()
@@ -0,0 +1,170 @@
+"""
+Локальная замена Redis для проверки RespBackend без настоящего сервера:
+asyncio-сервер протокола RESP2 с данными в памяти. Поддерживает только команды,
+которые использует хранилище состояния (PING, AUTH, SELECT, FLUSHDB, GET, SET, DEL,
+HSET, HGET, HDEL, HGETALL, HKEYS, SADD, SREM, SMEMBERS, SISMEMBER).
+
+Запуск: python benchmarks/resp_stub.py [--host 127.0.0.1] [--port 6399]
+Бот: LYSSA_STATE=redis://127.0.0.1:6399/0 python Lyssa.py
+"""
+
+import argparse
+import asyncio
+import threading
+
+
+class RespStub:
+    """Сервер-заглушка; базы — словари ключ -> bytes, dict или set."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6399):
+        self.host = host
+        self.port = port
+        self.databases = {}  # номер базы -> {ключ: значение}
+        self.commands = 0  # Сколько команд выполнено
+        self._server = None
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, Exception):
+            return b"-ERR %s\r\n" % str(value).encode()
+        if isinstance(value, str):
+            return b"+%s\r\n" % value.encode()
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        return b"*%d\r\n" % len(value) + b"".join(RespStub._encode(item) for item in value)
+
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # Inline-команда (например, из telnet)
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    def _typed(self, db, key, kind):
+        value = db.get(key)
+        if value is None:
+            value = db[key] = kind()
+        elif not isinstance(value, kind):
+            raise ValueError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def execute(self, db_index: int, args: list):
+        """Возвращает (ответ, новый номер базы)."""
+        self.commands += 1
+        name = args[0].upper().decode()
+        db = self.databases.setdefault(db_index, {})
+        if name == "PING":
+            return "PONG", db_index
+        if name == "AUTH":
+            return "OK", db_index
+        if name == "SELECT":
+            return "OK", int(args[1])
+        if name == "FLUSHDB":
+            db.clear()
+            return "OK", db_index
+        if name == "GET":
+            return db.get(args[1]), db_index
+        if name == "SET":
+            db[args[1]] = args[2]
+            return "OK", db_index
+        if name == "DEL":
+            return sum(db.pop(key, None) is not None for key in args[1:]), db_index
+        if name == "HSET":
+            fields = self._typed(db, args[1], dict)
+            pairs = list(zip(args[2::2], args[3::2]))
+            added = sum(field not in fields for field, _ in pairs)
+            fields.update(pairs)
+            return added, db_index
+        if name == "HGET":
+            return self._typed(db, args[1], dict).get(args[2]), db_index
+        if name == "HDEL":
+            fields = self._typed(db, args[1], dict)
+            return sum(fields.pop(field, None) is not None for field in args[2:]), db_index
+        if name == "HGETALL":
+            fields = self._typed(db, args[1], dict)
+            return [item for pair in fields.items() for item in pair], db_index
+        if name == "HKEYS":
+            return list(self._typed(db, args[1], dict)), db_index
+        if name == "SADD":
+            members = self._typed(db, args[1], set)
+            before = len(members)
+            members.update(args[2:])
+            return len(members) - before, db_index
+        if name == "SREM":
+            members = self._typed(db, args[1], set)
+            before = len(members)
+            members.difference_update(args[2:])
+            return before - len(members), db_index
+        if name == "SMEMBERS":
+            return list(self._typed(db, args[1], set)), db_index
+        if name == "SISMEMBER":
+            return int(args[2] in self._typed(db, args[1], set)), db_index
+        return ValueError(f"unknown command '{name}'"), db_index
+
+    async def _handle(self, reader, writer):
+        db_index = 0
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if not args:
+                    continue
+                try:
+                    reply, db_index = self.execute(db_index, args)
+                except (ValueError, IndexError) as e:
+                    reply = e
+                writer.write(self._encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self) -> "RespStub":
+        """Запускает сервер в фоновом потоке (для бенчмарков); port=0 — любой свободный порт."""
+        started = threading.Event()
+
+        async def run():
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            await self._server.serve_forever()
+
+        threading.Thread(target=asyncio.run, args=(run(),), name="resp-stub", daemon=True).start()
+        started.wait()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+
+    stub = RespStub(args.host, args.port)
+    print(f"RESP-заглушка слушает {args.host}:{args.port}")
+    try:
+        asyncio.run(stub.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Нагрузочный отправитель для режима вебхука: вместо Telegram шлёт синтетические
+обновления (сообщения в группах) на локальный вебхук и замеряет задержку ответа.
+
+Бот запускается с WEBHOOK_URL, указывающим на локальный адрес, например:
+    WEBHOOK_URL=http://127.0.0.1:8443/telegram python Lyssa.py
+Запуск: python benchmarks/webhook_sender.py [--url http://127.0.0.1:8443/telegram]
+        [--updates 10000] [--concurrency 50] [--chats 100] [--rate 0] [--secret ...]
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def make_update(update_id, chat_id, user_id, message_id):
+    """Обычное текстовое сообщение в супергруппе."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"chat {chat_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": "привет",
+        },
+    }
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def send_all(args):
+    rng = random.Random(0)
+    chats = [-1001000000000 - i for i in range(args.chats)]
+    update_ids = itertools.count(1)
+    message_ids = itertools.count(1)
+    headers = {SECRET_HEADER: args.secret} if args.secret else {}
+    latencies = []
+    statuses = Counter()
+    queue = asyncio.Queue()
+    for _ in range(args.updates):
+        queue.put_nowait(make_update(next(update_ids), rng.choice(chats), rng.randint(1, 10_000_000),
+                                     next(message_ids)))
+    interval = 1 / args.rate if args.rate else 0.0
+    next_send = [time.perf_counter()]
+
+    async def worker(client):
+        while not queue.empty():
+            update = queue.get_nowait()
+            if interval:
+                # Равномерный темп отправки на все воркеры
+                at = next_send[0] = max(next_send[0] + interval, time.perf_counter())
+                await asyncio.sleep(max(0.0, at - time.perf_counter()))
+            started = time.perf_counter()
+            try:
+                response = await client.post(args.url, json=update, headers=headers)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("WEBHOOK_URL", "http://127.0.0.1:8443/telegram"),
+                        help="адрес вебхука бота")
+    parser.add_argument("--updates", type=int, default=10_000, help="количество обновлений")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных запросов")
+    parser.add_argument("--chats", type=int, default=100, help="количество групп")
+    parser.add_argument("--rate", type=float, default=0, help="обновлений в секунду (0 — без ограничения)")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"), help="секрет вебхука")
+    args = parser.parse_args()
+
+    latencies, statuses, elapsed = asyncio.run(send_all(args))
+    print(f"url={args.url} updates={args.updates} concurrency={args.concurrency} chats={args.chats}")
+    print(f"ответы: {dict(statuses)}")
+    print(f"пропускная способность: {len(latencies) / elapsed:.0f} обновлений/с за {elapsed:.2f} с")
+    if latencies:
+        print(f"задержка, мс: p50={percentile(latencies, 0.5) * 1000:.2f} "
+              f"p99={percentile(latencies, 0.99) * 1000:.2f} "
+              f"среднее={statistics.fmean(latencies) * 1000:.2f} макс={max(latencies) * 1000:.2f}")
+
+
+if __name__ == "__main__":
+    main()
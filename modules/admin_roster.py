@@ -0,0 +1,122 @@
+# modules/admin_roster.py
+
+import asyncio
+import logging
+import time
+from telegram import Update
+from telegram.ext import ContextTypes
+from config import DEFAULT_CONFIG, get_config
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = ("administrator", "creator")
+
+# Сколько секунд помнить неудачную загрузку списка, прежде чем запросить его снова
+FAILURE_TTL = 5.0
+
+
+class AdminRoster:
+    """
+    Списки администраторов по чатам, загружаемые одним get_chat_administrators.
+    Обновляются по событиям ChatMemberUpdated и перечитываются по истечении ttl.
+    """
+
+    def __init__(self, ttl: float = 600.0, concurrency: int = 10):
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self._rosters = {}  # chat_id -> (время истечения, {user_id: статус})
+        self._loading = {}  # chat_id -> asyncio.Task загрузки списка
+        self._warm_task = None
+
+    def __contains__(self, chat_id: int):
+        return chat_id in self._rosters
+
+    def status(self, chat_id: int, user_id: int):
+        """Возвращает статус администратора из памяти или None."""
+        entry = self._rosters.get(chat_id)
+        return entry[1].get(user_id) if entry else None
+
+    async def _load(self, bot, chat_id: int) -> dict:
+        ttl = self.ttl
+        try:
+            admins = await bot.get_chat_administrators(chat_id)
+            roster = {admin.user.id: admin.status for admin in admins}
+        except Exception as e:
+            # Пустой список кэшируем ненадолго: запрос не повторяется на каждую команду,
+            # но администраторы не теряют права на весь ttl из-за одной сетевой ошибки
+            logger.error(f"Не удалось загрузить администраторов чата {chat_id}: {e}")
+            roster = {}
+            ttl = min(ttl, FAILURE_TTL)
+        self._rosters[chat_id] = (time.monotonic() + ttl, roster)
+        return roster
+
+    async def get(self, bot, chat_id: int) -> dict:
+        """Возвращает {user_id: статус} администраторов чата, загружая список при необходимости."""
+        entry = self._rosters.get(chat_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        # Одновременные запросы одного чата ждут одну загрузку
+        task = self._loading.get(chat_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(bot, chat_id))
+            self._loading[chat_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(chat_id, None))
+        return await asyncio.shield(task)
+
+    async def warm(self, bot, chat_ids):
+        """Загружает списки администраторов нескольких чатов параллельно."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def load(chat_id):
+            async with semaphore:
+                await self.get(bot, chat_id)
+
+        chat_ids = list(chat_ids)
+        started = time.monotonic()
+        await asyncio.gather(*(load(chat_id) for chat_id in chat_ids))
+        logger.info(f"Загружены администраторы {len(chat_ids)} чатов за {time.monotonic() - started:.2f} с.")
+
+    def start(self, bot, chat_ids):
+        """Загружает списки администраторов в фоне, не задерживая запуск (нужен запущенный event loop)."""
+        if self._warm_task is None or self._warm_task.done():
+            self._warm_task = asyncio.create_task(self.warm(bot, chat_ids), name="admin-roster-warm")
+
+    async def stop(self):
+        """Отменяет фоновую загрузку и незавершённые запросы списков."""
+        tasks = list(self._loading.values())
+        if self._warm_task is not None:
+            tasks.append(self._warm_task)
+            self._warm_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def apply(self, chat_id: int, member):
+        """Обновляет список по новому статусу участника."""
+        entry = self._rosters.get(chat_id)
+        if entry is None:
+            return
+        if member.status in ADMIN_STATUSES:
+            entry[1][member.user.id] = member.status
+        else:
+            entry[1].pop(member.user.id, None)
+
+    def discard(self, chat_id: int):
+        """Забывает список чата, например когда бота удалили из него."""
+        self._rosters.pop(chat_id, None)
+
+
+admin_roster = AdminRoster(ttl=get_config().get("admin_roster_ttl", DEFAULT_CONFIG["admin_roster_ttl"]))
+
+
+async def track_admin_changes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поддерживает списки администраторов в актуальном состоянии по ChatMemberUpdated."""
+    change = update.chat_member or update.my_chat_member
+    if not change:
+        return
+    member = change.new_chat_member
+    if update.my_chat_member and member.status in ("left", "kicked"):
+        admin_roster.discard(change.chat.id)
+    else:
+        admin_roster.apply(change.chat.id, member)
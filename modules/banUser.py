@@ -2,16 +2,26 @@
 
 import logging
 import datetime
-import asyncio
 from telegram import Update
 from telegram.ext import ContextTypes
-from config import save_config, load_config  # Импортируем из config.py
+from config import DEFAULT_CONFIG, get_config  # Импортируем из config.py
+from chat_config import get_chat_config, set_chat_config
+from member_cache import member_cache
+from kick_pipeline import KickPipeline
 from lock import has_permission
+from metrics import instrument
 
 logger = logging.getLogger(__name__)
 
 # Значение по умолчанию для 'banUsers'
-DEFAULT_BAN_USERS = False  # False: кикать, True: банить
+DEFAULT_BAN_USERS = DEFAULT_CONFIG["banUsers"]  # False: кикать, True: банить
+
+# Срок временного бана при кике. Telegram считает бан короче 30 секунд вечным,
+# поэтому срок берётся с запасом: если бот упадёт до разбана, бан снимется сам.
+KICK_BAN_DURATION = 60
+
+# Отложенные разбаны для режима кика
+kick_pipeline = KickPipeline(delay=get_config().get("kick_unban_delay", DEFAULT_CONFIG["kick_unban_delay"]))
 
 async def set_ban_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -41,14 +51,8 @@ async def set_ban_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     mode = arg == 'true'
 
     try:
-        # Загружаем текущую конфигурацию
-        config = load_config()
-
-        # Устанавливаем режим
-        config['banUsers'] = mode
-
-        # Сохраняем обновлённую конфигурацию
-        save_config(config)
+        # Устанавливаем режим для этого чата
+        set_chat_config(update.effective_chat.id, banUsers=mode)
 
         # Определяем строковое представление режима
         mode_str = 'банить' if mode else 'кикать'
@@ -62,24 +66,24 @@ async def set_ban_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при установке режима бана: {e}")
         await update.message.reply_text("Произошла ошибка при изменении режима. Пожалуйста, попробуйте позже.")
 
+@instrument
 async def ban_or_kick_user(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int):
+    ban_mode = get_chat_config(chat_id).get('banUsers', DEFAULT_BAN_USERS)
     try:
-        config = load_config()
-        ban_mode = config.get('banUsers', DEFAULT_BAN_USERS)
-
         if ban_mode:
+            kick_pipeline.cancel(chat_id, user_id)
             await context.bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
             logger.info(f"Пользователь {user_id} забанен в чате {chat_id}.")
         else:
-            until_date = int(datetime.datetime.utcnow().timestamp()) + 5
+            until_date = int(datetime.datetime.now(datetime.timezone.utc).timestamp()) + KICK_BAN_DURATION
             await context.bot.ban_chat_member(chat_id=chat_id, user_id=user_id, until_date=until_date)
             logger.info(f"Пользователь {user_id} временно забанен для кика из чата {chat_id}.")
-            await asyncio.sleep(6)  # Увеличьте время ожидания до 6 секунд
-            await context.bot.unban_chat_member(chat_id=chat_id, user_id=user_id)
-            logger.info(f"Временный бан снят, пользователь {user_id} кикнут из чата {chat_id}.")
+            # Разбан выполнит фоновая задача, хендлер не ждёт
+            kick_pipeline.schedule(chat_id, user_id)
 
     except Exception as e:
-        config = load_config()
-        ban_mode = config.get('banUsers', DEFAULT_BAN_USERS)
         action = 'забанить' if ban_mode else 'кикнуть'
-        logger.error(f"Ошибка при попытке {action} пользователя {user_id} в чате {chat_id}: {e}")
\ No newline at end of file
+        logger.error(f"Ошибка при попытке {action} пользователя {user_id} в чате {chat_id}: {e}")
+    finally:
+        # Статус участника изменился, кэшированная запись больше не актуальна
+        member_cache.invalidate(chat_id, user_id)
\ No newline at end of file
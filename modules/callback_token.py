@@ -0,0 +1,106 @@
+# modules/callback_token.py
+
+import base64
+import functools
+import hashlib
+import hmac
+import os
+import struct
+import time
+from typing import NamedTuple
+
+# Подписанные callback_data начинаются с этого префикса
+CALLBACK_PREFIX = "~"
+
+# Типы капч в токене
+CAPTCHA_TYPE_CODES = {"button": 0, "math": 1, "fruits": 2, "image": 3, "batch": 4}
+CAPTCHA_TYPE_NAMES = {code: name for name, code in CAPTCHA_TYPE_CODES.items()}
+
+# Тип, chat_id, user_id, (длина кода << 4 | шаг), срок действия, nonce, замаскированное значение
+_PAYLOAD = struct.Struct(">BqqBIHB")
+TAG_SIZE = 10  # Байт усечённого HMAC-SHA256
+
+# Запас к сроку действия кнопки сверх времени на капчу
+EXPIRY_GRACE = 30
+
+
+class CallbackToken(NamedTuple):
+    captcha_type: str
+    chat_id: int
+    user_id: int
+    step: int  # Шаг image капчи (номер вводимого символа)
+    length: int  # Длина кода image капчи
+    expires: int  # Unix-время, после которого кнопка недействительна
+    value: int  # 1/0 — верный/неверный ответ; для image — битовая маска позиций символа в коде
+
+
+@functools.lru_cache(maxsize=1)
+def _secret() -> bytes:
+    """
+    Ключ подписи: CALLBACK_SECRET или производный от токена бота,
+    одинаковый во всех процессах одного бота.
+    """
+    secret = os.getenv("CALLBACK_SECRET")
+    if secret:
+        return secret.encode()
+    return hashlib.sha256(b"lyssa-callback:" + os.getenv("TELEGRAM_BOT_TOKEN", "").encode()).digest()
+
+
+def _mask(header: bytes) -> int:
+    # Значение маскируется, чтобы по callback_data нельзя было отличить верную кнопку от неверной
+    return hmac.new(_secret(), b"m" + header, hashlib.sha256).digest()[0]
+
+
+def sign_callback(captcha_type: str, chat_id: int, user_id: int, value: int, expires: int,
+                  step: int = 0, length: int = 0) -> str:
+    """Возвращает подписанную callback_data (не длиннее 64 байт)."""
+    nonce = int.from_bytes(os.urandom(2), "big")
+    header = _PAYLOAD.pack(CAPTCHA_TYPE_CODES[captcha_type], chat_id, user_id, (length << 4) | step,
+                           expires, nonce, 0)[:-1]
+    payload = header + bytes([value ^ _mask(header)])
+    tag = hmac.new(_secret(), payload, hashlib.sha256).digest()[:TAG_SIZE]
+    return CALLBACK_PREFIX + base64.urlsafe_b64encode(payload + tag).rstrip(b"=").decode()
+
+
+def is_signed(data: str) -> bool:
+    return bool(data) and data.startswith(CALLBACK_PREFIX)
+
+
+def verify_callback(data: str, chat_id: int, user_id: int, now: float = None):
+    """
+    Проверяет подпись, срок действия, чат и адресата кнопки без обращения к состоянию бота.
+    Возвращает (CallbackToken, None) или (None, текст ошибки для пользователя).
+    """
+    encoded = data[len(CALLBACK_PREFIX):]
+    try:
+        raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+    except (ValueError, TypeError):
+        return None, "Кнопка недействительна."
+    payload, tag = raw[:-TAG_SIZE], raw[-TAG_SIZE:]
+    if len(payload) != _PAYLOAD.size or not hmac.compare_digest(
+            tag, hmac.new(_secret(), payload, hashlib.sha256).digest()[:TAG_SIZE]):
+        return None, "Кнопка недействительна."
+
+    type_code, token_chat, token_user, step_byte, expires, _, masked = _PAYLOAD.unpack(payload)
+    if token_chat != chat_id or type_code not in CAPTCHA_TYPE_NAMES:
+        return None, "Кнопка недействительна."
+    if token_user != user_id:
+        return None, "Эта кнопка предназначена другому пользователю."
+    if (time.time() if now is None else now) > expires:
+        return None, "Время на прохождение капчи истекло."
+
+    token = CallbackToken(
+        captcha_type=CAPTCHA_TYPE_NAMES[type_code],
+        chat_id=token_chat,
+        user_id=token_user,
+        step=step_byte & 0x0F,
+        length=step_byte >> 4,
+        expires=expires,
+        value=masked ^ _mask(payload[:-1]),
+    )
+    return token, None
+
+
+def callback_expiry(time_limit: int) -> int:
+    """Срок действия кнопок капчи с заданным временем на прохождение."""
+    return int(time.time()) + time_limit + EXPIRY_GRACE
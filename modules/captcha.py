@@ -2,14 +2,28 @@
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import ContextTypes
+import asyncio
 import logging
 import random
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
-import string
-import io
+import time
 from lock import has_permission
 from banUser import ban_or_kick_user  # Корректный импорт
-from config import load_config, save_config
+from config import DEFAULT_CONFIG, get_config
+from captcha_pool import CaptchaPool
+from captcha_image import image_extension, render_captcha
+from renderer import CaptchaRenderer
+from media_cache import send_cached_photo
+from chat_config import get_chat_config, set_chat_config
+from member_cache import get_chat_member, member_cache
+from delete_batcher import delete_batcher
+from outbound import outbound_scheduler
+from deadlines import DeadlineScheduler
+from shared_state import pending_store, verified_users
+from pending import PendingCaptcha
+from pending_filter import PendingCaptchas, PendingUsersFilter
+from callback_token import callback_expiry, is_signed, sign_callback, verify_callback
+from metrics import (captcha_render_seconds, captcha_solve_seconds, captchas_failed, captchas_issued,
+                     captchas_passed, instrument)
 
 logger = logging.getLogger(__name__)
 
@@ -21,109 +35,98 @@ ALL_FRUITS = [
     "🥥", "🍅"
 ]
 
-# Конфигурация капчи по умолчанию
-DEFAULT_CONFIG = {
-    "captcha_type": "button",  # Возможные: button, math, fruits, image
-    "time_limit": 60,  # Время на прохождение капчи в секундах
-    "custom_captcha_message": "Пожалуйста, подтвердите, что вы не бот!",
-    "button_text": "Я не бот!",
-    "banUsers": False   # False: кикать, True: банить
-}
-
-CONFIG_FILE = "lyssa_config.json"
+# Хранилище для капч; verified_users — (chat_id, user_id) прошедших капчу, из shared_state
+# Фильтр для handle_text_messages: пропускает только тех, кто должен ответить на капчу текстом
+pending_users = PendingUsersFilter()
+pending_captchas = PendingCaptchas(pending_users)  # (chat_id, user_id) -> PendingCaptcha
+batch_captcha_buttons = {}  # (chat_id, message_id) общей капчи -> {user_id: кнопка} ещё не прошедших
+_overdue_task = None  # фоновая обработка просроченных после перезапуска капч
 
-# Инициализация конфигурации
-bot_config = load_config()
-# Хранилище для капч
-verified_users = set()
-user_math_captcha = {}  # Для math-капчи
-user_captcha_code = {}  # Для image-капчи
-captcha_jobs = {}  # Для отслеживания задач по капчам
-user_captcha_messages = {}  # Для отслеживания message_id капчи и предупреждений
 
+# Таймеры предупреждений и киков, ключ — (chat_id, user_id)
+captcha_deadlines = DeadlineScheduler()
 
-def generate_captcha_code(length=5):
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choices(characters, k=length))
+# Отрисовка image-капч в пуле процессов
+captcha_renderer = CaptchaRenderer(
+    workers=get_config().get("render_workers", DEFAULT_CONFIG["render_workers"]),
+    max_queue=get_config().get("render_queue_depth", DEFAULT_CONFIG["render_queue_depth"]),
+)
 
 
-def generate_captcha_image(
-        text,
-        font_path='Fonts/arial.ttf',  # Убедитесь, что путь к шрифту корректен
-        size=(200, 80),  # Передаем размеры изображения как параметр
-        noise_points=50,
-        blur_intensity=0
-):
-    width, height = size  # Используем переданный параметр size
-    background_color = (255, 255, 255)
-    font_size = 36
+# Seed примера image-капчи: пример всегда одинаковый, поэтому загружается в Telegram один раз
+EXAMPLE_CAPTCHA_SEED = 0
 
-    # Создаём новое изображение
-    image = Image.new('RGB', (width, height), background_color)
-    draw = ImageDraw.Draw(image)
 
-    # Загружаем шрифт
+async def render_image_captcha(seed=None):
+    """Отрисовывает image-капчу в пуле процессов с текущими настройками кодирования."""
+    config = get_config()
+    started = time.perf_counter()
     try:
-        font = ImageFont.truetype(font_path, font_size)
-    except IOError:
-        font = ImageFont.load_default()
-        logger.warning("Шрифт не найден. Используется стандартный шрифт.")
-
-    # Добавляем текст на изображение
-    text_color = (random.randint(0, 100), random.randint(0, 100), random.randint(0, 100))
-    bbox = font.getbbox(text)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-
-    text_x = (width - text_width) // 2
-    text_y = (height - text_height) // 2
-    draw.text((text_x, text_y), text, font=font, fill=text_color)
-
-    # Добавляем случайные линии для усложнения капчи
-    for _ in range(5):
-        start = (random.randint(0, width), random.randint(0, height))
-        end = (random.randint(0, width), random.randint(0, height))
-        line_color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
-        draw.line([start, end], fill=line_color, width=2)
-
-    # Добавляем шум
-    for _ in range(noise_points):
-        x = random.randint(0, width)
-        y = random.randint(0, height)
-        draw.point((x, y), fill=(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
-
-    # Применяем фильтр размытия
-    for _ in range(blur_intensity):
-        image = image.filter(ImageFilter.BLUR)
-
-    # Сохраняем изображение в байтовый поток
-    byte_io = io.BytesIO()
-    image.save(byte_io, 'PNG')
-    byte_io.seek(0)
-
-    return byte_io
-
-
-async def handle_failed_captcha(context: ContextTypes.DEFAULT_TYPE):
+        return await captcha_renderer.render(
+            render_captcha,
+            config.get("captcha_image_format", DEFAULT_CONFIG["captcha_image_format"]),
+            config.get("captcha_image_quality", DEFAULT_CONFIG["captcha_image_quality"]),
+            config.get("captcha_png_compress_level", DEFAULT_CONFIG["captcha_png_compress_level"]),
+            config.get("captcha_palette_colors", DEFAULT_CONFIG["captcha_palette_colors"]),
+            seed,
+        )
+    finally:
+        captcha_render_seconds.observe(time.perf_counter() - started)
+
+
+# Пул заранее отрисованных image-капч, запускается из Lyssa.post_init
+captcha_pool = CaptchaPool(
+    render_image_captcha,
+    size=get_config().get("captcha_pool_size", DEFAULT_CONFIG["captcha_pool_size"]),
+    low_water=get_config().get("captcha_pool_low_water", DEFAULT_CONFIG["captcha_pool_low_water"]),
+)
+
+
+def _record_passed(chat_id: int, user_id: int):
+    """Учитывает пройденную капчу в метриках."""
+    pending = pending_captchas.get((chat_id, user_id))
+    captcha_type = pending.captcha_type if pending is not None else "unknown"
+    captchas_passed.inc(captcha_type, chat_id)
+    if pending is not None and pending.issued_at:
+        captcha_solve_seconds.observe(time.time() - pending.issued_at, captcha_type)
+
+
+def _record_failed(chat_id: int, user_id: int, reason: str):
+    """Учитывает непройденную капчу в метриках (reason: timeout или wrong)."""
+    pending = pending_captchas.get((chat_id, user_id))
+    captchas_failed.inc(pending.captcha_type if pending is not None else "unknown", chat_id, reason)
+
+
+async def finish_failed_captcha(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, reason: str):
+    """
+    Завершает непройденную капчу (reason: timeout или wrong): учитывает её в метриках,
+    снимает таймеры, удаляет запись из журнала и из памяти и убирает сообщения капчи.
+    """
+    key = (chat_id, user_id)
+    if key in pending_captchas:
+        # Повторное неверное нажатие после завершения капчи не считается ещё одной неудачей
+        _record_failed(chat_id, user_id, reason)
+    captcha_deadlines.cancel(key)
+    pending_store.done(chat_id, user_id)
+    pending = pending_captchas.pop(key, None)
+    if pending is not None:
+        await delete_captcha_messages(context, pending)
+
+
+async def handle_failed_captcha(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int):
     """
     Обрабатывает неудачную попытку прохождения капчи.
     """
-    data = context.job.data
-    chat_id = data["chat_id"]
-    user_id = data["user_id"]
+    await finish_failed_captcha(context, chat_id, user_id, "timeout")
 
-    config = load_config()
-    ban_mode = config.get('banUsers', DEFAULT_CONFIG["banUsers"])  # Используем прямой доступ
+    ban_mode = get_chat_config(chat_id).get('banUsers', DEFAULT_CONFIG["banUsers"])
 
     # Логируем неудачную попытку
     logger.info(f"Пользователь {user_id} не прошёл капчу.")
 
-    # Вызываем функцию ban_or_kick_user из banUser.py
-    await ban_or_kick_user(context, chat_id, user_id)
-
-    # Получаем информацию о пользователе для уведомления
+    # Получаем информацию о пользователе для уведомления (до бана, пока запись в кэше актуальна)
     try:
-        user = await context.bot.get_chat_member(chat_id, user_id)
+        user = await get_chat_member(context, chat_id, user_id)
         user_full_name = user.user.full_name
 
         mention = f"@{user.user.username}" if user.user.username else user_full_name
@@ -131,14 +134,22 @@ async def handle_failed_captcha(context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Не удалось получить информацию о пользователе {user_id}: {e}")
         mention = f"Пользователь {user_id}"
 
+    # Вызываем функцию ban_or_kick_user из banUser.py
+    await ban_or_kick_user(context, chat_id, user_id)
+
     await context.bot.send_message(
         chat_id=chat_id,
         text=f"Пользователь {mention} не прошёл капчу и был{' забанен' if ban_mode else ' кикнут'}.",
     )
 
 
-async def restrict_user(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int):
-    """Ограничивает права пользователя на время прохождения капчи."""
+@instrument
+async def restrict_user(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, pending=None) -> bool:
+    """
+    Ограничивает права пользователя на время прохождения капчи.
+    Капча (pending или новая button-капча) попадает в pending_captchas и фильтр ожидающих только
+    после успешного ограничения; при ошибке возвращает False и ничего не сохраняет.
+    """
     try:
         await context.bot.restrict_chat_member(
             chat_id=chat_id,
@@ -154,47 +165,133 @@ async def restrict_user(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_i
         logger.info(f"Права пользователя {user_id} успешно ограничены.")
     except Exception as e:
         logger.error(f"Не удалось ограничить права пользователя {user_id}: {e}")
-        return
+        return False
+    finally:
+        member_cache.invalidate(chat_id, user_id)
 
-    config = load_config()
-    time_limit = config.get("time_limit", DEFAULT_CONFIG["time_limit"])
+    # Сохраняем состояние капчи (журнал или общее хранилище), чтобы восстановить его после перезапуска
+    if pending is None:
+        pending = PendingCaptcha(chat_id, user_id, "button")
+    pending_captchas[pending.key] = pending
+    captchas_issued.inc(pending.captcha_type, chat_id)
+    # Сообщение капчи ещё не отправлено и может ждать лимита сообщений чата
+    arm_captcha_deadlines(pending, outbound_scheduler.chat_delay(chat_id))
+    return True
 
-    # Удаляем старые задания
-    if user_id in captcha_jobs:
-        for job in captcha_jobs[user_id].values():
-            job.schedule_removal()
-        captcha_jobs.pop(user_id, None)
 
-    if not context.job_queue:
-        logger.error("Job queue не инициализирована.")
-        return
+def arm_captcha_deadlines(pending: PendingCaptcha, delay: float = 0.0):
+    """
+    Взводит предупреждение и кик, отсчитывая время на капчу через delay секунд, и записывает капчу в журнал.
+    Вызывается при ограничении прав (delay — ожидаемое ожидание сообщения капчи в очереди чата)
+    и ещё раз, когда сообщение отправлено: время на ответ считается с момента, когда капча видна.
+    """
+    chat_id, user_id = pending.key
+    time_limit = get_chat_config(chat_id).get("time_limit", DEFAULT_CONFIG["time_limit"])
+
+    # Таймеры того же ключа заменяются, старые задания удалять отдельно не нужно
+    key = pending.key
+
+    # Запланировать предупреждение
+    warning_time = time_limit // 2
+    captcha_deadlines.schedule(key, "warning", delay + warning_time, send_warning, chat_id, user_id)
+    logger.info(f"Предупреждение для пользователя {user_id} запланировано через {delay + warning_time:.0f} секунд.")
+
+    # Запланировать кик
+    captcha_deadlines.schedule(key, "kick", delay + time_limit, handle_failed_captcha, chat_id, user_id)
+    logger.info(f"Кик для пользователя {user_id} запланирован через {delay + time_limit:.0f} секунд.")
 
+    now = time.time() + delay
+    pending.issued_at = now
+    pending.deadline = now + time_limit
+    pending.warn_at = now + warning_time
+    pending_store.start(chat_id, user_id, **pending.to_record())
+
+
+async def deliver_captcha(context: ContextTypes.DEFAULT_TYPE, pending: PendingCaptcha, send):
+    """
+    Ограничивает права пользователя, затем отправляет сообщение капчи:
+    send(expires) возвращает корутину отправки с кнопками, подписанными до expires.
+    Ограничение идёт первым: во время рейда текст капчи может минутами ждать лимита сообщений чата,
+    а новичок всё это время не должен писать в чат. Если ограничить не удалось, капча не отправляется;
+    если не отправилось сообщение, ограничение снимается.
+    """
+    chat_id, user_id = pending.key
+    if not await restrict_user(context, chat_id, user_id, pending):
+        return
+    # Время на капчу считается с отправки сообщения, поэтому к сроку кнопок добавляется ожидание очереди чата
+    time_limit = get_chat_config(chat_id).get("time_limit", DEFAULT_CONFIG["time_limit"])
+    expires = callback_expiry(time_limit + int(outbound_scheduler.chat_delay(chat_id)))
     try:
-        # Запланировать предупреждение
-        warning_time = time_limit // 2
-        job_warning = context.job_queue.run_once(
-            callback=send_warning,
-            when=warning_time,
-            data={"chat_id": chat_id, "user_id": user_id},
-            name=f"warning_{user_id}"
-        )
-        logger.info(f"Предупреждение для пользователя {user_id} запланировано через {warning_time} секунд.")
-
-        # Запланировать кик
-        job_kick = context.job_queue.run_once(
-            callback=handle_failed_captcha,
-            when=time_limit,
-            data={"chat_id": chat_id, "user_id": user_id},
-            name=f"kick_{user_id}"
-        )
-        logger.info(f"Кик для пользователя {user_id} запланирован через {time_limit} секунд.")
+        message = await send(expires)
+    except Exception:
+        await cancel_captcha_jobs(context, user_id, chat_id)
+        raise
+    if pending_captchas.get(pending.key) is not pending:
+        # Капча завершилась (пользователь вышел), пока сообщение ждало своей очереди
+        delete_batcher.delete(chat_id, message.message_id)
+        return
+    pending.captcha_message_id = message.message_id
+    arm_captcha_deadlines(pending)
 
-        captcha_jobs[user_id] = {
-            'warning': job_warning,
-            'kick': job_kick,
-        }
-    except Exception as e:
-        logger.error(f"Ошибка при планировании задач для пользователя {user_id}: {e}")
+
+async def _process_overdue(context: ContextTypes.DEFAULT_TYPE, overdue: list):
+    """Обрабатывает пачку пользователей, время капчи которых истекло, пока бот был остановлен."""
+    semaphore = asyncio.Semaphore(get_config().get("join_concurrency", DEFAULT_CONFIG["join_concurrency"]))
+
+    async def process(chat_id, user_id):
+        async with semaphore:
+            try:
+                await handle_failed_captcha(context, chat_id, user_id)
+            except Exception as e:
+                logger.error(f"Не удалось обработать просроченную капчу пользователя {user_id}: {e}")
+
+    await asyncio.gather(*(process(chat_id, user_id) for chat_id, user_id in overdue))
+    logger.info(f"Обработано просроченных капч: {len(overdue)}.")
+
+
+def recover_pending_captchas(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Восстанавливает незавершённые капчи из журнала или общего хранилища после перезапуска:
+    пересчитывает сроки, заново взводит таймеры и запускает обработку просроченных пользователей.
+    """
+    started = time.perf_counter()
+    now = time.time()
+    overdue = []
+    records = pending_store.load()
+    for record in records:
+        pending = PendingCaptcha.from_record(record)
+        key = pending.key
+        chat_id, user_id = key
+        pending_captchas[key] = pending
+        if pending.batch_message_id is not None and pending.batch_button is not None:
+            # Клавиатура общего сообщения собирается из кнопок ещё не прошедших капчу
+            text, callback_data = pending.batch_button
+            batch_captcha_buttons.setdefault((chat_id, pending.batch_message_id), {})[user_id] = \
+                InlineKeyboardButton(text, callback_data=callback_data)
+
+        if pending.deadline <= now:
+            overdue.append(key)
+            continue
+        if pending.warn_at > now:
+            captcha_deadlines.schedule(key, "warning", pending.warn_at - now, send_warning, chat_id, user_id)
+        captcha_deadlines.schedule(key, "kick", pending.deadline - now, handle_failed_captcha, chat_id, user_id)
+
+    logger.info(f"Восстановлено {len(records)} незавершённых капч ({len(overdue)} просрочено) "
+                f"за {time.perf_counter() - started:.3f} с.")
+    if overdue:
+        # Вызывается из post_init до запуска приложения, поэтому задача отслеживается здесь и
+        # отменяется в stop_recovery
+        global _overdue_task
+        _overdue_task = asyncio.create_task(_process_overdue(context, overdue), name="captcha-overdue")
+
+
+async def stop_recovery():
+    """Отменяет незавершённую обработку просроченных капч."""
+    global _overdue_task
+    task, _overdue_task = _overdue_task, None
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
 
 
 async def captcha_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -203,14 +300,12 @@ async def captcha_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await has_permission(update, context):
         await update.message.reply_text("У вас недостаточно прав для выполнения этой команды.")
         return
-    global bot_config
-    bot_config = load_config()
+    chat_id = update.effective_chat.id
 
     if context.args:
         new_type = context.args[0].lower()
         if new_type in ["button", "math", "fruits", "image"]:
-            bot_config["captcha_type"] = new_type
-            save_config(bot_config)  # Сохраняем изменения
+            set_chat_config(chat_id, captcha_type=new_type)  # Сохраняем изменения
             await update.message.reply_text(f"Тип капчи установлен: {new_type}")
             logger.info(f"Тип капчи изменён на: {new_type}")
 
@@ -240,9 +335,8 @@ async def captcha_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 reply_markup = InlineKeyboardMarkup(buttons)
                 await update.message.reply_text("Вот пример капчи с фруктами: выберите 🍍", reply_markup=reply_markup)
             elif new_type == "image":
-                # Генерация кода для примера
-                code = generate_captcha_code(length=5)
-                captcha_image = generate_captcha_image(code)
+                # Пример детерминирован, повторная отправка идёт по file_id без загрузки файла
+                code, captcha_image = await render_image_captcha(seed=EXAMPLE_CAPTCHA_SEED)
 
                 # Генерация кнопок для примера (одна строка)
                 buttons = [
@@ -252,200 +346,260 @@ async def captcha_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 reply_markup = InlineKeyboardMarkup([buttons])  # Одной строкой
 
                 # Отправка изображения с кнопками
-                await context.bot.send_photo(
-                    chat_id=update.effective_chat.id,
-                    photo=InputFile(captcha_image, filename="example_captcha.png"),
+                await send_cached_photo(
+                    context.bot,
+                    update.effective_chat.id,
+                    captcha_image,
+                    filename=f"example_captcha.{image_extension(captcha_image)}",
                     caption="Вот пример image капчи. Нажмите кнопки в порядке символов на изображении.",
                     reply_markup=reply_markup
                 )
         else:
             await update.message.reply_text("Доступные типы капчи: button, math, fruits, image.")
     else:
-        await update.message.reply_text(f"Текущий тип капчи: {bot_config['captcha_type']}")
-
+        await update.message.reply_text(f"Текущий тип капчи: {get_chat_config(chat_id)['captcha_type']}")
 
-async def handle_new_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает новых участников чата."""
-    chat_id = update.effective_chat.id
-    for user in update.message.new_chat_members:
-        if user.id in verified_users:
-            logger.info(f"Пользователь {user.id} уже верифицирован.")
-            continue
-
-        captcha_type = bot_config.get("captcha_type", DEFAULT_CONFIG["captcha_type"])
-        logger.info(f"Обработка капчи для пользователя {user.id} типа {captcha_type}")
-
-        # Получаем имя пользователя для персонализации сообщений
-        if user.username:
-            user_display = f"@{user.username}"
-        else:
-            user_display = user.full_name
 
-        # Очистка предыдущих данных, если таковые имеются
-        if user.id in user_math_captcha:
-            del user_math_captcha[user.id]
-            logger.info(f"Удалены предыдущие данные math капчи для пользователя {user.id}.")
-        if user.id in user_captcha_code:
-            del user_captcha_code[user.id]
-            logger.info(f"Удалены предыдущие данные image капчи для пользователя {user.id}.")
+async def send_member_captcha(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user, bot_config):
+    """Отправляет капчу одному новому участнику и ограничивает его права."""
+    key = (chat_id, user.id)
+    if key in verified_users:
+        logger.info(f"Пользователь {user.id} уже верифицирован.")
+        return
 
-        if captcha_type == "button":
-            try:
-                # Загружаем актуальную конфигурацию
-                config = load_config()
-                time_limit = config.get("time_limit", DEFAULT_CONFIG["time_limit"])
+    captcha_type = bot_config.get("captcha_type", DEFAULT_CONFIG["captcha_type"])
+    logger.info(f"Обработка капчи для пользователя {user.id} типа {captcha_type}")
 
-                # Кнопка "Я не бот!"
-                keyboard = [[InlineKeyboardButton(bot_config["button_text"], callback_data="captcha_ok")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                message = await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"{user_display}, {bot_config['custom_captcha_message']}, у вас есть {time_limit} секунд.",
-                    reply_markup=reply_markup
-                )
-                logger.info(f"Сообщение капчи отправлено пользователю {user.id}.")
+    # Получаем имя пользователя для персонализации сообщений
+    if user.username:
+        user_display = f"@{user.username}"
+    else:
+        user_display = user.full_name
 
-                # Сохраняем message_id основного сообщения капчи
-                if user.id not in user_captcha_messages:
-                    user_captcha_messages[user.id] = {}
-                user_captcha_messages[user.id]['captcha'] = message.message_id
+    # Очистка предыдущих данных, если таковые имеются
+    if pending_captchas.pop(key, None) is not None:
+        logger.info(f"Удалены предыдущие данные капчи для пользователя {user.id}.")
+    # В pending_captchas капча попадает в deliver_captcha, после ограничения прав
+    pending = PendingCaptcha(chat_id, user.id, captcha_type)
 
-                # Ограничение прав пользователя
-                await restrict_user(context, chat_id, user.id)
-            except Exception as e:
-                logger.error(f"Ошибка при отправке капчи для пользователя {user.id}: {e}")
+    if captcha_type == "button":
+        try:
+            time_limit = bot_config.get("time_limit", DEFAULT_CONFIG["time_limit"])
+
+            # Кнопка "Я не бот!"
+            def reply_markup(expires):
+                return InlineKeyboardMarkup([[InlineKeyboardButton(
+                    bot_config["button_text"], callback_data=sign_callback("button", chat_id, user.id, 1, expires)
+                )]])
+
+            await deliver_captcha(context, pending, lambda expires: context.bot.send_message(
+                chat_id=chat_id,
+                text=f"{user_display}, {bot_config['custom_captcha_message']}, у вас есть {time_limit} секунд.",
+                reply_markup=reply_markup(expires)
+            ))
+            logger.info(f"Сообщение капчи отправлено пользователю {user.id}.")
+        except Exception as e:
+            logger.error(f"Ошибка при отправке капчи для пользователя {user.id}: {e}")
 
-        elif captcha_type == "math":
-            try:
-                # Математическая капча (сложение или вычитание)
-                num1 = random.randint(1, 20)
-                num2 = random.randint(1, 20)
-                operation = random.choice(['+', '-'])
-                expression = f"{num1} {operation} {num2} = ?"
-                answer = num1 + num2 if operation == '+' else num1 - num2
-                user_math_captcha[user.id] = answer
-
-                # Генерация вариантов ответов
-                possible_answers = set()
-                possible_answers.add(answer)
-                while len(possible_answers) < 4:
-                    wrong_answer = answer + random.choice([-3, -2, -1, 1, 2, 3])
-                    if wrong_answer > 0:
-                        possible_answers.add(wrong_answer)
-                possible_answers = list(possible_answers)
-                random.shuffle(possible_answers)
-
-                # Создание кнопок
+    elif captcha_type == "math":
+        try:
+            # Математическая капча (сложение или вычитание)
+            num1 = random.randint(1, 20)
+            num2 = random.randint(1, 20)
+            operation = random.choice(['+', '-'])
+            if operation == '-' and num1 < num2:
+                # Ответ не отрицательный, иначе ниже не набрать положительных неверных вариантов
+                num1, num2 = num2, num1
+            expression = f"{num1} {operation} {num2} = ?"
+            answer = num1 + num2 if operation == '+' else num1 - num2
+            pending.answer = answer
+
+            # Генерация вариантов ответов
+            possible_answers = set()
+            possible_answers.add(answer)
+            while len(possible_answers) < 4:
+                wrong_answer = answer + random.choice([-3, -2, -1, 1, 2, 3])
+                if wrong_answer > 0:
+                    possible_answers.add(wrong_answer)
+            possible_answers = list(possible_answers)
+            random.shuffle(possible_answers)
+
+            # Создание кнопок
+            def reply_markup(expires):
                 buttons = []
                 for ans in possible_answers:
-                    if ans == answer:
-                        buttons.append([InlineKeyboardButton(str(ans), callback_data="captcha_math_ok")])
-                    else:
-                        buttons.append([InlineKeyboardButton(str(ans), callback_data="captcha_math_fail")])
-                reply_markup = InlineKeyboardMarkup(buttons)
+                    callback_data = sign_callback("math", chat_id, user.id, int(ans == answer), expires)
+                    buttons.append([InlineKeyboardButton(str(ans), callback_data=callback_data)])
+                return InlineKeyboardMarkup(buttons)
+
+            await deliver_captcha(context, pending, lambda expires: context.bot.send_message(
+                chat_id=chat_id,
+                text=f"{user_display}, {expression}\nВыберите правильный ответ:",
+                reply_markup=reply_markup(expires)
+            ))
+            logger.info(f"Сообщение math капчи отправлено пользователю {user.id}.")
+        except Exception as e:
+            logger.error(f"Ошибка при отправке math капчи для пользователя {user.id}: {e}")
 
-                message = await context.bot.send_message(
+    elif captcha_type == "fruits":
+        try:
+            # Капча с фруктами
+            if len(ALL_FRUITS) < 4:
+                await context.bot.send_message(
                     chat_id=chat_id,
-                    text=f"{user_display}, {expression}\nВыберите правильный ответ:",
-                    reply_markup=reply_markup
+                    text="Недостаточно фруктов для капчи."
                 )
-                logger.info(f"Сообщение math капчи отправлено пользователю {user.id}.")
-
-                # Сохраняем message_id основного сообщения капчи
-                if user.id not in user_captcha_messages:
-                    user_captcha_messages[user.id] = {}
-                user_captcha_messages[user.id]['captcha'] = message.message_id
+                logger.error("Недостаточно фруктов для капчи.")
+                return
 
-                # Ограничение прав пользователя
-                await restrict_user(context, chat_id, user.id)
-            except Exception as e:
-                logger.error(f"Ошибка при отправке math капчи для пользователя {user.id}: {e}")
-
-        elif captcha_type == "fruits":
-            try:
-                # Капча с фруктами
-                if len(ALL_FRUITS) < 4:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="Недостаточно фруктов для капчи."
-                    )
-                    logger.error("Недостаточно фруктов для капчи.")
-                    return
+            chosen_emojis = random.sample(ALL_FRUITS, 4)
+            correct_emoji = random.choice(chosen_emojis)
+            instruction_text = f"{user_display}, выберите фрукт {correct_emoji}, чтобы подтвердить, что вы не бот!"
+            random.shuffle(chosen_emojis)
 
-                chosen_emojis = random.sample(ALL_FRUITS, 4)
-                correct_emoji = random.choice(chosen_emojis)
-                instruction_text = f"{user_display}, выберите фрукт {correct_emoji}, чтобы подтвердить, что вы не бот!"
+            def reply_markup(expires):
                 buttons = []
                 for emoji in chosen_emojis:
-                    if emoji == correct_emoji:
-                        buttons.append([InlineKeyboardButton(emoji, callback_data="captcha_fruit_ok")])
-                    else:
-                        buttons.append([InlineKeyboardButton(emoji, callback_data="captcha_fruit_fail")])
-                random.shuffle(buttons)
-                reply_markup = InlineKeyboardMarkup(buttons)
-
-                message = await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=instruction_text,
-                    reply_markup=reply_markup
-                )
-                logger.info(f"Сообщение фруктовой капчи отправлено пользователю {user.id}.")
+                    callback_data = sign_callback("fruits", chat_id, user.id, int(emoji == correct_emoji), expires)
+                    buttons.append([InlineKeyboardButton(emoji, callback_data=callback_data)])
+                return InlineKeyboardMarkup(buttons)
+
+            await deliver_captcha(context, pending, lambda expires: context.bot.send_message(
+                chat_id=chat_id,
+                text=instruction_text,
+                reply_markup=reply_markup(expires)
+            ))
+            logger.info(f"Сообщение фруктовой капчи отправлено пользователю {user.id}.")
+        except Exception as e:
+            logger.error(f"Ошибка при отправке фруктовой капчи для пользователя {user.id}: {e}")
 
-                # Сохраняем message_id основного сообщения капчи
-                if user.id not in user_captcha_messages:
-                    user_captcha_messages[user.id] = {}
-                user_captcha_messages[user.id]['captcha'] = message.message_id
+    elif captcha_type == "image":
+        try:
+            # Берём готовую капчу из пула, при пустом пуле рисуем на месте
+            pooled = captcha_pool.take()
+            code, captcha_image = pooled if pooled is not None else await render_image_captcha()
+            pending.answer = code
+
+            # Отправка изображения и кнопок
+            await deliver_captcha(context, pending, lambda expires: context.bot.send_photo(
+                chat_id=chat_id,
+                photo=InputFile(captcha_image, filename=f'captcha.{image_extension(captcha_image)}'),
+                caption=f"{user_display}, нажмите кнопки в порядке символов из изображения.",
+                reply_markup=image_keyboard(chat_id, user.id, code, expires)
+            ))
+            logger.info(f"Сообщение image капчи отправлено пользователю {user.id}.")
+        except Exception as e:
+            logger.error(f"Ошибка при отправке image капчи для пользователя {user.id}: {e}")
 
-                # Ограничение прав пользователя
-                await restrict_user(context, chat_id, user.id)
-            except Exception as e:
-                logger.error(f"Ошибка при отправке фруктовой капчи для пользователя {user.id}: {e}")
+    else:
+        try:
+            # Если тип капчи не распознан
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text=f"{user_display}, Тип капчи не установлен или некорректен. Пожалуйста, обратитесь к администратору."
+            )
+            logger.warning(f"Неизвестный тип капчи: {captcha_type} для пользователя {user.id}")
+        except Exception as e:
+            logger.error(f"Ошибка при уведомлении пользователя {user.id} о неизвестном типе капчи: {e}")
+
+
+async def send_batch_captcha(context: ContextTypes.DEFAULT_TYPE, chat_id: int, users, bot_config):
+    """Отправляет одно сообщение button-капчи на всех вошедших, у каждого пользователя своя кнопка."""
+    time_limit = bot_config.get("time_limit", DEFAULT_CONFIG["time_limit"])
+    expires = callback_expiry(time_limit + int(outbound_scheduler.chat_delay(chat_id)))
+    buttons = {}
+    for user in users:
+        user_display = f"@{user.username}" if user.username else user.full_name
+        buttons[user.id] = InlineKeyboardButton(
+            f"{bot_config['button_text']} ({user_display})",
+            callback_data=sign_callback("batch", chat_id, user.id, 1, expires),
+        )
 
-        elif captcha_type == "image":
-            try:
-                code = generate_captcha_code()
-                user_captcha_code[user.id] = {"code": code, "current_index": 0}
+    mentions = ", ".join(f"@{user.username}" if user.username else user.full_name for user in users)
+    message = await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"{mentions}, {bot_config['custom_captcha_message']}, у вас есть {time_limit} секунд.",
+        reply_markup=InlineKeyboardMarkup([[button] for button in buttons.values()])
+    )
+    logger.info(f"Общее сообщение капчи отправлено {len(users)} пользователям.")
 
-                # Генерация изображения капчи
-                font_path = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
-                captcha_image = generate_captcha_image(code, font_path=font_path, size=(200, 80))
+    batch_captcha_buttons[(chat_id, message.message_id)] = buttons
+    for user in users:
+        pending = pending_captchas.get((chat_id, user.id))
+        if pending is not None:
+            pending.batch_message_id = message.message_id
+            # Кнопка пишется в журнал вместе с капчей, чтобы после перезапуска восстановить клавиатуру
+            button = buttons[user.id]
+            pending.batch_button = (button.text, button.callback_data)
+            arm_captcha_deadlines(pending)
 
-                # Генерация кнопок
-                buttons = [
-                    InlineKeyboardButton(char, callback_data=f"captcha_image_{char}")
-                    for char in random.sample(code, len(code))
-                ]
-                reply_markup = InlineKeyboardMarkup([buttons])
 
-                # Отправка изображения и кнопок
-                message = await context.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=InputFile(captcha_image, filename='captcha.png'),
-                    caption=f"{user_display}, нажмите кнопки в порядке символов из изображения.",
-                    reply_markup=reply_markup
-                )
-                logger.info(f"Сообщение image капчи отправлено пользователю {user.id}.")
+@instrument
+async def handle_new_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Обрабатывает новых участников чата.
+    Все участники события обрабатываются параллельно (не больше join_concurrency одновременно).
+    """
+    chat_id = update.effective_chat.id
+    bot_config = get_chat_config(chat_id)
+    semaphore = asyncio.Semaphore(bot_config.get("join_concurrency", DEFAULT_CONFIG["join_concurrency"]))
+
+    async def limited(coro):
+        async with semaphore:
+            await coro
+
+    users = [user for user in update.message.new_chat_members if (chat_id, user.id) not in verified_users]
+    captcha_type = bot_config.get("captcha_type", DEFAULT_CONFIG["captcha_type"])
+    batch = bot_config.get("join_batch_captcha", DEFAULT_CONFIG["join_batch_captcha"])
+
+    if batch and captcha_type == "button" and len(users) > 1:
+        # Сначала ограничение прав всех участников параллельно, затем одно сообщение на всех:
+        # сообщение может ждать лимита сообщений чата, а ограничение — нет
+        await asyncio.gather(*(limited(restrict_user(context, chat_id, user.id)) for user in users))
+        # Капча отправляется только тем, кого удалось ограничить
+        users = [user for user in users if (chat_id, user.id) in pending_captchas]
+        if not users:
+            return
+        try:
+            await send_batch_captcha(context, chat_id, users, bot_config)
+        except Exception as e:
+            logger.error(f"Ошибка при отправке общей капчи: {e}")
+            # Без сообщения капчу не пройти: снимаем ограничения и таймеры
+            await asyncio.gather(*(limited(cancel_captcha_jobs(context, user.id, chat_id)) for user in users))
+        return
 
-                # Сохраняем message_id капчи
-                if user.id not in user_captcha_messages:
-                    user_captcha_messages[user.id] = {}
-                user_captcha_messages[user.id]['captcha'] = message.message_id
+    await asyncio.gather(
+        *(limited(send_member_captcha(context, chat_id, user, bot_config))
+          for user in update.message.new_chat_members),
+        return_exceptions=True,
+    )
 
-                # Ограничение прав пользователя
-                await restrict_user(context, chat_id, user.id)
-            except Exception as e:
-                logger.error(f"Ошибка при отправке image капчи для пользователя {user.id}: {e}")
 
-        else:
-            try:
-                # Если тип капчи не распознан
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"{user_display}, Тип капчи не установлен или некорректен. Пожалуйста, обратитесь к администратору."
-                )
-                logger.warning(f"Неизвестный тип капчи: {captcha_type} для пользователя {user.id}")
-            except Exception as e:
-                logger.error(f"Ошибка при уведомлении пользователя {user.id} о неизвестном типе капчи: {e}")
+async def delete_captcha_messages(context: ContextTypes.DEFAULT_TYPE, pending: PendingCaptcha):
+    """
+    Удаляет сообщения капчи и предупреждения пользователя.
+    Общее сообщение капчи удаляется, только когда в нём не осталось ожидающих пользователей,
+    до этого из него убирается кнопка пользователя.
+    """
+    chat_id, user_id = pending.key
+    for key, message_id in pending.message_ids().items():
+        if key == 'batch':
+            buttons = batch_captcha_buttons.get((chat_id, message_id), {})
+            buttons.pop(user_id, None)
+            if buttons:
+                try:
+                    await context.bot.edit_message_reply_markup(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        reply_markup=InlineKeyboardMarkup([[button] for button in buttons.values()]),
+                    )
+                except Exception as e:
+                    logger.error(f"Не удалось обновить общее сообщение капчи {message_id}: {e}")
+                continue
+            batch_captcha_buttons.pop((chat_id, message_id), None)
+        # Сообщения удаляются пачками через delete_messages
+        delete_batcher.delete(chat_id, message_id)
+        logger.info(f"Сообщение '{key}' капчи для пользователя {user_id} поставлено в очередь на удаление.")
 
 
 async def handle_left_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -456,37 +610,20 @@ async def handle_left_members(update: Update, context: ContextTypes.DEFAULT_TYPE
         user_id = left_member.id
         logger.info(f"Пользователь {left_member.username or left_member.full_name} покинул(а) группу.")
 
-        # Отменяем запланированные задания капчи
+        # Отменяем запланированные задания капчи и удаляем её сообщения
         await cancel_captcha_jobs(context, user_id, chat_id)
 
-        # Удаляем сообщение капчи, если оно существует
-        message_info = user_captcha_messages.get(user_id)
-        if message_info:
-            for key, message_id in message_info.items():
-                try:
-                    await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-                    logger.info(f"Сообщение '{key}' капчи для пользователя {user_id} удалено.")
-                except Exception as e:
-                    logger.error(f"Не удалось удалить сообщение '{key}' капчи для пользователя {user_id}: {e}")
-            del user_captcha_messages[user_id]
 
-
-async def send_warning(context: ContextTypes.DEFAULT_TYPE):
+async def send_warning(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int):
     """Отправляет предупреждение пользователю об оставшемся времени."""
-    job = context.job
-    data = job.data
-    chat_id = data["chat_id"]
-    user_id = data["user_id"]
 
     try:
-        # Загружаем актуальную конфигурацию
-        config = load_config()
-        time_limit = config.get("time_limit", DEFAULT_CONFIG["time_limit"])
+        time_limit = get_chat_config(chat_id).get("time_limit", DEFAULT_CONFIG["time_limit"])
 
         # Вычисляем оставшееся время до истечения лимита
         warning_time = time_limit // 2
 
-        user = await context.bot.get_chat_member(chat_id, user_id)
+        user = await get_chat_member(context, chat_id, user_id)
         if user.status in ["left", "kicked"]:
             logger.info(f"Пользователь {user_id} уже покинул чат. Предупреждение не отправляется.")
             return
@@ -501,128 +638,143 @@ async def send_warning(context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"Отправлено предупреждение пользователю {user_id}.")
 
         # Сохраняем message_id предупреждения
-        if user_id not in user_captcha_messages:
-            user_captcha_messages[user_id] = {}
-        user_captcha_messages[user_id]['warning'] = warning_message.message_id
+        pending = pending_captchas.get((chat_id, user_id))
+        if pending is not None:
+            pending.warning_message_id = warning_message.message_id
+            pending_store.update(chat_id, user_id, warning=warning_message.message_id)
+        else:
+            # Капча завершилась, пока предупреждение ждало лимита сообщений чата
+            delete_batcher.delete(chat_id, warning_message.message_id)
 
     except Exception as e:
         logger.error(f"Не удалось отправить предупреждение пользователю {user_id}: {e}")
 
 
+def image_keyboard(chat_id: int, user_id: int, code: str, expires: int) -> InlineKeyboardMarkup:
+    """
+    Кнопки image капчи для первого шага. В каждой кнопке подписана маска позиций
+    её символа в коде, поэтому верность нажатия проверяется без хранения кода.
+    """
+    buttons = []
+    for char in random.sample(code, len(code)):
+        positions = sum(1 << i for i, c in enumerate(code) if c == char)
+        callback_data = sign_callback("image", chat_id, user_id, positions, expires, step=0, length=len(code))
+        buttons.append(InlineKeyboardButton(char, callback_data=callback_data))
+    return InlineKeyboardMarkup([buttons])
+
+
+def resign_image_keyboard(markup: InlineKeyboardMarkup, token) -> InlineKeyboardMarkup:
+    """Переподписывает кнопки image капчи для следующего шага."""
+    rows = []
+    for row in markup.inline_keyboard:
+        new_row = []
+        for button in row:
+            button_token, _ = verify_callback(button.callback_data, token.chat_id, token.user_id)
+            if button_token is None:
+                return None
+            callback_data = sign_callback("image", token.chat_id, token.user_id, button_token.value,
+                                          button_token.expires, step=token.step + 1, length=button_token.length)
+            new_row.append(InlineKeyboardButton(button.text, callback_data=callback_data))
+        rows.append(new_row)
+    return InlineKeyboardMarkup(rows)
+
+
+# Ответы на нажатия: (верный ответ, неверный ответ)
+CALLBACK_REPLIES = {
+    "button": ("{mention}, вы успешно прошли проверку!", "{mention}, неверный ответ! Вы будете кикнуты."),
+    "math": ("{mention}, верно! Добро пожаловать!", "{mention}, неверный ответ! Вы будете кикнуты."),
+    "fruits": ("{mention}, верно! Добро пожаловать!", "{mention}, неправильно! Вы будете кикнуты."),
+}
+
+
+@instrument
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает нажатия на кнопки капчи."""
+    """
+    Обрабатывает нажатия на кнопки капчи.
+    Чат, адресат, шаг и верность ответа берутся из подписанной callback_data,
+    поэтому проверка не обращается к состоянию бота.
+    """
     query = update.callback_query
-    await query.answer()
-    data = query.data
+    if not is_signed(query.data):
+        # Кнопки примеров из /captcha ничего не делают
+        await query.answer()
+        return
 
     user_id = query.from_user.id
     chat_id = query.message.chat.id
-    try:
-        user = await context.bot.get_chat_member(chat_id, user_id)
-        user_full_name = user.user.full_name
-        mention = f"@{user.user.username}" if user.user.username else user_full_name
-    except Exception as e:
-        logger.error(f"Не удалось получить информацию о пользователе {user_id}: {e}")
-        mention = f"<@{user_id}>"
-
-    if data == "captcha_ok":
-        verified_users.add(user_id)
-        await query.edit_message_text(f"{mention}, вы успешно прошли проверку!")
-        logger.info(f"Пользователь {user_id} успешно прошёл капчу.")
-        await cancel_captcha_jobs(context, user_id, chat_id)
-
-    elif data == "captcha_math_ok":
-        verified_users.add(user_id)
-        await query.edit_message_text(f"{mention}, верно! Добро пожаловать!")
-        logger.info(f"Пользователь {user_id} успешно прошёл math капчу.")
-        await cancel_captcha_jobs(context, user_id, chat_id)
+    token, error = verify_callback(query.data, chat_id, user_id)
+    if token is None:
+        await query.answer(error, show_alert=True)
+        logger.info(f"Нажатие пользователя {user_id} в чате {chat_id} отклонено: {error}")
+        return
 
-    elif data == "captcha_math_fail":
-        await query.edit_message_text(f"{mention}, неверный ответ! Вы будете кикнуты.")
-        logger.info(f"Пользователь {user_id} неверно ответил на math капчу.")
-        await ban_or_kick_user(context, chat_id, user_id)  # Заменено
+    # Данные пользователя уже есть в callback_query, запрос к API не нужен
+    mention = f"@{query.from_user.username}" if query.from_user.username else query.from_user.full_name
 
-    elif data == "captcha_fruit_ok":
-        verified_users.add(user_id)
-        await query.edit_message_text(f"{mention}, верно! Добро пожаловать!")
-        logger.info(f"Пользователь {user_id} успешно прошёл фруктовую капчу.")
+    if token.captcha_type == "batch":
+        # Кнопка общей капчи: сообщение остаётся для остальных пользователей
+        await query.answer("Вы успешно прошли проверку!")
+        verified_users.add((chat_id, user_id))
+        _record_passed(chat_id, user_id)
+        logger.info(f"Пользователь {user_id} успешно прошёл общую капчу.")
         await cancel_captcha_jobs(context, user_id, chat_id)
+        return
 
-    elif data == "captcha_fruit_fail":
-        await query.edit_message_text(f"{mention}, неправильно! Вы будете кикнуты.")
-        logger.info(f"Пользователь {user_id} неправильно ответил на фруктовую капчу.")
-        await ban_or_kick_user(context, chat_id, user_id)  # Заменено
-
-    elif data.startswith("captcha_image_"):
-        char_clicked = data.split("_")[-1]
-        user_captcha_info = user_captcha_code.get(user_id, {})
-        if not user_captcha_info:
-            await query.edit_message_caption("Ошибка! Код капчи не найден.")
-            logger.warning(f"Капча для пользователя {user_id} отсутствует.")
-            return
-
-        expected_code = user_captcha_info["code"]
-        current_index = user_captcha_info.get("current_index", 0)
-
-        if char_clicked == expected_code[current_index]:
-            user_captcha_info["current_index"] += 1
-            if user_captcha_info["current_index"] == len(expected_code):
-                verified_users.add(user_id)
-                await query.edit_message_caption("Капча успешно пройдена! Добро пожаловать!")
-                logger.info(f"Пользователь {user_id} успешно прошёл image капчу.")
-                await cancel_captcha_jobs(context, user_id, chat_id)
-            else:
-                await query.answer("Верно! Продолжайте.")
-        else:
+    if token.captcha_type == "image":
+        if not token.value >> token.step & 1:
+            await query.answer()
             await query.edit_message_caption("Неправильный ввод символа! Вы будете удалены.")
-            logger.info(f"Пользователь {user_id} ввёл неверный символ: {char_clicked}")
-            await ban_or_kick_user(context, chat_id, user_id)  # Заменено
+            logger.info(f"Пользователь {user_id} ввёл неверный символ на шаге {token.step}.")
+            await finish_failed_captcha(context, chat_id, user_id, "wrong")
+            await ban_or_kick_user(context, chat_id, user_id)
+        elif token.step + 1 == token.length:
+            await query.answer()
+            verified_users.add((chat_id, user_id))
+            _record_passed(chat_id, user_id)
+            await query.edit_message_caption("Капча успешно пройдена! Добро пожаловать!")
+            logger.info(f"Пользователь {user_id} успешно прошёл image капчу.")
+            await cancel_captcha_jobs(context, user_id, chat_id)
+        else:
+            await query.answer("Верно! Продолжайте.")
+            pending = pending_captchas.get((chat_id, user_id))
+            if pending is not None:
+                pending.index = token.step + 1
+                pending_store.update(chat_id, user_id, index=pending.index)
+            # Кнопки следующего шага подписываются заново
+            reply_markup = resign_image_keyboard(query.message.reply_markup, token)
+            if reply_markup is not None:
+                await query.edit_message_reply_markup(reply_markup)
+        return
 
-    elif data == "captcha_math_fail":
-        # Неправильный ответ на math капчу
-        await query.edit_message_text(f"{mention}, неверный ответ! Вы будете кикнуты.")
-        logger.info(f"Пользователь {user_id} неверно ответил на math капчу.")
-        await ban_or_kick_user(context, chat_id, user_id)  # Заменено
-
-    elif data == "captcha_fruit_ok":
-        # Правильный фрукт
-        verified_users.add(user_id)
-        await query.edit_message_text(f"{mention}, верно! Добро пожаловать!")
-        logger.info(f"Пользователь {user_id} успешно прошёл фруктовую капчу.")
-        # Отменяем задачи по капче
+    await query.answer()
+    passed_text, failed_text = CALLBACK_REPLIES[token.captcha_type]
+    if token.value:
+        verified_users.add((chat_id, user_id))
+        _record_passed(chat_id, user_id)
+        await query.edit_message_text(passed_text.format(mention=mention))
+        logger.info(f"Пользователь {user_id} успешно прошёл {token.captcha_type} капчу.")
         await cancel_captcha_jobs(context, user_id, chat_id)
-
-    elif data == "captcha_fruit_fail":
-        # Неправильный фрукт
-        await query.edit_message_text(f"{mention}, неправильно! Вы будете кикнуты.")
-        logger.info(f"Пользователь {user_id} неправильно ответил на фруктовую капчу.")
-        await ban_or_kick_user(context, chat_id, user_id)  # Заменено
+    else:
+        await query.edit_message_text(failed_text.format(mention=mention))
+        logger.info(f"Пользователь {user_id} неверно ответил на {token.captcha_type} капчу.")
+        await finish_failed_captcha(context, chat_id, user_id, "wrong")
+        await ban_or_kick_user(context, chat_id, user_id)
 
 
 async def cancel_captcha_jobs(context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int):
     """Отменяет запланированные задания капчи и восстанавливает права пользователя."""
-    jobs = captcha_jobs.get(user_id, {})
-    for job_key, job in jobs.items():
-        try:
-            job.schedule_removal()
-            logger.info(f"Задание '{job_key}' для пользователя {user_id} запланировано на удаление.")
-        except Exception as e:
-            logger.warning(f"Не удалось отменить задание '{job_key}' для пользователя {user_id}: {e}")
-    captcha_jobs.pop(user_id, None)
+    captcha_deadlines.cancel((chat_id, user_id))
+    pending_store.done(chat_id, user_id)
+    logger.info(f"Таймеры капчи для пользователя {user_id} отменены.")
 
     # Удаляем все связанные сообщения капчи
-    message_info = user_captcha_messages.get(user_id, {})
-    for key, message_id in message_info.items():
-        try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-            logger.info(f"Сообщение '{key}' капчи для пользователя {user_id} удалено.")
-        except Exception as e:
-            logger.error(f"Не удалось удалить сообщение '{key}' капчи для пользователя {user_id}: {e}")
-    user_captcha_messages.pop(user_id, None)
+    pending = pending_captchas.pop((chat_id, user_id), None)
+    if pending is not None:
+        await delete_captcha_messages(context, pending)
 
     # Проверяем статус пользователя
     try:
-        user = await context.bot.get_chat_member(chat_id, user_id)
+        user = await get_chat_member(context, chat_id, user_id)
         if user.status == "kicked":
             logger.info(f"Пользователь {user_id} находится в черном списке чата. Восстановление прав отменено.")
             return
@@ -642,21 +794,14 @@ async def cancel_captcha_jobs(context: ContextTypes.DEFAULT_TYPE, user_id: int,
                 'can_add_web_page_previews': True,
             },
         )
+        member_cache.invalidate(chat_id, user_id)
         logger.info(f"Права пользователя {user_id} восстановлены.")
     except Exception as e:
         logger.error(f"Ошибка при проверке статуса пользователя {user_id}: {e}")
 
-    # Очистка дополнительных данных капчи
-    if user_id in user_math_captcha:
-        del user_math_captcha[user_id]
-        logger.info(f"Удалены данные math капчи для пользователя {user_id}.")
-    if user_id in user_captcha_code:
-        del user_captcha_code[user_id]
-        logger.info(f"Удалены данные image капчи для пользователя {user_id}.")
-
     # Удаляем пользователя из verified_users, если он там есть
-    if user_id in verified_users:
-        verified_users.remove(user_id)
+    if (chat_id, user_id) in verified_users:
+        verified_users.remove((chat_id, user_id))
         logger.info(f"Пользователь {user_id} удалён из verified_users.")
 
     # Восстанавливаем права пользователя
@@ -675,6 +820,8 @@ async def cancel_captcha_jobs(context: ContextTypes.DEFAULT_TYPE, user_id: int,
         logger.info(f"Права пользователя {user_id} восстановлены.")
     except Exception as e:
         logger.error(f"Не удалось восстановить права пользователя {user_id}: {e}")
+    finally:
+        member_cache.invalidate(chat_id, user_id)
 
 
 async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -686,42 +833,49 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = user.id
     chat_id = update.effective_chat.id
 
+    pending = pending_captchas.get((chat_id, user_id))
+    if pending is None:
+        return
+
     # Проверка на math-капчу
-    if user_id in user_math_captcha:
-        expected_answer = user_math_captcha[user_id]
+    if pending.captcha_type == "math":
+        expected_answer = pending.answer
         try:
             user_answer = int(update.message.text.strip())
             if user_answer == expected_answer:
-                verified_users.add(user_id)
+                verified_users.add((chat_id, user_id))
+                _record_passed(chat_id, user_id)
                 await update.message.reply_text("Капча пройдена, добро пожаловать!")
                 logger.info(f"Пользователь {user_id} успешно прошёл math капчу через текстовое сообщение.")
-                del user_math_captcha[user_id]
                 # Отменяем задачи по капче
                 await cancel_captcha_jobs(context, user_id, chat_id)
             else:
                 await update.message.reply_text("Неверный ответ! Вы будете кикнуты.")
                 logger.info(f"Пользователь {user_id} ввёл неверный ответ на math капчу.")
+                await finish_failed_captcha(context, chat_id, user_id, "wrong")
                 await ban_or_kick_user(context, chat_id, user_id)  # Заменено
         except ValueError:
             await update.message.reply_text("Пожалуйста, введите числовой ответ.")
             logger.info(f"Пользователь {user_id} ввёл некорректный ответ на math капчу.")
+            await finish_failed_captcha(context, chat_id, user_id, "wrong")
             await ban_or_kick_user(context, chat_id, user_id)  # Заменено
         return
 
     # Проверка на image-капчу (изображение)
-    if user_id in user_captcha_code:
-        expected_code = user_captcha_code[user_id]["code"]
+    if pending.captcha_type == "image":
+        expected_code = pending.answer
         user_code = update.message.text.strip()
         if user_code == expected_code:
-            verified_users.add(user_id)
+            verified_users.add((chat_id, user_id))
+            _record_passed(chat_id, user_id)
             await update.message.reply_text("Капча пройдена, добро пожаловать!")
             logger.info(f"Пользователь {user_id} успешно прошёл image капчу через текстовое сообщение.")
-            del user_captcha_code[user_id]
             # Отменяем задачи по капче
             await cancel_captcha_jobs(context, user_id, chat_id)
         else:
             await update.message.reply_text("Неверный код! Вы будете кикнуты.")
             logger.info(f"Пользователь {user_id} ввёл неверный код на image капчу.")
+            await finish_failed_captcha(context, chat_id, user_id, "wrong")
             await ban_or_kick_user(context, chat_id, user_id)  # Заменено
         return
 
@@ -0,0 +1,245 @@
+# modules/captcha_image.py
+
+import functools
+import io
+import logging
+import os
+import random
+import string
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageFilter
+
+logger = logging.getLogger(__name__)
+
+
+def generate_captcha_code(length=5, rng=random):
+    characters = CAPTCHA_ALPHABET
+    return ''.join(rng.choices(characters, k=length))
+
+
+# Шрифты из каталога Fonts/ в корне репозитория, не зависят от рабочего каталога
+FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Fonts')
+DEFAULT_FONT_PATH = os.path.join(FONTS_DIR, 'arial.ttf')
+
+# Символы капчи и варианты их начертания в атласе
+CAPTCHA_ALPHABET = string.ascii_letters + string.digits
+ATLAS_FONT_SIZES = (32, 36, 40)
+ATLAS_ANGLES = (-24, -16, -8, 0, 8, 16, 24)
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(font_path: str = DEFAULT_FONT_PATH, font_size: int = 36):
+    """Загружает шрифт один раз на процесс; относительные пути ищутся в Fonts/."""
+    if not os.path.isabs(font_path):
+        bundled = os.path.join(FONTS_DIR, os.path.basename(font_path))
+        if os.path.exists(bundled):
+            font_path = bundled
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except IOError:
+        logger.warning(f"Шрифт {font_path} не найден. Используется стандартный шрифт.")
+        return ImageFont.load_default(font_size)
+
+
+class GlyphAtlas:
+    """
+    Заранее растеризованные символы алфавита капчи во всех размерах и наклонах.
+    Изображение капчи собирается из готовых масок символов без отрисовки текста.
+    """
+
+    def __init__(self, font_path: str, alphabet: str = CAPTCHA_ALPHABET,
+                 sizes=ATLAS_FONT_SIZES, angles=ATLAS_ANGLES):
+        self.angles = angles
+        self._fonts = [load_font(font_path, font_size) for font_size in sizes]
+        self._glyphs = {}  # (char, angle) -> список масок (по одной на размер)
+        for char in alphabet:
+            self._add(char)
+
+    def _add(self, char: str):
+        """Растеризует символ во всех размерах и наклонах."""
+        for font in self._fonts:
+            left, top, right, bottom = font.getbbox(char)
+            glyph = Image.new('L', (max(right - left, 1) + 4, max(bottom - top, 1) + 4), 0)
+            ImageDraw.Draw(glyph).text((2 - left, 2 - top), char, font=font, fill=255)
+            for angle in self.angles:
+                rotated = glyph.rotate(angle, resample=Image.BILINEAR, expand=True)
+                self._glyphs.setdefault((char, angle), []).append(np.asarray(rotated))
+
+    def pick(self, char: str, max_rotation: float, rng=random):
+        """Возвращает маску символа случайного размера с наклоном не больше max_rotation."""
+        if (char, self.angles[0]) not in self._glyphs:
+            # Символ вне алфавита капчи: растеризуем один раз и запоминаем
+            self._add(char)
+        angles = [angle for angle in self.angles if abs(angle) <= max_rotation] or [0]
+        return rng.choice(self._glyphs[(char, rng.choice(angles))])
+
+
+@functools.lru_cache(maxsize=None)
+def get_atlas(font_path: str = DEFAULT_FONT_PATH) -> GlyphAtlas:
+    """Строит атлас символов для шрифта один раз на процесс."""
+    return GlyphAtlas(font_path)
+
+
+def _compose_text(atlas, text, width, height, pad, max_rotation, rng=random):
+    """
+    Собирает маску текста из масок атласа: символы по центру изображения,
+    каждый со своим размером, наклоном и вертикальным смещением.
+    Маска имеет по pad пустых строк сверху и снизу под вертикальное искажение.
+    """
+    glyphs = [atlas.pick(char, max_rotation, rng) for char in text]
+    overlap = 3  # Символы слегка наезжают друг на друга, чтобы их труднее было разделить
+    text_width = sum(glyph.shape[1] for glyph in glyphs) - overlap * (len(glyphs) - 1)
+
+    mask = np.zeros((height + 2 * pad, width), dtype=np.uint8)
+    x = (width - text_width) // 2
+    for glyph in glyphs:
+        glyph_height, glyph_width = glyph.shape
+        y = pad + (height - glyph_height) // 2 + rng.randint(-4, 4)
+        # Обрезаем символ по краям изображения, если строка шире него
+        left, right = max(x, 0), min(x + glyph_width, width)
+        if right > left:
+            region = mask[y:y + glyph_height, left:right]
+            np.maximum(region, glyph[:, left - x:right - x], out=region)
+        x += glyph_width - overlap
+    return mask
+
+
+def _sine_shifts(width, amplitude, rng=random):
+    """Вертикальный сдвиг каждого столбца по синусоиде со случайными периодом и фазой."""
+    period = rng.uniform(0.6, 1.2) * width
+    phase = rng.uniform(0, 2 * np.pi)
+    shifts = amplitude * np.sin(np.arange(width) * (2 * np.pi / period) + phase)
+    return np.rint(shifts).astype(np.int32)
+
+
+_grids = {}  # (width, height) -> индексы пикселей выходного изображения в маске
+
+
+def _warp_columns(mask, size, shifts, pad):
+    """
+    Переносит маску в изображение size одной операцией np.take, сдвигая каждый
+    столбец по вертикали на shifts. У маски по pad пустых строк сверху и снизу,
+    поэтому индексы не выходят за её пределы.
+    """
+    width, height = size
+    grid = _grids.get(size)
+    if grid is None:
+        rows, cols = np.indices((height, width), dtype=np.int32)
+        grid = _grids[size] = rows * width + cols
+    shifts = np.clip(shifts, -pad, pad)
+    return mask.ravel().take(grid + (pad - shifts) * width)
+
+
+# Радиус GaussianBlur, соответствующий одному проходу ImageFilter.BLUR (σ ядра 5x5 ≈ 1.66)
+BLUR_PASS_RADIUS = 1.66
+
+# Доля цвета текста для каждого значения маски 0..255
+_ALPHA = np.arange(256)[:, None] / 255
+
+# Форматы вывода: png — полноцветный PNG, png8 — PNG с палитрой, webp и jpeg — с потерями
+IMAGE_FORMATS = ("png", "png8", "webp", "jpeg")
+
+
+def encode_image(image, image_format="png", quality=75, compress_level=6, colors=32) -> bytes:
+    """
+    Кодирует изображение капчи.
+    quality используется для webp и jpeg, compress_level — для png и png8,
+    colors — размер палитры для png8.
+    """
+    byte_io = io.BytesIO()
+    if image_format == "png":
+        image.save(byte_io, 'PNG', compress_level=compress_level)
+    elif image_format == "png8":
+        image.quantize(colors=colors, method=Image.Quantize.FASTOCTREE).save(
+            byte_io, 'PNG', compress_level=compress_level
+        )
+    elif image_format == "webp":
+        image.save(byte_io, 'WEBP', quality=quality)
+    elif image_format == "jpeg":
+        image.save(byte_io, 'JPEG', quality=quality)
+    else:
+        raise ValueError(f"Неизвестный формат изображения: {image_format}")
+    data = byte_io.getvalue()
+    logger.debug(f"Капча закодирована в {image_format}: {len(data)} байт.")
+    return data
+
+
+def image_extension(data: bytes) -> str:
+    """Определяет расширение файла по сигнатуре закодированного изображения."""
+    if data.startswith(b'\xff\xd8'):
+        return "jpg"
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return "webp"
+    return "png"
+
+
+def generate_captcha_image(
+        text,
+        font_path=DEFAULT_FONT_PATH,
+        size=(200, 80),  # Передаем размеры изображения как параметр
+        noise_points=50,
+        blur_intensity=0,
+        warp_amplitude=4,  # Амплитуда синусоидального искажения текста в пикселях
+        max_rotation=25,  # Максимальный наклон отдельного символа в градусах
+        image_format="png",  # Формат вывода, см. IMAGE_FORMATS
+        quality=75,
+        compress_level=6,
+        colors=32,
+        seed=None  # При заданном seed одинаковые аргументы дают одинаковое изображение
+):
+    width, height = size  # Используем переданный параметр size
+    background_color = (255, 255, 255)
+    atlas = get_atlas(font_path)
+    rng = random.Random(seed) if seed is not None else random
+    # Генератор NumPy засеивается из rng: после fork у процессов пула разные состояния random,
+    # а глобальное состояние NumPy было бы одинаковым
+    np_rng = np.random.default_rng(rng.getrandbits(64))
+
+    # Маска текста из атласа символов, искажённая синусоидой против OCR
+    pad = height // 2
+    mask = _compose_text(atlas, text, width, height, pad, max_rotation, rng)
+    shifts = _sine_shifts(width, warp_amplitude, rng) if warp_amplitude else np.zeros(width, dtype=np.int32)
+    mask = _warp_columns(mask, size, shifts, pad)
+
+    # Цвет каждого пикселя по маске через таблицу: фон -> цвет текста
+    text_color = (rng.randint(0, 100), rng.randint(0, 100), rng.randint(0, 100))
+    palette = np.rint(np.array(background_color) * (1 - _ALPHA) + np.array(text_color) * _ALPHA).astype(np.uint8)
+    pixels = palette.take(mask.ravel(), axis=0)
+
+    # Добавляем шум: все точки за одну операцию по массиву координат
+    if noise_points:
+        points = np_rng.integers(0, width * height, noise_points)
+        pixels[points] = np_rng.integers(0, 256, (noise_points, 3), dtype=np.uint8)
+
+    image = Image.fromarray(pixels.reshape(height, width, 3), 'RGB')
+    draw = ImageDraw.Draw(image)
+
+    # Добавляем случайные линии для усложнения капчи
+    for _ in range(5):
+        start = (rng.randint(0, width), rng.randint(0, height))
+        end = (rng.randint(0, width), rng.randint(0, height))
+        line_color = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+        draw.line([start, end], fill=line_color, width=2)
+
+    # Один проход GaussianBlur вместо blur_intensity проходов ImageFilter.BLUR
+    if blur_intensity:
+        image = image.filter(ImageFilter.GaussianBlur(BLUR_PASS_RADIUS * blur_intensity ** 0.5))
+
+    # Сохраняем изображение в байтовый поток
+    byte_io = io.BytesIO(encode_image(image, image_format, quality, compress_level, colors))
+    byte_io.seek(0)
+
+    return byte_io
+
+
+def render_captcha(image_format="png", quality=75, compress_level=6, colors=32, seed=None):
+    """
+    Генерирует код и изображение image-капчи. Возвращает (code, bytes изображения).
+    С заданным seed результат воспроизводим (используется для примера капчи).
+    """
+    code = generate_captcha_code(rng=random.Random(seed) if seed is not None else random)
+    captcha_image = generate_captcha_image(
+        code, size=(200, 80), image_format=image_format, quality=quality,
+        compress_level=compress_level, colors=colors, seed=seed
+    )
+    return code, captcha_image.getvalue()
@@ -0,0 +1,165 @@
+# modules/captcha_journal.py
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from persist import WriteBehind
+
+logger = logging.getLogger(__name__)
+
+PENDING_FILE = 'lyssa_pending.jsonl'  # Журнал незавершённых капч
+
+# Журнал сжимается, когда устаревших строк становится больше, чем COMPACT_RATIO * живых (и не меньше COMPACT_MIN)
+COMPACT_RATIO = 2
+COMPACT_MIN = 1000
+
+# Строки копятся в памяти и дописываются на фоновом потоке не позже чем через WRITE_DELAY секунд
+WRITE_DELAY = 0.1
+
+
+class CaptchaJournal:
+    """
+    Журнал незавершённых капч с записью только в конец файла.
+    Каждая строка — JSON-операция: start (новая капча), update (изменение полей), done (капча завершена).
+    При загрузке операции проигрываются заново, после чего файл сжимается до живых записей.
+    Состояние в памяти меняется сразу, а запись и сжатие файла выполняются на фоновом потоке
+    в порядке поступления, чтобы всплеск входов не останавливал event loop.
+    """
+
+    def __init__(self, path: str = PENDING_FILE):
+        self.path = path
+        self._live = {}  # (chat_id, user_id) -> запись
+        self._file = None
+        self._lines = 0  # Строк в файле журнала с учётом ещё не записанных
+        self._queue = []  # ("line", строка) или ("compact", строки живых записей) в порядке поступления
+        self._queue_lock = threading.Lock()
+        self._io_lock = threading.Lock()  # Файл журнала трогает только один поток за раз
+        self._writer = WriteBehind("captcha-journal", delay=WRITE_DELAY)
+
+    def __len__(self):
+        return len(self._live)
+
+    def _apply(self, entry: dict):
+        key = (entry["chat"], entry["user"])
+        op = entry.pop("op")
+        if op == "start":
+            self._live[key] = entry
+        elif op == "update":
+            record = self._live.get(key)
+            if record is not None:
+                record.update(entry)
+        elif op == "done":
+            self._live.pop(key, None)
+
+    def load(self) -> list:
+        """Читает журнал и возвращает живые записи."""
+        self.flush()
+        self._live.clear()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except (json.JSONDecodeError, KeyError) as e:
+                        # Обычно это недописанная последняя строка после аварийной остановки
+                        logger.warning(f"Пропущена повреждённая строка журнала капч: {e}")
+        except FileNotFoundError:
+            pass
+        except IOError as e:
+            logger.error(f"Не удалось прочитать журнал капч: {e}")
+        self.compact()
+        self.flush()
+        return list(self._live.values())
+
+    def _enqueue(self, item):
+        with self._queue_lock:
+            self._queue.append(item)
+        self._writer.submit(self.path, self._write)
+
+    def _append(self, entry: dict):
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+        self._apply(entry)
+        self._enqueue(("line", line))
+        self._lines += 1
+        if self._lines > max(COMPACT_MIN, COMPACT_RATIO * len(self._live)):
+            self.compact()
+
+    def start(self, chat_id: int, user_id: int, **fields):
+        """Записывает новую капчу (заменяет прежнюю запись того же пользователя в чате)."""
+        self._append({"op": "start", "chat": chat_id, "user": user_id, **fields})
+
+    def update(self, chat_id: int, user_id: int, **fields):
+        """Изменяет поля незавершённой капчи."""
+        if (chat_id, user_id) in self._live:
+            self._append({"op": "update", "chat": chat_id, "user": user_id, **fields})
+
+    def done(self, chat_id: int, user_id: int):
+        """Отмечает капчу завершённой."""
+        if (chat_id, user_id) in self._live:
+            self._append({"op": "done", "chat": chat_id, "user": user_id})
+
+    def compact(self):
+        """Ставит в очередь атомарную перезапись журнала живыми записями на текущий момент."""
+        lines = [json.dumps({"op": "start", **record}, ensure_ascii=False, separators=(',', ':')) + '\n'
+                 for record in self._live.values()]
+        self._enqueue(("compact", lines))
+        self._lines = len(lines)
+
+    def _write(self):
+        """Выполняется на фоновом потоке: дописывает строки и сжимает журнал в порядке очереди."""
+        with self._queue_lock:
+            queue, self._queue = self._queue, []
+        with self._io_lock:
+            for kind, data in queue:
+                if kind == "line":
+                    try:
+                        if self._file is None:
+                            self._file = open(self.path, 'a', encoding='utf-8')
+                        self._file.write(data)
+                    except IOError as e:
+                        logger.error(f"Не удалось записать журнал капч: {e}")
+                else:
+                    self._rewrite(data)
+            if self._file is not None:
+                try:
+                    self._file.flush()
+                except IOError as e:
+                    logger.error(f"Не удалось записать журнал капч: {e}")
+
+    def _rewrite(self, lines: list):
+        """Атомарно подменяет файл журнала; при ошибке остаётся прежний файл со всеми строками."""
+        self._close_file()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.lyssa_pending.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Не удалось сжать журнал капч: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Блокирует до записи всех накопленных операций на диск."""
+        return self._writer.flush(timeout)
+
+    def close(self):
+        """Дописывает накопленные операции и закрывает файл журнала."""
+        self.flush()
+        with self._io_lock:
+            self._close_file()
+
+
+captcha_journal = CaptchaJournal()
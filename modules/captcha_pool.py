@@ -0,0 +1,74 @@
+# modules/captcha_pool.py
+
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class CaptchaPool:
+    """
+    Пул заранее отрисованных image-капч (code, PNG bytes).
+    Фоновая задача дозаполняет пул до size, как только в нём остаётся меньше low_water капч.
+    """
+
+    def __init__(self, render, size: int = 50, low_water: int = 20):
+        self._render = render  # Корутина без аргументов, возвращающая (code, bytes)
+        self.size = size
+        self.low_water = min(low_water, size)
+        self._items = deque()
+        self._refill_needed = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def configure(self, size: int, low_water: int):
+        """Меняет размер пула и порог дозаполнения."""
+        self.size = size
+        self.low_water = min(low_water, size)
+        while len(self._items) > size:
+            self._items.pop()
+        self._refill_needed.set()
+
+    def take(self):
+        """Забирает готовую капчу из пула за O(1). Возвращает None, если пул пуст."""
+        try:
+            item = self._items.popleft()
+        except IndexError:
+            item = None
+            logger.warning("Пул image капч пуст, капча будет отрисована на месте.")
+        if len(self._items) < self.low_water:
+            self._refill_needed.set()
+        return item
+
+    def start(self):
+        """Запускает фоновое заполнение пула (нужен запущенный event loop)."""
+        if self._task is None or self._task.done():
+            self._refill_needed.set()
+            self._task = asyncio.create_task(self._refill_loop(), name="captcha-pool-refill")
+
+    async def stop(self):
+        """Останавливает фоновое заполнение."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refill_loop(self):
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+            while len(self._items) < self.size:
+                try:
+                    item = await self._render()
+                except Exception as e:
+                    logger.error(f"Не удалось отрисовать капчу для пула: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                self._items.append(item)
+            logger.info(f"Пул image капч заполнен: {len(self._items)} шт.")
@@ -0,0 +1,112 @@
+# modules/chat_config.py
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from config import get_config
+from persist import WriteBehind
+from state_backend import StateBackendError, state_backend
+
+logger = logging.getLogger(__name__)
+
+# Настройки, которые можно переопределить для отдельного чата
+CHAT_KEYS = (
+    "access_level",
+    "captcha_type",
+    "time_limit",
+    "custom_captcha_message",
+    "button_text",
+    "banUsers",
+    "join_batch_captcha",
+)
+
+# Сколько «горячих» чатов держать в памяти
+CACHE_SIZE = 1024
+
+_cache = OrderedDict()  # chat_id -> (снимок глобальной конфигурации, объединённые настройки)
+_overrides = OrderedDict()  # chat_id -> dict с настройками чата
+_dirty = {}  # chat_id -> dict, ещё не записанные в хранилище
+_dirty_lock = threading.Lock()
+_writer = WriteBehind("chat_config")
+
+
+def _load_overrides(chat_id: int) -> dict:
+    """Возвращает настройки чата из памяти или из хранилища."""
+    pending = _dirty.get(chat_id)
+    if pending is not None:
+        return pending
+    if chat_id in _overrides:
+        _overrides.move_to_end(chat_id)
+        return _overrides[chat_id]
+
+    overrides = {}
+    try:
+        overrides = state_backend.get_chat_config(chat_id)
+    except (StateBackendError, json.JSONDecodeError) as e:
+        logger.error(f"Не удалось прочитать настройки чата {chat_id}: {e}")
+
+    _overrides[chat_id] = overrides
+    if len(_overrides) > CACHE_SIZE:
+        _overrides.popitem(last=False)
+    return overrides
+
+
+def get_chat_config(chat_id: int) -> MappingProxyType:
+    """Возвращает неизменяемые настройки чата: глобальная конфигурация + переопределения чата."""
+    base = get_config()
+    entry = _cache.get(chat_id)
+    if entry is not None and entry[0] is base:
+        _cache.move_to_end(chat_id)
+        return entry[1]
+
+    merged = dict(base)
+    merged.update(_load_overrides(chat_id))
+    merged = MappingProxyType(merged)
+    _cache[chat_id] = (base, merged)
+    _cache.move_to_end(chat_id)
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return merged
+
+
+def _write_chat_config(chat_id: int, overrides: dict):
+    """Записывает настройки чата в хранилище (выполняется на фоновом потоке)."""
+    state_backend.set_chat_config(chat_id, overrides)
+    # Снимаем пометку, только если за время записи не появилось новых изменений
+    with _dirty_lock:
+        if _dirty.get(chat_id) is overrides:
+            del _dirty[chat_id]
+    logger.info(f"Настройки чата {chat_id} сохранены.")
+
+
+def set_chat_config(chat_id: int, **changes):
+    """Меняет настройки чата в памяти и ставит запись одной строки в фоновую очередь."""
+    for key in changes:
+        if key not in CHAT_KEYS:
+            raise KeyError(f"Неизвестная настройка чата: {key}")
+
+    overrides = dict(_load_overrides(chat_id))
+    overrides.update(changes)
+    with _dirty_lock:
+        _dirty[chat_id] = overrides
+    _overrides[chat_id] = overrides
+    _overrides.move_to_end(chat_id)
+    _cache.pop(chat_id, None)
+    _writer.submit(chat_id, lambda: _write_chat_config(chat_id, overrides))
+
+
+def known_chat_ids() -> list:
+    """Возвращает идентификаторы всех чатов, для которых сохранены настройки."""
+    try:
+        chat_ids = state_backend.chat_ids()
+    except StateBackendError as e:
+        logger.error(f"Не удалось получить список чатов: {e}")
+        chat_ids = []
+    return sorted(set(chat_ids) | set(_dirty))
+
+
+def flush_chat_configs(timeout: float = 10.0) -> bool:
+    """Дожидается записи всех отложенных изменений настроек чатов."""
+    return _writer.flush(timeout)
@@ -3,32 +3,59 @@
 import logging
 import os
 import json
+import time
+from types import MappingProxyType
+from persist import WriteBehind, atomic_write_json
 
 logger = logging.getLogger(__name__)
 
 CONFIG_FILE = 'lyssa_config.json'  # Убедитесь, что путь корректный
 
+# Единые настройки по умолчанию для всех модулей
 DEFAULT_CONFIG = {
-    "access_level": "owner",
+    "access_level": "owner",  # owner, admin или all
+    "captcha_type": "button",  # Возможные: button, math, fruits, image
+    "time_limit": 60,  # Время на прохождение капчи в секундах
+    "custom_captcha_message": "Пожалуйста, подтвердите, что вы не бот!",
+    "button_text": "Я не бот!",
     "banUsers": False,  # False: кикать, True: банить
-    "time_limit": 60  # Пример другой настройки
-    # Добавьте другие ключи конфигурации по необходимости
+    "captcha_pool_size": 50,  # Сколько image капч держать отрисованными заранее
+    "captcha_pool_low_water": 20,  # Порог, ниже которого пул дозаполняется
+    "render_workers": 2,  # Процессы для отрисовки image капч
+    "render_queue_depth": 64,  # Максимум задач отрисовки в очереди пула процессов
+    "captcha_image_format": "png8",  # png, png8 (с палитрой), webp или jpeg
+    "captcha_image_quality": 75,  # Качество для webp и jpeg
+    "captcha_png_compress_level": 6,  # Уровень сжатия zlib для png и png8 (0-9)
+    "captcha_palette_colors": 32,  # Размер палитры для png8
+    "media_cache_size": 256,  # Сколько file_id загруженных файлов помнить
+    "member_cache_ttl": 30,  # Сколько секунд доверять закэшированному get_chat_member
+    "admin_roster_ttl": 600,  # Как часто (в секундах) перечитывать списки администраторов
+    "kick_unban_delay": 6,  # Через сколько секунд после кика снимать временный бан
+    "join_concurrency": 10,  # Сколько новых участников одного события обрабатывать одновременно
+    "join_batch_captcha": False,  # Одно сообщение button капчи на всех вошедших одним событием
+    "rate_global_per_second": 30,  # Общий лимит запросов к Bot API
+    "rate_group_per_minute": 20,  # Лимит сообщений в одну группу
+    "rate_max_retries": 3,  # Сколько раз повторять запрос после RetryAfter
+    "delete_batch_delay": 1.0  # Сколько секунд копить сообщения для пакетного удаления
 }
 
+# Как часто (в секундах) проверять mtime файла конфигурации
+RELOAD_CHECK_INTERVAL = 1.0
 
-def load_config() -> dict:
-    """Загружает конфигурацию из файла. Если файл отсутствует, создаёт его с настройками по умолчанию."""
-    if not os.path.exists(CONFIG_FILE):
-        logger.warning("Файл конфигурации не найден. Создаётся новый файл с настройками по умолчанию.")
-        save_config(DEFAULT_CONFIG)  # Создаём файл с настройками по умолчанию
-        return DEFAULT_CONFIG.copy()
-    try:
-        with open(CONFIG_FILE, "r", encoding="utf-8") as file:
-            config = json.load(file)
-        logger.info("Конфигурация успешно загружена.")
-    except (json.JSONDecodeError, IOError) as e:
-        logger.error(f"Ошибка при загрузке конфигурации: {e}")
-        return DEFAULT_CONFIG.copy()
+# Кэш конфигурации в памяти
+_snapshot = MappingProxyType(DEFAULT_CONFIG.copy())
+_mtime = None  # mtime файла, из которого получен текущий снимок
+_last_check = float('-inf')  # Время последней проверки mtime
+
+# Фоновая запись: серия изменений за SAVE_DELAY секунд сохраняется одной записью
+SAVE_DELAY = 0.5
+_writer = WriteBehind("config", delay=SAVE_DELAY)
+
+
+def _read_config_file() -> dict:
+    """Читает и разбирает файл конфигурации, дополняя отсутствующие ключи."""
+    with open(CONFIG_FILE, "r", encoding="utf-8") as file:
+        config = json.load(file)
 
     # Проверяем наличие ключей и добавляем отсутствующие
     updated = False
@@ -42,14 +69,70 @@ def load_config() -> dict:
         save_config(config)
         logger.info("Конфигурационный файл обновлён с добавлением отсутствующих ключей.")
 
-    return config.copy()
+    return config
 
 
-def save_config(config: dict):
-    """Сохраняет конфигурацию в файл."""
+def _refresh():
+    """Перечитывает файл конфигурации, только если он изменился на диске."""
+    global _snapshot, _mtime, _last_check
+
+    _last_check = time.monotonic()
+    try:
+        mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        logger.warning("Файл конфигурации не найден. Создаётся новый файл с настройками по умолчанию.")
+        save_config(DEFAULT_CONFIG)  # Создаём файл с настройками по умолчанию
+        return
+
+    if mtime == _mtime:
+        return
+
+    try:
+        config = _read_config_file()
+    except (json.JSONDecodeError, IOError) as e:
+        # Оставляем последний удачно прочитанный снимок
+        logger.error(f"Ошибка при загрузке конфигурации: {e}")
+        return
+
+    _snapshot = MappingProxyType(config)
+    _mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    logger.info("Конфигурация успешно загружена.")
+
+
+def get_config() -> MappingProxyType:
+    """Возвращает неизменяемый снимок конфигурации из памяти."""
+    if time.monotonic() - _last_check >= RELOAD_CHECK_INTERVAL:
+        _refresh()
+    return _snapshot
+
+
+def load_config() -> dict:
+    """Возвращает изменяемую копию текущей конфигурации (без чтения с диска)."""
+    return dict(get_config())
+
+
+def _write_config_file(config: dict):
+    """Атомарно записывает конфигурацию на диск (выполняется на фоновом потоке)."""
+    global _mtime, _last_check
+
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=4)
+        atomic_write_json(CONFIG_FILE, config)
+        _mtime = os.stat(CONFIG_FILE).st_mtime_ns
+        _last_check = time.monotonic()
         logger.info("Конфигурационный файл успешно сохранён.")
     except Exception as e:
         logger.error(f"Не удалось сохранить конфигурационный файл: {e}")
+
+
+def save_config(config: dict):
+    """Обновляет снимок в памяти и ставит запись файла в фоновую очередь."""
+    global _snapshot
+
+    config = dict(config)
+    _snapshot = MappingProxyType(config)
+    _writer.submit(CONFIG_FILE, lambda: _write_config_file(config))
+
+
+def flush_config(timeout: float = 10.0) -> bool:
+    """Дожидается записи всех отложенных изменений конфигурации."""
+    return _writer.flush(timeout)
@@ -0,0 +1,115 @@
+# modules/deadlines.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """
+    Таймеры капч на одной куче и одной asyncio-задаче вместо отдельных заданий JobQueue.
+    Таймер идентифицируется ключом (например, (chat_id, user_id)) и видом ("warning", "kick").
+    Добавление — O(log n), отмена — O(1): запись удаляется из словаря, а в куче
+    пропускается при извлечении.
+    """
+
+    def __init__(self):
+        self._heap = []  # (время срабатывания, номер, ключ, вид)
+        self._timers = {}  # ключ -> {вид: (номер, время срабатывания, callback, args)}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._context = None
+        self._task = None
+        self._running = set()  # Выполняющиеся callback, чтобы задачи не собрал сборщик мусора
+
+    def __len__(self):
+        return sum(len(timers) for timers in self._timers.values())
+
+    def schedule(self, key, kind: str, delay: float, callback, *args):
+        """
+        Через delay секунд вызывает callback(context, *args).
+        Таймер того же ключа и вида заменяется.
+        """
+        seq = next(self._seq)
+        when = time.monotonic() + delay
+        self._timers.setdefault(key, {})[kind] = (seq, when, callback, args)
+        if not self._heap or when < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (when, seq, key, kind))
+
+    def cancel(self, key, kind: str = None):
+        """Отменяет таймер указанного вида или все таймеры ключа."""
+        if kind is None:
+            self._timers.pop(key, None)
+            return
+        timers = self._timers.get(key)
+        if timers is not None:
+            timers.pop(kind, None)
+            if not timers:
+                del self._timers[key]
+
+    def remaining(self, key, kind: str):
+        """Сколько секунд осталось до срабатывания таймера или None, если таймера нет."""
+        timer = self._timers.get(key, {}).get(kind)
+        return None if timer is None else max(0.0, timer[1] - time.monotonic())
+
+    def start(self, context):
+        """Запускает обработку таймеров; context передаётся в callback (нужен запущенный event loop)."""
+        self._context = context
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="captcha-deadlines")
+
+    async def stop(self):
+        """Останавливает обработку таймеров и дожидается уже запущенных callback."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._running:
+            # Callback успевают поставить бан в kick_pipeline до его остановки
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _pop_due(self, now: float) -> list:
+        """Извлекает все наступившие таймеры, пропуская отменённые и заменённые."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, key, kind = heapq.heappop(self._heap)
+            timers = self._timers.get(key)
+            timer = timers.get(kind) if timers else None
+            if timer is None or timer[0] != seq:
+                continue
+            del timers[kind]
+            if not timers:
+                del self._timers[key]
+            due.append(timer)
+        return due
+
+    async def _fire(self, callback, args):
+        try:
+            await callback(self._context, *args)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике таймера {callback.__name__}{args}: {e}")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            for _, _, callback, args in self._pop_due(time.monotonic()):
+                # Обработчики выполняются параллельно, чтобы медленный не задерживал остальные
+                task = asyncio.create_task(self._fire(callback, args))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._heap[0][0] - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,107 @@
+# modules/delete_batcher.py
+
+import asyncio
+import logging
+import time
+from config import DEFAULT_CONFIG, get_config
+
+logger = logging.getLogger(__name__)
+
+# Максимум сообщений в одном вызове deleteMessages
+MAX_BATCH_SIZE = 100
+
+
+class DeleteBatcher:
+    """
+    Пакетное удаление сообщений: message_id копятся по чатам и удаляются
+    одним delete_messages, когда набралось batch_size штук или прошло delay секунд
+    с момента добавления первого из них.
+    """
+
+    def __init__(self, delay: float = 1.0, batch_size: int = MAX_BATCH_SIZE):
+        self.delay = delay
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self._pending = {}  # chat_id -> список message_id
+        self._deadlines = {}  # chat_id -> время, когда пачку нужно отправить
+        self._wakeup = asyncio.Event()
+        self._bot = None
+        self._task = None
+        self.deleted = 0  # Сколько message_id отправлено на удаление
+        self.failed = 0  # Сколько message_id не удалось удалить
+        self.calls = 0  # Сколько вызовов delete_messages сделано
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество сообщений, ожидающих удаления."""
+        return sum(len(ids) for ids in self._pending.values())
+
+    def delete(self, chat_id: int, message_id: int):
+        """Ставит сообщение в очередь на удаление и сразу возвращает управление."""
+        ids = self._pending.setdefault(chat_id, [])
+        if not ids:
+            self._deadlines[chat_id] = time.monotonic() + self.delay
+        ids.append(message_id)
+        if len(ids) >= self.batch_size:
+            self._deadlines[chat_id] = 0.0
+            self._wakeup.set()
+        elif len(ids) == 1:
+            self._wakeup.set()
+
+    def start(self, bot):
+        """Запускает фоновую задачу удаления (нужен запущенный event loop)."""
+        self._bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="delete-batcher")
+
+    async def stop(self):
+        """Останавливает фоновую задачу и удаляет всё, что осталось в очереди."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending and self._bot is not None:
+            await self._flush(list(self._pending))
+
+    async def _delete_chunk(self, chat_id: int, ids: list):
+        self.calls += 1
+        try:
+            await self._bot.delete_messages(chat_id=chat_id, message_ids=ids)
+            self.deleted += len(ids)
+            logger.info(f"Удалено {len(ids)} сообщений в чате {chat_id}.")
+        except Exception as e:
+            # Telegram пропускает уже удалённые сообщения, ошибка означает, что не удалилась вся пачка
+            self.failed += len(ids)
+            logger.error(f"Не удалось удалить {len(ids)} сообщений в чате {chat_id}: {e}")
+
+    async def _flush(self, chat_ids):
+        chunks = []
+        for chat_id in chat_ids:
+            ids = self._pending.pop(chat_id, [])
+            self._deadlines.pop(chat_id, None)
+            for start in range(0, len(ids), self.batch_size):
+                chunks.append((chat_id, ids[start:start + self.batch_size]))
+        await asyncio.gather(*(self._delete_chunk(chat_id, ids) for chat_id, ids in chunks))
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            due = [chat_id for chat_id, deadline in self._deadlines.items() if deadline <= now]
+            if due:
+                await self._flush(due)
+                continue
+
+            if not self._deadlines:
+                await self._wakeup.wait()
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(self._deadlines.values()) - now)
+            except asyncio.TimeoutError:
+                pass
+
+
+delete_batcher = DeleteBatcher(delay=get_config().get("delete_batch_delay", DEFAULT_CONFIG["delete_batch_delay"]))
@@ -0,0 +1,113 @@
+# modules/kick_pipeline.py
+
+import asyncio
+import heapq
+import logging
+import time
+from member_cache import member_cache
+
+logger = logging.getLogger(__name__)
+
+
+class KickPipeline:
+    """
+    Очередь отложенных разбанов для режима кика.
+    Хендлер только банит пользователя и ставит разбан в очередь,
+    а одна фоновая задача снимает наступившие баны пачками.
+    """
+
+    def __init__(self, delay: float = 6.0, batch_size: int = 50):
+        self.delay = delay
+        self.batch_size = batch_size
+        self._heap = []  # (время разбана, chat_id, user_id)
+        self._pending = {}  # (chat_id, user_id) -> время разбана; записи кучи без пары здесь устарели
+        self._wakeup = asyncio.Event()
+        self._bot = None
+        self._task = None
+        self.unban_lag = 0.0  # Насколько позже срока был снят последний бан, в секундах
+        self.failed = 0  # Количество неудачных разбанов
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество пользователей, ожидающих разбана."""
+        return len(self._pending)
+
+    def schedule(self, chat_id: int, user_id: int):
+        """Ставит разбан в очередь и сразу возвращает управление."""
+        due = time.monotonic() + self.delay
+        self._pending[(chat_id, user_id)] = due
+        heapq.heappush(self._heap, (due, chat_id, user_id))
+        self._wakeup.set()
+
+    def cancel(self, chat_id: int, user_id: int):
+        """Отменяет разбан (например, если пользователя решили забанить насовсем)."""
+        self._pending.pop((chat_id, user_id), None)
+
+    def start(self, bot):
+        """Запускает фоновую задачу разбанов (нужен запущенный event loop)."""
+        self._bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="kick-pipeline")
+
+    async def stop(self):
+        """Останавливает фоновую задачу и сразу снимает все оставшиеся баны."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending and self._bot is not None:
+            logger.info(f"Снимаются оставшиеся временные баны: {len(self._pending)}.")
+            while self._pending:
+                await self._unban_batch(float('inf'))
+
+    def _pop_due(self, now: float) -> list:
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            due, chat_id, user_id = heapq.heappop(self._heap)
+            if self._pending.get((chat_id, user_id)) == due:
+                del self._pending[(chat_id, user_id)]
+                batch.append((due, chat_id, user_id))
+        return batch
+
+    async def _unban(self, chat_id: int, user_id: int):
+        try:
+            await self._bot.unban_chat_member(chat_id=chat_id, user_id=user_id, only_if_banned=True)
+            logger.info(f"Временный бан снят, пользователь {user_id} кикнут из чата {chat_id}.")
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Не удалось снять временный бан пользователя {user_id} в чате {chat_id}: {e}")
+        finally:
+            member_cache.invalidate(chat_id, user_id)
+
+    async def _unban_batch(self, now: float):
+        batch = self._pop_due(now)
+        if not batch:
+            return
+        await asyncio.gather(*(self._unban(chat_id, user_id) for _, chat_id, user_id in batch))
+        if now != float('inf'):
+            self.unban_lag = time.monotonic() - batch[0][0]
+
+    async def _run(self):
+        while True:
+            # Отбрасываем отменённые записи в голове кучи
+            while self._heap and self._pending.get(self._heap[0][1:]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            timeout = self._heap[0][0] - time.monotonic()
+            if timeout > 0:
+                try:
+                    # Новая запись могла оказаться раньше текущей головы кучи
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+            await self._unban_batch(time.monotonic())
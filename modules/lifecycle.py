@@ -0,0 +1,41 @@
+# modules/lifecycle.py
+
+import asyncio
+import signal
+
+
+async def wait_for_stop_signal(signals=(signal.SIGINT, signal.SIGTERM)):
+    """Ждёт сигнала остановки процесса."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # На Windows обработчики сигналов недоступны, остановка по KeyboardInterrupt
+            pass
+    await stop.wait()
+
+
+async def run_application(application, serve):
+    """
+    Запускает приложение с тем же жизненным циклом, что и run_polling:
+    initialize → post_init → start → serve() → stop → post_stop → shutdown → post_shutdown.
+    serve — корутина-функция, получающая обновления, пока приложение работает.
+    """
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        try:
+            await serve()
+        finally:
+            if application.running:
+                await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -1,77 +1,47 @@
 import logging
-import json
-import os
 from telegram import Update
 from telegram.ext import ContextTypes
+from chat_config import get_chat_config, set_chat_config
+from admin_roster import admin_roster
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
 
-# Путь к конфигурационному файлу
-CONFIG_FILE = 'lyssa_config.json'
-
 # Допустимые уровни доступа
 VALID_ACCESS_LEVELS = ["owner", "admin", "all"]
 
-# Функция для загрузки конфигурации из файла
-def load_config() -> dict:
-    if not os.path.exists(CONFIG_FILE):
-        # Если файл не существует, создаём его с уровнем доступа "owner"
-        default_config = {"access_level": "owner"}
-        save_config(default_config)
-        return default_config
-    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-        try:
-            config = json.load(f)
-            if "access_level" not in config:
-                config["access_level"] = "owner"
-                save_config(config)
-            return config
-        except json.JSONDecodeError:
-            logger.error("Ошибка при чтении конфигурационного файла. Создаётся новый файл.")
-            default_config = {"access_level": "owner"}
-            save_config(default_config)
-            return default_config
-
-# Функция для сохранения конфигурации в файл
-def save_config(config: dict):
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=4)
-    logger.info(f"Конфигурация сохранена: {config}")
-
 # Функция для получения текущего уровня доступа
-def get_access_level() -> str:
-    config = load_config()
-    return config.get("access_level", "owner")
+def get_access_level(chat_id: int) -> str:
+    return get_chat_config(chat_id).get("access_level", "owner")
 
 # Синхронная функция для установки нового уровня доступа
-def set_access_level(level: str):
+def set_access_level(chat_id: int, level: str):
     if level not in VALID_ACCESS_LEVELS:
         logger.error(f"Недопустимый уровень доступа: {level}")
         raise ValueError("Уровень доступа должен быть 'owner', 'admin' или 'all'.")
 
-    config = load_config()
-    config["access_level"] = level
-    save_config(config)
-    logger.info(f"Уровень доступа установлен на: {level}")
+    set_chat_config(chat_id, access_level=level)
+    logger.info(f"Уровень доступа в чате {chat_id} установлен на: {level}")
 
 # Функция для проверки прав пользователя
 async def has_permission(update: Update, context: ContextTypes.DEFAULT_TYPE, required_level: str = "admin") -> bool:
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id
-    current_level = get_access_level()
+    current_level = get_access_level(chat_id)
 
     if current_level == "all":
         return True  # Все пользователи имеют доступ
 
-    try:
-        user_status = await context.bot.get_chat_member(chat_id, user_id)
-        if current_level == "admin" and user_status.status in ["administrator", "creator"]:
-            return True
-        if current_level == "owner" and user_status.status == "creator":
-            return True
-    except Exception as e:
-        logger.error(f"Ошибка при проверке прав пользователя {user_id}: {e}")
+    if update.effective_chat.type == "private":
+        return False  # В личных сообщениях администраторов нет
+
+    # Список администраторов чата хранится в памяти, сетевой запрос нужен только при первой проверке
+    roster = await admin_roster.get(context.bot, chat_id)
+    status = roster.get(user_id)
+    if current_level == "admin" and status in ["administrator", "creator"]:
+        return True
+    if current_level == "owner" and status == "creator":
+        return True
 
     return False
 
@@ -87,7 +57,7 @@ async def lock_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Проверка наличия аргументов
     if not context.args:
-        current_level = get_access_level()
+        current_level = get_access_level(update.effective_chat.id)
         logger.info(f"Текущий уровень доступа: {current_level}")
         await update.message.reply_text(f"Текущий уровень доступа: {current_level}")
         return
@@ -103,7 +73,7 @@ async def lock_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Установка уровня доступа
     try:
-        set_access_level(level)  # Синхронный вызов
+        set_access_level(update.effective_chat.id, level)  # Синхронный вызов
         await update.message.reply_text(f"Уровень доступа изменен на: {level}")
         logger.info(f"Уровень доступа успешно изменен на: {level}")
     except ValueError as e:
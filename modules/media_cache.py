@@ -0,0 +1,96 @@
+# modules/media_cache.py
+
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from telegram import InputFile
+from telegram.error import BadRequest
+from config import DEFAULT_CONFIG, get_config
+from persist import WriteBehind, atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_FILE = 'lyssa_media_cache.json'  # Хэш содержимого -> file_id Telegram
+
+
+class MediaCache:
+    """
+    LRU-кэш file_id уже загруженных в Telegram файлов, ключ — SHA-256 содержимого.
+    Сохраняется на диск в фоне, чтобы переживать перезапуски.
+    """
+
+    def __init__(self, path: str = MEDIA_CACHE_FILE, capacity: int = 256):
+        self.path = path
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._writer = WriteBehind("media_cache")
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries.update(json.load(f))
+            logger.info(f"Загружено {len(self._entries)} file_id из кэша медиа.")
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"Не удалось загрузить кэш медиа: {e}")
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def _save(self):
+        # Снимок берём сразу, запись выполняется на фоновом потоке
+        entries = dict(self._entries)
+        self._writer.submit(self.path, lambda: atomic_write_json(self.path, entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str):
+        """Возвращает file_id по ключу или None."""
+        file_id = self._entries.get(key)
+        if file_id is not None:
+            self._entries.move_to_end(key)
+        return file_id
+
+    def put(self, key: str, file_id: str):
+        """Запоминает file_id, вытесняя самые давно использованные записи."""
+        self._entries[key] = file_id
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+        self._save()
+
+    def discard(self, key: str):
+        """Удаляет запись, например если Telegram больше не принимает file_id."""
+        if self._entries.pop(key, None) is not None:
+            self._save()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Дожидается записи кэша на диск."""
+        return self._writer.flush(timeout)
+
+
+media_cache = MediaCache(capacity=get_config().get("media_cache_size", DEFAULT_CONFIG["media_cache_size"]))
+
+
+async def send_cached_photo(bot, chat_id: int, photo: bytes, filename: str, **kwargs):
+    """
+    Отправляет фото по file_id, если такое содержимое уже загружалось,
+    иначе загружает файл и запоминает file_id из ответа.
+    """
+    key = hashlib.sha256(photo).hexdigest()
+    file_id = media_cache.get(key)
+    if file_id is not None:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except BadRequest as e:
+            logger.warning(f"file_id из кэша медиа не принят ({e}), файл будет загружен заново.")
+            media_cache.discard(key)
+
+    message = await bot.send_photo(chat_id=chat_id, photo=InputFile(photo, filename=filename), **kwargs)
+    if message.photo:
+        # Последний элемент — самый крупный размер, его и переиспользуем
+        media_cache.put(key, message.photo[-1].file_id)
+    return message
@@ -0,0 +1,96 @@
+# modules/member_cache.py
+
+import asyncio
+import logging
+import time
+from telegram import Update
+from telegram.ext import ContextTypes
+from config import DEFAULT_CONFIG, get_config
+
+logger = logging.getLogger(__name__)
+
+
+class MemberCache:
+    """
+    Кэш get_chat_member по (chat_id, user_id) с TTL.
+    Одновременные запросы одного участника объединяются в один вызов API.
+    """
+
+    def __init__(self, ttl: float = 30.0, capacity: int = 10000):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._entries = {}  # (chat_id, user_id) -> (время истечения, ChatMember)
+        self._in_flight = {}  # (chat_id, user_id) -> asyncio.Future
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, chat_id: int, member):
+        """Кладёт в кэш свежие данные участника (например, из ChatMemberUpdated)."""
+        key = (chat_id, member.user.id)
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, member)
+        if len(self._entries) > self.capacity:
+            # Вытесняем самую старую запись (dict хранит порядок вставки)
+            del self._entries[next(iter(self._entries))]
+
+    def invalidate(self, chat_id: int, user_id: int):
+        """Сбрасывает запись, когда статус участника мог измениться."""
+        self._entries.pop((chat_id, user_id), None)
+
+    async def get(self, bot, chat_id: int, user_id: int):
+        """Возвращает ChatMember из кэша или запрашивает его через get_chat_member."""
+        key = (chat_id, user_id)
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    return entry[1]
+                del self._entries[key]
+
+            future = self._in_flight.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    # Отменили сам ожидающий вызов
+                    raise
+                # Отменён первый вызов, а не этот: запрашиваем заново
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            member = await bot.get_chat_member(chat_id, user_id)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # Исключение уже передано ожидающим, здесь его помечаем как полученное
+                future.exception()
+            else:
+                # Первый вызов отменён: ожидающие повторяют запрос сами
+                future.cancel()
+            raise
+        else:
+            self.put(chat_id, member)
+            future.set_result(member)
+            return member
+        finally:
+            self._in_flight.pop(key, None)
+
+member_cache = MemberCache(ttl=get_config().get("member_cache_ttl", DEFAULT_CONFIG["member_cache_ttl"]))
+
+
+async def get_chat_member(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int):
+    """get_chat_member через кэш участников."""
+    return await member_cache.get(context.bot, chat_id, user_id)
+
+
+async def track_member_changes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обновляет кэш участников по событиям ChatMemberUpdated."""
+    change = update.chat_member or update.my_chat_member
+    if change:
+        member_cache.put(change.chat.id, change.new_chat_member)
+        logger.debug(f"Статус пользователя {change.new_chat_member.user.id} в чате {change.chat.id}: "
+                     f"{change.new_chat_member.status}")
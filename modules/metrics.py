@@ -0,0 +1,272 @@
+# modules/metrics.py
+
+import asyncio
+import bisect
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Время прохождения капчи: от секунд до нескольких минут
+SOLVE_BUCKETS = (1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 300.0)
+
+# Как часто измерять задержку event loop
+LOOP_LAG_INTERVAL = 0.5
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик с метками."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}  # значения меток -> число
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        return [f"{self.name}{_labels(self.labels, values)} {_number(value)}"
+                for values, value in self._values.items()]
+
+
+class Gauge:
+    """Текущее значение; func вызывается при каждом чтении метрик."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, func=None, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.func = func
+        self._values = {}
+
+    def set(self, value, *label_values):
+        self._values[label_values] = value
+
+    def render(self) -> list:
+        if self.func is not None:
+            try:
+                return [f"{self.name} {_number(self.func())}"]
+            except Exception as e:
+                logger.error(f"Не удалось получить значение метрики {self.name}: {e}")
+                return []
+        return [f"{self.name}{_labels(self.labels, values)} {_number(value)}"
+                for values, value in self._values.items()]
+
+
+class Histogram:
+    """Гистограмма с накопительными корзинами, суммой и количеством наблюдений."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # значения меток -> [счётчики корзин..., сумма, количество]
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return series[-1] if series else 0
+
+    def render(self) -> list:
+        lines = []
+        for values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Набор метрик, отдаваемых в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, func=None, labels=()) -> Gauge:
+        return self._register(Gauge(name, help_text, func, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Воронка капч
+captchas_issued = registry.counter("lyssa_captchas_issued_total", "Выдано капч", ("type", "chat"))
+captchas_passed = registry.counter("lyssa_captchas_passed_total", "Пройдено капч", ("type", "chat"))
+captchas_failed = registry.counter(
+    "lyssa_captchas_failed_total", "Не пройдено капч (timeout — истекло время, wrong — неверный ответ)",
+    ("type", "chat", "reason"),
+)
+captcha_solve_seconds = registry.histogram(
+    "lyssa_captcha_solve_seconds", "Время от выдачи капчи до верного ответа", ("type",), SOLVE_BUCKETS,
+)
+captcha_render_seconds = registry.histogram(
+    "lyssa_captcha_render_seconds", "Время отрисовки image капчи (generate_captcha_image) с ожиданием в очереди",
+)
+
+# Bot API
+api_request_seconds = registry.histogram("lyssa_bot_api_request_seconds", "Время запроса к Bot API", ("method",))
+api_errors = registry.counter("lyssa_bot_api_errors_total", "Ошибки запросов к Bot API", ("method", "error"))
+
+# Обработчики
+handler_seconds = registry.histogram("lyssa_handler_seconds", "Время выполнения обработчика", ("handler",))
+handler_errors = registry.counter("lyssa_handler_errors_total", "Исключения в обработчиках", ("handler", "error"))
+
+# Event loop
+loop_lag_seconds = registry.histogram(
+    "lyssa_event_loop_lag_seconds", "Опоздание пробуждения event loop относительно запланированного",
+)
+
+
+def instrument(func):
+    """Декоратор для корутин: время выполнения и исключения по имени функции."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            handler_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+class LoopLagMonitor:
+    """Периодически засыпает на interval секунд и записывает, на сколько event loop опоздал с пробуждением."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="loop-lag")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, time.monotonic() - started - self.interval)
+            loop_lag_seconds.observe(self.last_lag)
+
+
+class MetricsServer:
+    """HTTP-сервер на asyncio, отдающий /metrics в формате Prometheus."""
+
+    def __init__(self, registry: Registry, listen: str = "127.0.0.1", port: int = 9108):
+        self.registry = registry
+        self.listen = listen
+        self.port = port
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            # Заголовки запроса не нужны, но их нужно дочитать
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.listen, self.port)
+        logger.info(f"Метрики доступны на http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+loop_lag_monitor = LoopLagMonitor()
@@ -0,0 +1,291 @@
+# modules/outbound.py
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import DEFAULT_CONFIG, get_config
+from metrics import api_errors, api_request_seconds
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше — раньше
+PRIORITY_MODERATION = 0  # Ограничение, бан и разбан
+PRIORITY_DEFAULT = 1  # Ответы на кнопки, запросы данных
+PRIORITY_MESSAGE = 2  # Тексты капч, предупреждения, редактирование
+PRIORITY_DELETE = 3  # Удаление сообщений
+
+MODERATION_ENDPOINTS = {"restrictChatMember", "banChatMember", "unbanChatMember"}
+DELETE_ENDPOINTS = {"deleteMessage", "deleteMessages"}
+
+# Одинаковые запросы этих методов, ожидающие выполнения, объединяются в один
+COALESCED_ENDPOINTS = MODERATION_ENDPOINTS | DELETE_ENDPOINTS | {"getChatMember", "getChatAdministrators"}
+
+
+def endpoint_priority(endpoint: str) -> int:
+    """Возвращает класс приоритета для метода Bot API."""
+    if endpoint in MODERATION_ENDPOINTS:
+        return PRIORITY_MODERATION
+    if endpoint in DELETE_ENDPOINTS:
+        return PRIORITY_DELETE
+    if endpoint.startswith(("send", "edit", "copy", "forward")):
+        return PRIORITY_MESSAGE
+    return PRIORITY_DEFAULT
+
+
+def is_chat_limited(endpoint: str) -> bool:
+    """Методы, на которые распространяется лимит сообщений в чат."""
+    return endpoint.startswith(("send", "copy", "forward"))
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity накопленных."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # До этого момента запросы не отправляются (после RetryAfter)
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float, need_token: bool = True) -> float:
+        """Сколько секунд ждать до возможности отправить запрос."""
+        wait = max(0.0, self.blocked_until - now)
+        if need_token:
+            self._refill(now)
+            if self.tokens < 1:
+                wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def delay_for(self, now: float, count: int) -> float:
+        """Сколько секунд ждать, пока накопится count токенов."""
+        self._refill(now)
+        return max(0.0, self.blocked_until - now, (count - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """
+    Планировщик исходящих запросов Bot API, подключается через ApplicationBuilder().rate_limiter().
+
+    - глобальное ведро токенов (около 30 запросов в секунду) и ведро на каждый чат
+      (около 20 сообщений в минуту в группе, 1 в секунду в личном чате);
+    - запросы ждут в очередях по приоритету: модерация раньше сообщений, удаления последними;
+    - при RetryAfter чат (или весь бот) приостанавливается на указанное время, запрос повторяется;
+    - одинаковые ожидающие запросы модерации и удаления выполняются один раз.
+    """
+
+    def __init__(self, global_rate: float = 30.0, group_per_minute: float = 20.0,
+                 private_rate: float = 1.0, max_retries: int = 3):
+        self.group_rate = group_per_minute / 60.0
+        self.group_capacity = group_per_minute
+        self.private_rate = private_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}  # chat_id -> TokenBucket
+        self._queues = {}  # (chat_id, ограничен ли лимитом чата) -> куча (приоритет, номер, future)
+        self._coalesced = {}  # ключ запроса -> future с результатом
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.retries = 0  # Сколько раз запросы повторялись после RetryAfter
+        self.coalesced = 0  # Сколько запросов объединено с уже ожидающими
+
+    async def initialize(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch(), name="outbound-scheduler")
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for heap in self._queues.values():
+            for _, _, future in heap:
+                if not future.done():
+                    future.cancel()
+        self._queues.clear()
+
+    @property
+    def global_rate(self) -> float:
+        return self._global.rate
+
+    def set_global_rate(self, rate: float):
+        """Меняет общий лимит запросов (шарды делят лимит бота между собой)."""
+        self._global.rate = rate
+        self._global.capacity = max(1.0, rate)
+        self._global.tokens = min(self._global.tokens, self._global.capacity)
+
+    def queue_depth(self, chat_id=None) -> int:
+        """Количество ожидающих запросов в чате или во всех очередях, если chat_id не указан."""
+        if chat_id is None:
+            return sum(len(heap) for heap in self._queues.values())
+        return sum(len(heap) for (key, _), heap in self._queues.items() if key == chat_id)
+
+    def queue_depths(self) -> dict:
+        """Количество ожидающих запросов по чатам."""
+        depths = {}
+        for (chat_id, _), heap in self._queues.items():
+            if heap:
+                depths[chat_id] = depths.get(chat_id, 0) + len(heap)
+        return depths
+
+    def chat_delay(self, chat_id) -> float:
+        """Примерно через сколько секунд уйдёт новое сообщение в чат с учётом очереди сообщений и лимита чата."""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            return 0.0
+        queued = len(self._queues.get((chat_id, True), ()))
+        return bucket.delay_for(time.monotonic(), queued + 1)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные идентификаторы — группы и каналы
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_capacity)
+            else:
+                bucket = TokenBucket(self.private_rate, 1)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id, limited: bool, priority: int):
+        """Ждёт своей очереди на отправку запроса."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queues.setdefault((chat_id, limited), []), (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    def _block(self, chat_id, seconds: float):
+        bucket = self._global if chat_id is None else self._chat_bucket(chat_id)
+        bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + seconds)
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            best = None
+            wait = float('inf')
+            for key in list(self._queues):
+                heap = self._queues[key]
+                # Отбрасываем запросы, ожидание которых отменили
+                while heap and heap[0][2].done():
+                    heapq.heappop(heap)
+                chat_id, limited = key
+                if not heap:
+                    del self._queues[key]
+                    bucket = self._chats.get(chat_id)
+                    if bucket is not None and (chat_id, not limited) not in self._queues and bucket.idle(now):
+                        del self._chats[chat_id]
+                    continue
+                delay = 0.0 if chat_id is None else self._chat_bucket(chat_id).delay(now, limited)
+                if delay > 0:
+                    wait = min(wait, delay)
+                elif best is None or heap[0][:2] < self._queues[best][0][:2]:
+                    best = key
+
+            if best is not None:
+                delay = self._global.delay(now)
+                if delay <= 0:
+                    self._global.take()
+                    chat_id, limited = best
+                    if limited:
+                        self._chat_bucket(chat_id).take()
+                    heapq.heappop(self._queues[best])[2].set_result(None)
+                    continue
+                wait = min(wait, delay)
+
+            if wait == float('inf'):
+                await self._wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _send(self, callback, args, kwargs, endpoint, data, priority):
+        chat_id = data.get("chat_id")
+        limited = chat_id is not None and is_chat_limited(endpoint)
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, limited, priority)
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except Exception as e:
+                api_errors.inc(endpoint, type(e).__name__)
+                if not isinstance(e, RetryAfter):
+                    raise
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                self._block(chat_id, retry_after)
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning(f"{endpoint} в чате {chat_id}: превышен лимит, повтор через {retry_after} с.")
+            finally:
+                api_request_seconds.observe(time.perf_counter() - started, endpoint)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # rate_limit_args может задать приоритет явно
+        priority = rate_limit_args if isinstance(rate_limit_args, int) else endpoint_priority(endpoint)
+
+        if endpoint not in COALESCED_ENDPOINTS:
+            return await self._send(callback, args, kwargs, endpoint, data, priority)
+
+        key = (endpoint, json.dumps(data, sort_keys=True, default=str))
+        while True:
+            shared = self._coalesced.get(key)
+            if shared is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(shared)
+            except asyncio.CancelledError:
+                # Отмена первого запроса не касается ожидающих: один из них отправляет запрос сам.
+                # Отмену самого ожидающего и остановку планировщика передаём дальше
+                if not shared.cancelled() or self._task is None:
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._coalesced[key] = future
+        try:
+            result = await self._send(callback, args, kwargs, endpoint, data, priority)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # Исключение уже передано ожидающим, здесь его помечаем как полученное
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._coalesced.pop(key, None)
+
+
+outbound_scheduler = OutboundScheduler(
+    global_rate=get_config().get("rate_global_per_second", DEFAULT_CONFIG["rate_global_per_second"]),
+    group_per_minute=get_config().get("rate_group_per_minute", DEFAULT_CONFIG["rate_group_per_minute"]),
+    max_retries=get_config().get("rate_max_retries", DEFAULT_CONFIG["rate_max_retries"]),
+)
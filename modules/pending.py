@@ -0,0 +1,88 @@
+# modules/pending.py
+
+
+class PendingCaptcha:
+    """
+    Состояние незавершённой капчи одного пользователя в одном чате.
+    __slots__ вместо нескольких вложенных словарей: одна компактная запись на пользователя.
+    """
+
+    __slots__ = (
+        "chat_id",
+        "user_id",
+        "captcha_type",  # button, math, fruits или image
+        "answer",  # Ответ math капчи или код image капчи
+        "index",  # Сколько символов image капчи уже введено
+        "captcha_message_id",
+        "warning_message_id",
+        "batch_message_id",  # Общее сообщение капчи для нескольких пользователей
+        "batch_button",  # (текст, callback_data) кнопки пользователя в общем сообщении
+        "deadline",  # Время кика (time.time())
+        "warn_at",  # Время предупреждения (time.time())
+        "issued_at",  # Время выдачи капчи (time.time()), для метрики времени прохождения
+    )
+
+    def __init__(self, chat_id: int, user_id: int, captcha_type: str, answer=None):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.captcha_type = captcha_type
+        self.answer = answer
+        self.index = 0
+        self.captcha_message_id = None
+        self.warning_message_id = None
+        self.batch_message_id = None
+        self.batch_button = None
+        self.deadline = 0.0
+        self.warn_at = 0.0
+        self.issued_at = 0.0
+
+    @property
+    def key(self) -> tuple:
+        return self.chat_id, self.user_id
+
+    def message_ids(self) -> dict:
+        """Сообщения, которые нужно удалить после завершения капчи."""
+        ids = {
+            "captcha": self.captcha_message_id,
+            "warning": self.warning_message_id,
+            "batch": self.batch_message_id,
+        }
+        return {kind: message_id for kind, message_id in ids.items() if message_id is not None}
+
+    def to_record(self) -> dict:
+        """Поля для журнала незавершённых капч (chat_id и user_id журнал добавляет сам)."""
+        return {
+            "type": self.captcha_type,
+            "answer": self.answer,
+            "index": self.index,
+            "captcha": self.captcha_message_id,
+            "warning": self.warning_message_id,
+            "batch": self.batch_message_id,
+            "batch_button": self.batch_button,
+            "deadline": self.deadline,
+            "warn_at": self.warn_at,
+            "issued": self.issued_at,
+        }
+
+    @classmethod
+    def from_record(cls, record: dict) -> "PendingCaptcha":
+        """Восстанавливает запись из журнала, включая записи прежнего формата (code, messages)."""
+        messages = record.get("messages") or {}
+        answer = record.get("answer")
+        if answer is None:
+            answer = record.get("code")
+        captcha_type = record.get("type")
+        if captcha_type is None:
+            captcha_type = "image" if record.get("code") else "math" if answer is not None else "button"
+
+        pending = cls(record["chat"], record["user"], captcha_type, answer)
+        pending.index = record.get("index", 0)
+        pending.captcha_message_id = record.get("captcha", messages.get("captcha"))
+        pending.warning_message_id = record.get("warning", messages.get("warning"))
+        pending.batch_message_id = record.get("batch", messages.get("batch"))
+        batch_button = record.get("batch_button")
+        pending.batch_button = tuple(batch_button) if batch_button else None
+        pending.deadline = record["deadline"]
+        pending.warn_at = record["warn_at"]
+        pending.issued_at = record.get("issued", 0.0)
+        return pending
@@ -0,0 +1,92 @@
+# modules/pending_filter.py
+
+from telegram import Update
+from telegram.ext import filters
+
+# Типы капч, ответ на которые приходит текстовым сообщением
+TEXT_ANSWER_TYPES = frozenset(("math", "image"))
+
+
+def pack_key(chat_id: int, user_id: int) -> int:
+    """(chat_id, user_id) одним int: заметно компактнее кортежа из двух int."""
+    return (chat_id << 64) | user_id
+
+
+class PendingUsersFilter(filters.UpdateFilter):
+    """
+    Пропускает только сообщения пользователей, которые должны ответить на капчу текстом,
+    чтобы обычная переписка в группах не доходила до handle_text_messages.
+    """
+
+    __slots__ = ("_keys",)
+
+    def __init__(self):
+        super().__init__(name="PendingUsers", data_filter=False)
+        self._keys = set()  # pack_key(chat_id, user_id)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, chat_id: int, user_id: int):
+        self._keys.add(pack_key(chat_id, user_id))
+
+    def discard(self, chat_id: int, user_id: int):
+        self._keys.discard(pack_key(chat_id, user_id))
+
+    def clear(self):
+        self._keys.clear()
+
+    def filter(self, update: Update) -> bool:
+        message = update.message
+        if message is None or message.from_user is None:
+            return False
+        return pack_key(message.chat.id, message.from_user.id) in self._keys
+
+
+class PendingCaptchas(dict):
+    """
+    (chat_id, user_id) -> PendingCaptcha. При добавлении и удалении записей
+    поддерживает в фильтре пары пользователей с капчей math или image.
+    Капча должна удаляться отсюда при любом завершении (прохождение, неудача, выход),
+    иначе пользователь остаётся в фильтре.
+    """
+
+    __slots__ = ("filter",)
+
+    def __init__(self, pending_filter: PendingUsersFilter):
+        super().__init__()
+        self.filter = pending_filter
+
+    def __setitem__(self, key, pending):
+        super().__setitem__(key, pending)
+        if pending.captcha_type in TEXT_ANSWER_TYPES:
+            self.filter.add(*key)
+        else:
+            self.filter.discard(*key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.filter.discard(*key)
+
+    def pop(self, key, *default):
+        self.filter.discard(*key)
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, pending = super().popitem()
+        self.filter.discard(*key)
+        return key, pending
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        # dict.update не вызывает __setitem__, поэтому записи добавляются по одной
+        for key, pending in dict(*args, **kwargs).items():
+            self[key] = pending
+
+    def clear(self):
+        super().clear()
+        self.filter.clear()
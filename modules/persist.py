@@ -0,0 +1,97 @@
+# modules/persist.py
+
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write_json(path: str, data):
+    """Записывает JSON во временный файл рядом с path и атомарно подменяет им path."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class WriteBehind:
+    """
+    Отложенная запись на фоновом потоке.
+    Задачи с одинаковым ключом схлопываются: выполняется только последняя,
+    поставленная в течение окна delay.
+    """
+
+    def __init__(self, name: str, delay: float = 0.5):
+        self.name = name
+        self.delay = delay
+        self._pending = {}  # key -> callable
+        self._cond = threading.Condition()
+        self._busy = False
+        self._flush_requested = False
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, key, func):
+        """Ставит func в очередь на запись; предыдущая задача с тем же ключом отбрасывается."""
+        with self._cond:
+            self._pending[key] = func
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Блокирует до записи всех накопленных изменений. Возвращает False по таймауту."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Будим поток, не дожидаясь окна схлопывания
+            if self._pending:
+                self._flush_requested = True
+                self._cond.notify_all()
+            while self._pending or self._busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.error(f"[{self.name}] Не удалось дождаться записи изменений на диск.")
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Ждём окно схлопывания, чтобы собрать серию изменений в одну запись
+                deadline = time.monotonic() + self.delay
+                while not self._flush_requested:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending
+                self._pending = {}
+                self._flush_requested = False
+                self._busy = True
+
+            for key, func in batch.items():
+                try:
+                    func()
+                except Exception as e:
+                    logger.error(f"[{self.name}] Ошибка при фоновой записи '{key}': {e}")
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
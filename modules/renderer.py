@@ -0,0 +1,74 @@
+# modules/renderer.py
+
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from captcha_image import get_atlas, render_captcha
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_up():
+    """Пустая задача, чтобы процессы пула стартовали заранее, а не на первой капче."""
+    return None
+
+
+class CaptchaRenderer:
+    """
+    Асинхронная отрисовка капч в пуле процессов, чтобы CPU-нагрузка Pillow
+    не блокировала event loop и распределялась по ядрам.
+    Одновременно в очереди пула находится не больше max_queue задач, остальные ждут.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 64):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = None
+        self._slots = asyncio.Semaphore(max_queue)
+        self._in_flight = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество задач, отправленных в пул и ещё не выполненных."""
+        return self._in_flight
+
+    def start(self):
+        """Создаёт пул процессов."""
+        if self._executor is not None:
+            return
+        # Атлас символов строится до запуска процессов, чтобы они получили его готовым
+        get_atlas()
+        try:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            for _ in range(self.workers):
+                self._executor.submit(_warm_up)
+            logger.info(f"Пул отрисовки капч запущен: {self.workers} процесс(ов).")
+        except (OSError, ValueError) as e:
+            self._executor = None
+            logger.error(f"Не удалось запустить пул процессов, капчи будут рисоваться в потоке: {e}")
+
+    def shutdown(self):
+        """Останавливает пул процессов."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, func=render_captcha, *args):
+        """Выполняет func(*args) в пуле процессов и возвращает результат."""
+        async with self._slots:
+            self._in_flight += 1
+            try:
+                if self._executor is None:
+                    return await asyncio.to_thread(func, *args)
+                loop = asyncio.get_running_loop()
+                try:
+                    return await loop.run_in_executor(self._executor, func, *args)
+                except BrokenProcessPool:
+                    # Пересоздаём пул, а текущую задачу выполняем в потоке
+                    logger.error("Пул процессов отрисовки сломан, пересоздаём его.")
+                    self._executor = None
+                    self.start()
+                    return await asyncio.to_thread(func, *args)
+            finally:
+                self._in_flight -= 1
@@ -0,0 +1,162 @@
+# modules/sharding.py
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+
+from telegram import Update
+from lifecycle import run_application, wait_for_stop_signal
+from state_backend import shard_of
+
+logger = logging.getLogger(__name__)
+
+# Шард текущего процесса; в однопроцессном режиме единственный шард владеет всеми чатами
+SHARD = 0
+SHARDS = 1
+
+# Как часто маршрутизатор проверяет, живы ли процессы-шарды
+WATCH_INTERVAL = 5.0
+# Сколько ждать завершения шарда при остановке
+STOP_TIMEOUT = 30.0
+
+_EMPTY = object()  # Очередь шарда пуста
+
+
+def configure_shard(shard: int, shards: int):
+    """Задаёт шард текущего процесса."""
+    global SHARD, SHARDS
+    SHARD, SHARDS = shard, shards
+
+
+def owns_chat(chat_id: int) -> bool:
+    """Принадлежит ли чат шарду текущего процесса."""
+    return shard_of(chat_id, SHARDS) == SHARD
+
+
+def update_shard(update: Update, shards: int) -> int:
+    """Шард, который обрабатывает обновление: по чату, без чата — по пользователю."""
+    chat = update.effective_chat
+    if chat is not None:
+        return shard_of(chat.id, shards)
+    user = update.effective_user
+    return shard_of(user.id, shards) if user is not None else 0
+
+
+class ShardRouter:
+    """
+    Маршрутизатор процесса-родителя: получает обновления (polling или вебхук) и раздаёт их
+    процессам-шардам по chat_id, так что все обновления одного чата обрабатывает один процесс
+    в порядке поступления. Упавший шард перезапускается, его очередь сохраняется.
+    """
+
+    def __init__(self, shards: int, target):
+        """target(shard, shards, updates) — точка входа процесса-шарда (функция уровня модуля)."""
+        self.shards = shards
+        self.target = target
+        # spawn: шарды не наследуют event loop, потоки и соединения родителя
+        self._mp = multiprocessing.get_context("spawn")
+        self.queues = [self._mp.Queue() for _ in range(shards)]
+        self.processes = [None] * shards
+        self.routed = [0] * shards  # Сколько обновлений отправлено каждому шарду
+        self.restarts = 0
+        self._task = None
+
+    def _spawn(self, shard: int):
+        process = self._mp.Process(
+            target=self.target,
+            args=(shard, self.shards, self.queues[shard]),
+            name=f"lyssa-shard-{shard}",
+        )
+        process.start()
+        self.processes[shard] = process
+        logger.info(f"Шард {shard}/{self.shards} запущен (pid {process.pid}).")
+
+    def start(self):
+        """Запускает процессы-шарды и наблюдение за ними (нужен запущенный event loop)."""
+        for shard in range(self.shards):
+            self._spawn(shard)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch(), name="shard-watch")
+
+    async def route(self, update: Update, context):
+        """Обработчик маршрутизатора: передаёт обновление процессу-шарду."""
+        shard = update_shard(update, self.shards)
+        self.queues[shard].put(update.to_dict())
+        self.routed[shard] += 1
+
+    async def _watch(self):
+        """Перезапускает процессы-шарды, завершившиеся без команды остановки."""
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            for shard, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"Шард {shard} завершился с кодом {process.exitcode}, перезапускаем.")
+                    self.restarts += 1
+                    self._spawn(shard)
+
+    async def stop(self, timeout: float = STOP_TIMEOUT):
+        """Просит шарды доработать очереди и завершиться, дожидается их остановки."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self._stop_processes, timeout)
+
+    def _stop_processes(self, timeout: float):
+        for updates in self.queues:
+            updates.put(None)
+        for shard, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                logger.error(f"Шард {shard} не завершился за {timeout} с, останавливаем принудительно.")
+                process.terminate()
+                process.join()
+            self.processes[shard] = None
+
+
+def _get(updates, timeout: float):
+    try:
+        return updates.get(timeout=timeout)
+    except queue.Empty:
+        return _EMPTY
+
+
+async def _pump(application, updates):
+    """Передаёт обновления от маршрутизатора в приложение шарда до команды остановки (None)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        # С таймаутом, чтобы поток не зависал в get() после отмены
+        data = await loop.run_in_executor(None, _get, updates, 1.0)
+        if data is _EMPTY:
+            continue
+        if data is None:
+            return
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+
+async def serve_shard(application, updates):
+    """Обрабатывает обновления шарда до команды маршрутизатора или SIGTERM."""
+    pump = asyncio.create_task(_pump(application, updates))
+    stop = asyncio.create_task(wait_for_stop_signal((signal.SIGTERM,)))
+    try:
+        await asyncio.wait((pump, stop), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (pump, stop):
+            task.cancel()
+    if pump.done() and not pump.cancelled() and pump.exception():
+        raise pump.exception()
+
+
+def run_shard_application(application, updates):
+    """Точка входа процесса-шарда после сборки приложения."""
+    # Ctrl+C получает вся группа процессов: шард останавливает маршрутизатор, доработав очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger.info(f"Шард {SHARD}/{SHARDS} принимает обновления.")
+    asyncio.run(run_application(application, lambda: serve_shard(application, updates)))
@@ -0,0 +1,122 @@
+# modules/shared_state.py
+
+import logging
+import sharding
+from captcha_journal import captcha_journal
+from persist import WriteBehind
+from state_backend import SHARED_STATE, StateBackendError, state_backend
+
+logger = logging.getLogger(__name__)
+
+
+class VerifiedUsers:
+    """
+    Множество (chat_id, user_id) прошедших капчу. Проверки идут по копии в памяти шарда;
+    если задано общее хранилище, изменения записываются в него в фоне и загружаются при запуске.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._users = set()
+        self._writer = WriteBehind("verified") if backend is not None else None
+
+    def __contains__(self, key):
+        return key in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def _submit(self, key, verified: bool):
+        if self._writer is not None:
+            self._writer.submit(key, lambda: self.backend.set_verified(key[0], key[1], verified))
+
+    def add(self, key):
+        if key not in self._users:
+            self._users.add(key)
+            self._submit(key, True)
+
+    def discard(self, key):
+        if key in self._users:
+            self._users.remove(key)
+            self._submit(key, False)
+
+    def remove(self, key):
+        self._users.remove(key)
+        self._submit(key, False)
+
+    def load(self):
+        """Загружает прошедших капчу в чатах шарда из общего хранилища."""
+        if self.backend is None:
+            return
+        try:
+            self._users.update(self.backend.load_verified(sharding.SHARD, sharding.SHARDS))
+        except StateBackendError as e:
+            logger.error(f"Не удалось загрузить прошедших капчу: {e}")
+            return
+        logger.info(f"Загружено прошедших капчу: {len(self._users)}.")
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Дожидается записи отложенных изменений."""
+        return self._writer.flush(timeout) if self._writer is not None else True
+
+
+class BackendPendingStore:
+    """
+    Незавершённые капчи в общем хранилище с тем же интерфейсом, что у журнала капч
+    (start, update, done, load, close). Запись выполняется в фоне; серия изменений
+    одной капчи за окно WriteBehind сохраняется одной записью.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._live = {}  # (chat_id, user_id) -> запись
+        self._writer = WriteBehind("pending")
+
+    def __len__(self):
+        return len(self._live)
+
+    def _submit(self, key):
+        record = self._live.get(key)
+        if record is None:
+            self._writer.submit(key, lambda: self.backend.remove_pending(*key))
+        else:
+            record = dict(record)
+            self._writer.submit(key, lambda: self.backend.put_pending(*key, record))
+
+    def start(self, chat_id: int, user_id: int, **fields):
+        """Записывает новую капчу (заменяет прежнюю запись того же пользователя в чате)."""
+        key = (chat_id, user_id)
+        self._live[key] = {"chat": chat_id, "user": user_id, **fields}
+        self._submit(key)
+
+    def update(self, chat_id: int, user_id: int, **fields):
+        """Изменяет поля незавершённой капчи."""
+        record = self._live.get((chat_id, user_id))
+        if record is not None:
+            record.update(fields)
+            self._submit((chat_id, user_id))
+
+    def done(self, chat_id: int, user_id: int):
+        """Отмечает капчу завершённой."""
+        if self._live.pop((chat_id, user_id), None) is not None:
+            self._submit((chat_id, user_id))
+
+    def load(self) -> list:
+        """Читает незавершённые капчи в чатах шарда."""
+        try:
+            records = self.backend.load_pending(sharding.SHARD, sharding.SHARDS)
+        except StateBackendError as e:
+            logger.error(f"Не удалось загрузить незавершённые капчи: {e}")
+            records = []
+        self._live = {(record["chat"], record["user"]): record for record in records}
+        return [dict(record) for record in records]
+
+    def close(self):
+        """Дожидается записи отложенных изменений."""
+        self._writer.flush()
+
+
+# С общим хранилищем состояние капч переживает перезапуск и перебалансировку шардов,
+# без него незавершённые капчи пишутся в локальный журнал
+verified_users = VerifiedUsers(state_backend if SHARED_STATE else None)
+pending_store = BackendPendingStore(state_backend) if SHARED_STATE else captcha_journal
@@ -0,0 +1,421 @@
+# modules/state_backend.py
+
+import abc
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+from urllib.parse import unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = 'lyssa.db'  # SQLite-база с настройками отдельных чатов
+KEY_PREFIX = "lyssa:"  # Префикс ключей в Redis
+
+
+class StateBackendError(Exception):
+    """Ошибка хранилища состояния."""
+
+
+def shard_of(chat_id: int, shards: int) -> int:
+    """Номер шарда, которому принадлежит чат."""
+    return abs(chat_id) % shards
+
+
+class StateBackend(abc.ABC):
+    """
+    Хранилище состояния, общего для процессов-шардов: настройки чатов,
+    прошедшие капчу пользователи и незавершённые капчи.
+    Методы синхронные: запись выполняется на фоновом потоке WriteBehind,
+    чтение — при промахе кэша и при запуске шарда.
+    """
+
+    @abc.abstractmethod
+    def get_chat_config(self, chat_id: int) -> dict:
+        """Переопределённые настройки чата ({} если их нет)."""
+
+    @abc.abstractmethod
+    def set_chat_config(self, chat_id: int, overrides: dict):
+        """Сохраняет переопределённые настройки чата."""
+
+    @abc.abstractmethod
+    def chat_ids(self) -> list:
+        """Чаты, для которых сохранены настройки."""
+
+    @abc.abstractmethod
+    def set_verified(self, chat_id: int, user_id: int, verified: bool):
+        """Отмечает, прошёл ли пользователь капчу в чате."""
+
+    @abc.abstractmethod
+    def load_verified(self, shard: int = 0, shards: int = 1) -> list:
+        """Пары (chat_id, user_id) прошедших капчу в чатах шарда."""
+
+    @abc.abstractmethod
+    def put_pending(self, chat_id: int, user_id: int, record: dict):
+        """Записывает незавершённую капчу целиком (запись в формате журнала капч)."""
+
+    @abc.abstractmethod
+    def remove_pending(self, chat_id: int, user_id: int):
+        """Удаляет завершённую капчу."""
+
+    @abc.abstractmethod
+    def load_pending(self, shard: int = 0, shards: int = 1) -> list:
+        """Записи незавершённых капч в чатах шарда."""
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """Состояние в памяти процесса: для одного процесса и для бенчмарков, между процессами не разделяется."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chat_config = {}  # chat_id -> dict
+        self._verified = set()  # (chat_id, user_id)
+        self._pending = {}  # (chat_id, user_id) -> запись
+
+    def get_chat_config(self, chat_id):
+        with self._lock:
+            return dict(self._chat_config.get(chat_id, {}))
+
+    def set_chat_config(self, chat_id, overrides):
+        with self._lock:
+            self._chat_config[chat_id] = dict(overrides)
+
+    def chat_ids(self):
+        with self._lock:
+            return list(self._chat_config)
+
+    def set_verified(self, chat_id, user_id, verified):
+        with self._lock:
+            if verified:
+                self._verified.add((chat_id, user_id))
+            else:
+                self._verified.discard((chat_id, user_id))
+
+    def load_verified(self, shard=0, shards=1):
+        with self._lock:
+            return [key for key in self._verified if shard_of(key[0], shards) == shard]
+
+    def put_pending(self, chat_id, user_id, record):
+        with self._lock:
+            self._pending[(chat_id, user_id)] = dict(record)
+
+    def remove_pending(self, chat_id, user_id):
+        with self._lock:
+            self._pending.pop((chat_id, user_id), None)
+
+    def load_pending(self, shard=0, shards=1):
+        with self._lock:
+            return [dict(record) for key, record in self._pending.items() if shard_of(key[0], shards) == shard]
+
+
+class SQLiteBackend(StateBackend):
+    """
+    Состояние в SQLite (WAL): база на одной машине, общая для всех процессов-шардов.
+    Соединение своё у каждого потока.
+    """
+
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_config ("
+                "chat_id INTEGER PRIMARY KEY, "
+                "data TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS verified ("
+                "chat_id INTEGER NOT NULL, "
+                "user_id INTEGER NOT NULL, "
+                "PRIMARY KEY (chat_id, user_id)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending ("
+                "chat_id INTEGER NOT NULL, "
+                "user_id INTEGER NOT NULL, "
+                "data TEXT NOT NULL, "
+                "PRIMARY KEY (chat_id, user_id)) WITHOUT ROWID"
+            )
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def _query(self, sql: str, params=()) -> list:
+        try:
+            return self._connect().execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            raise StateBackendError(f"SQLite: {e}") from e
+
+    def _write(self, sql: str, params=()):
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(sql, params)
+        except sqlite3.Error as e:
+            raise StateBackendError(f"SQLite: {e}") from e
+
+    def get_chat_config(self, chat_id):
+        rows = self._query("SELECT data FROM chat_config WHERE chat_id = ?", (chat_id,))
+        return json.loads(rows[0][0]) if rows else {}
+
+    def set_chat_config(self, chat_id, overrides):
+        self._write(
+            "INSERT INTO chat_config (chat_id, data) VALUES (?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data",
+            (chat_id, json.dumps(overrides, ensure_ascii=False)),
+        )
+
+    def chat_ids(self):
+        return [row[0] for row in self._query("SELECT chat_id FROM chat_config")]
+
+    def set_verified(self, chat_id, user_id, verified):
+        if verified:
+            self._write("INSERT OR IGNORE INTO verified (chat_id, user_id) VALUES (?, ?)", (chat_id, user_id))
+        else:
+            self._write("DELETE FROM verified WHERE chat_id = ? AND user_id = ?", (chat_id, user_id))
+
+    def load_verified(self, shard=0, shards=1):
+        rows = self._query("SELECT chat_id, user_id FROM verified WHERE abs(chat_id) % ? = ?", (shards, shard))
+        return [(chat_id, user_id) for chat_id, user_id in rows]
+
+    def put_pending(self, chat_id, user_id, record):
+        self._write(
+            "INSERT INTO pending (chat_id, user_id, data) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id, user_id) DO UPDATE SET data = excluded.data",
+            (chat_id, user_id, json.dumps(record, ensure_ascii=False, separators=(',', ':'))),
+        )
+
+    def remove_pending(self, chat_id, user_id):
+        self._write("DELETE FROM pending WHERE chat_id = ? AND user_id = ?", (chat_id, user_id))
+
+    def load_pending(self, shard=0, shards=1):
+        rows = self._query("SELECT data FROM pending WHERE abs(chat_id) % ? = ?", (shards, shard))
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RespError(Exception):
+    """Ответ-ошибка сервера Redis."""
+
+
+class RespClient:
+    """
+    Минимальный синхронный клиент протокола Redis (RESP2): команды и конвейеры команд
+    по одному TCP-соединению, общему для потоков. При обрыве соединение
+    переустанавливается и запрос повторяется один раз (все команды хранилища идемпотентны).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0,
+                 password: str = None, timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(command) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Соединение с Redis закрыто")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._reader.read(size + 2)
+            if len(data) != size + 2:
+                raise ConnectionError("Соединение с Redis закрыто")
+            return data[:-2]
+        if kind == b"*":
+            size = int(rest)
+            return None if size < 0 else [self._read_reply() for _ in range(size)]
+        raise ConnectionError(f"Неизвестный ответ Redis: {line[:32]!r}")
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._exchange(setup)
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    def _exchange(self, commands) -> list:
+        self._sock.sendall(b"".join(self._encode(command) for command in commands))
+        # Читаем все ответы, даже если среди них есть ошибки, чтобы не рассинхронизировать поток
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def pipeline(self, commands) -> list:
+        """Отправляет команды одним пакетом и возвращает ответы по порядку."""
+        if not commands:
+            return []
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._exchange(commands)
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def execute(self, *command):
+        return self.pipeline([command])[0]
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+class RespBackend(StateBackend):
+    """
+    Состояние в Redis (или совместимом сервере): общее для шардов на разных машинах.
+    Ключи: lyssa:chat_config (hash chat_id -> JSON), lyssa:verified:<chat_id> (set user_id),
+    lyssa:pending:<chat_id> (hash user_id -> JSON), lyssa:chats (set чатов с капчами).
+    """
+
+    def __init__(self, client: RespClient, prefix: str = KEY_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def _call(self, *command):
+        return self._pipeline([command])[0]
+
+    def _pipeline(self, commands) -> list:
+        try:
+            return self.client.pipeline(commands)
+        except (OSError, ConnectionError, RespError) as e:
+            raise StateBackendError(f"Redis: {e}") from e
+
+    def _shard_chats(self, shard: int, shards: int) -> list:
+        chats = (int(chat_id) for chat_id in self._call("SMEMBERS", f"{self.prefix}chats"))
+        return [chat_id for chat_id in chats if shard_of(chat_id, shards) == shard]
+
+    def get_chat_config(self, chat_id):
+        data = self._call("HGET", f"{self.prefix}chat_config", chat_id)
+        return json.loads(data) if data else {}
+
+    def set_chat_config(self, chat_id, overrides):
+        self._call("HSET", f"{self.prefix}chat_config", chat_id, json.dumps(overrides, ensure_ascii=False))
+
+    def chat_ids(self):
+        return [int(chat_id) for chat_id in self._call("HKEYS", f"{self.prefix}chat_config")]
+
+    def set_verified(self, chat_id, user_id, verified):
+        if verified:
+            self._pipeline([
+                ("SADD", f"{self.prefix}verified:{chat_id}", user_id),
+                ("SADD", f"{self.prefix}chats", chat_id),
+            ])
+        else:
+            self._call("SREM", f"{self.prefix}verified:{chat_id}", user_id)
+
+    def load_verified(self, shard=0, shards=1):
+        chats = self._shard_chats(shard, shards)
+        replies = self._pipeline([("SMEMBERS", f"{self.prefix}verified:{chat_id}") for chat_id in chats])
+        return [(chat_id, int(user_id)) for chat_id, users in zip(chats, replies) for user_id in users]
+
+    def put_pending(self, chat_id, user_id, record):
+        self._pipeline([
+            ("HSET", f"{self.prefix}pending:{chat_id}", user_id,
+             json.dumps(record, ensure_ascii=False, separators=(',', ':'))),
+            ("SADD", f"{self.prefix}chats", chat_id),
+        ])
+
+    def remove_pending(self, chat_id, user_id):
+        self._call("HDEL", f"{self.prefix}pending:{chat_id}", user_id)
+
+    def load_pending(self, shard=0, shards=1):
+        chats = self._shard_chats(shard, shards)
+        replies = self._pipeline([("HGETALL", f"{self.prefix}pending:{chat_id}") for chat_id in chats])
+        # HGETALL возвращает плоский список: поле, значение, поле, значение...
+        return [json.loads(data) for flat in replies for data in flat[1::2]]
+
+    def close(self):
+        self.client.close()
+
+
+def create_backend(url: str = None) -> StateBackend:
+    """
+    Создаёт хранилище по адресу:
+    memory:// — в памяти процесса;
+    sqlite:///lyssa.db (sqlite:////абсолютный/путь.db) — SQLite;
+    redis://[:пароль@]хост[:порт][/номер базы] — Redis или совместимый сервер.
+    Без адреса — SQLite в DB_FILE.
+    """
+    if not url:
+        return SQLiteBackend(DB_FILE)
+    parts = urlsplit(url)
+    if parts.scheme == "memory":
+        return MemoryBackend()
+    if parts.scheme == "sqlite":
+        return SQLiteBackend(url[len("sqlite:///"):] or DB_FILE)
+    if parts.scheme == "redis":
+        client = RespClient(
+            host=parts.hostname or "127.0.0.1",
+            port=parts.port or 6379,
+            db=int(parts.path.strip("/") or 0),
+            password=unquote(parts.password) if parts.password else None,
+        )
+        return RespBackend(client)
+    raise ValueError(f"Неизвестное хранилище состояния: {url}")
+
+
+# Адрес общего хранилища. Если он задан, прошедшие капчу и незавершённые капчи тоже хранятся в нём,
+# иначе незавершённые капчи пишутся в локальный журнал, а прошедшие капчу живут в памяти процесса.
+# memory:// не переживает перезапуск и не делится между шардами, поэтому с ним журнал остаётся локальным
+STATE_URL = os.getenv("LYSSA_STATE")
+
+state_backend = create_backend(STATE_URL)
+SHARED_STATE = bool(STATE_URL) and not isinstance(state_backend, MemoryBackend)
@@ -0,0 +1,122 @@
+# modules/webhook.py
+
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import urlsplit
+
+from aiohttp import web
+from telegram import Update
+from lifecycle import run_application, wait_for_stop_signal
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_CONNECTIONS = 100  # Верхний предел max_connections в setWebhook
+
+
+class WebhookServer:
+    """
+    Локальный aiohttp-сервер: принимает обновления от Telegram и кладёт их в update_queue приложения.
+    /healthz — живость (event loop отвечает, приложение запущено),
+    /readyz — готовность (вебхук зарегистрирован, обновления принимаются).
+    """
+
+    def __init__(self, application, listen: str, port: int, path: str, secret: str = None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.ready = False
+        self.received = 0  # Принято обновлений
+        self.rejected = 0  # Отклонено запросов (неверный секрет или тело)
+        self._started_at = time.monotonic()
+        self._runner = None
+
+        app = web.Application()
+        app.router.add_post(path, self._handle_update)
+        app.router.add_get("/healthz", self._handle_healthz)
+        app.router.add_get("/readyz", self._handle_readyz)
+        self._app = app
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            self.rejected += 1
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except (json.JSONDecodeError, TypeError, KeyError, ValueError) as e:
+            self.rejected += 1
+            logger.warning(f"Не удалось разобрать обновление из вебхука: {e}")
+            return web.Response(status=400)
+        # Ответ отдаётся сразу, обработка идёт параллельно в приложении
+        await self.application.update_queue.put(update)
+        self.received += 1
+        return web.Response()
+
+    def _status(self) -> dict:
+        return {
+            "running": self.application.running,
+            "ready": self.ready,
+            "update_queue": self.application.update_queue.qsize(),
+            "received": self.received,
+            "rejected": self.rejected,
+            "uptime": round(time.monotonic() - self._started_at, 1),
+        }
+
+    async def _handle_healthz(self, request: web.Request) -> web.Response:
+        status = self._status()
+        return web.json_response(status, status=200 if status["running"] else 503)
+
+    async def _handle_readyz(self, request: web.Request) -> web.Response:
+        status = self._status()
+        return web.json_response(status, status=200 if status["running"] and status["ready"] else 503)
+
+    async def start(self):
+        self._runner = web.AppRunner(self._app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Вебхук слушает {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        self.ready = False
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def serve_webhook(application, url: str, listen: str = "0.0.0.0", port: int = 8443,
+                        secret: str = None, allowed_updates=None, max_connections: int = 40,
+                        drop_pending_updates: bool = False):
+    """Запускает приложение в режиме вебхука до сигнала остановки."""
+    path = urlsplit(url).path or "/"
+    server = WebhookServer(application, listen, port, path, secret)
+
+    async def serve():
+        await server.start()
+        try:
+            await application.bot.set_webhook(
+                url,
+                allowed_updates=allowed_updates,
+                secret_token=secret,
+                max_connections=max(1, min(max_connections, MAX_CONNECTIONS)),
+                drop_pending_updates=drop_pending_updates,
+            )
+            server.ready = True
+            logger.info("Вебхук зарегистрирован, бот принимает обновления.")
+            await wait_for_stop_signal()
+        finally:
+            # Вебхук не снимается: пока бот перезапускается, Telegram копит обновления у себя
+            await server.stop()
+
+    await run_application(application, serve)
+
+
+def run_webhook(application, url: str, **kwargs):
+    """Синхронная обёртка над serve_webhook для main()."""
+    try:
+        asyncio.run(serve_webhook(application, url, **kwargs))
+    except KeyboardInterrupt:
+        pass
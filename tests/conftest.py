@@ -0,0 +1,23 @@
+"""
+Общая настройка тестов: модули бота при импорте читают и создают конфигурацию и базу в текущем каталоге,
+поэтому тесты выполняются во временном каталоге; Lyssa.py без токена завершает процесс.
+"""
+
+import os
+import sys
+import tempfile
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, 'modules'), os.path.join(REPO_DIR, 'benchmarks')]
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:test")
+TMP_DIR = tempfile.mkdtemp(prefix="lyssa-tests-")
+os.chdir(TMP_DIR)
+
+
+def pytest_sessionfinish(session):
+    """
+    К концу сессии pytest уже вернул прежний каталог, а отложенные записи модулей
+    дописываются при выходе по относительным путям: возвращаемся во временный каталог.
+    """
+    os.chdir(TMP_DIR)
@@ -0,0 +1,77 @@
+"""Учёт незавершённых капч: pending_captchas, фильтр ожидающих и восстановление из журнала."""
+
+import asyncio
+import json
+import time
+
+from telegram.ext import ApplicationBuilder
+
+import Lyssa
+from bench_suite import join_update
+import captcha
+from captcha import batch_captcha_buttons, captcha_deadlines, pending_captchas, pending_users, recover_pending_captchas
+from chat_config import set_chat_config
+from fake_bot_api import FakeBotApi, FakeRequest
+from pending import PendingCaptcha
+from outbound import OutboundScheduler
+from test_outbound_dispatch import wait_for
+
+CHAT = -1001000000003
+
+
+def test_failed_restrict_leaves_no_pending_captcha(monkeypatch):
+    api = FakeBotApi()
+    injected_error = api.injected_error
+    monkeypatch.setattr(api, "injected_error", lambda method: (
+        api._error(method, 400, "Bad Request: not enough rights to restrict/unrestrict chat member")
+        if method == "restrictChatMember" else injected_error(method)
+    ))
+    scheduler = OutboundScheduler(global_rate=1000)
+    monkeypatch.setattr(Lyssa, "outbound_scheduler", scheduler)
+    monkeypatch.setattr(Lyssa, "application_builder", lambda: (
+        ApplicationBuilder().token("123:test").request(FakeRequest(api)).get_updates_request(FakeRequest(api))
+    ))
+    # math отвечается текстом, поэтому такая капча попадает и в фильтр ожидающих
+    set_chat_config(CHAT, captcha_type="math")
+    app = Lyssa.build_application(updater=False)
+
+    async def scenario():
+        await app.initialize()
+        await app.start()
+        try:
+            await app.update_queue.put(join_update(app.bot, CHAT, [7101]))
+            await app.update_queue.put(join_update(app.bot, CHAT, [7102, 7103]))
+            await wait_for(lambda: api.errors[("restrictChatMember", 400)] == 3)
+        finally:
+            await app.stop()
+            await scheduler.shutdown()
+            await app.shutdown()
+
+    asyncio.run(asyncio.wait_for(scenario(), 15))
+    assert api.requests["restrictChatMember"] == 3
+    assert api.requests["sendMessage"] == 0
+    assert not any(key[0] == CHAT for key in pending_captchas)
+    assert len(pending_users) == 0
+
+
+def test_batch_buttons_recovered_from_journal(monkeypatch):
+    records = []
+    for user_id in (7201, 7202):
+        pending = PendingCaptcha(CHAT, user_id, "button")
+        pending.batch_message_id = 55
+        pending.batch_button = (f"Я не бот! ({user_id})", f"batch:{user_id}")
+        pending.deadline = pending.warn_at = time.time() + 60
+        # Как после записи в журнал и чтения обратно
+        records.append(json.loads(json.dumps({"chat": CHAT, "user": user_id, **pending.to_record()})))
+    monkeypatch.setattr(captcha.pending_store, "load", lambda: records)
+
+    try:
+        recover_pending_captchas(None)
+        buttons = batch_captcha_buttons[(CHAT, 55)]
+        assert [button.callback_data for button in buttons.values()] == ["batch:7201", "batch:7202"]
+        assert pending_captchas[(CHAT, 7202)].batch_button == ("Я не бот! (7202)", "batch:7202")
+    finally:
+        batch_captcha_buttons.pop((CHAT, 55), None)
+        for record in records:
+            pending_captchas.pop((CHAT, record["user"]), None)
+            captcha_deadlines.cancel((CHAT, record["user"]))
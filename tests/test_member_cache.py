@@ -0,0 +1,35 @@
+"""Объединённые запросы get_chat_member в MemberCache."""
+
+import asyncio
+from types import SimpleNamespace
+
+from member_cache import MemberCache
+
+
+class SlowBot:
+    def __init__(self):
+        self.calls = 0
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return SimpleNamespace(user=SimpleNamespace(id=user_id), status="member")
+
+
+def test_waiters_retry_when_first_call_is_cancelled():
+    cache = MemberCache(ttl=60)
+    bot = SlowBot()
+
+    async def scenario():
+        leader = asyncio.create_task(cache.get(bot, 1, 2))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get(bot, 1, 2)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        # Ожидающие не получают чужую отмену, а один из них запрашивает участника заново
+        members = await asyncio.gather(*waiters)
+        assert [member.user.id for member in members] == [2] * 3
+        assert leader.cancelled()
+
+    asyncio.run(scenario())
+    assert bot.calls == 2
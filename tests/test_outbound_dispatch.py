@@ -0,0 +1,87 @@
+"""Исходящий планировщик: разбор обновлений не ждёт лимитов чатов, объединённые запросы переживают отмену первого."""
+
+import asyncio
+
+from telegram.ext import ApplicationBuilder
+
+import Lyssa
+from bench_suite import callback_update, join_update
+from callback_token import callback_expiry, sign_callback
+from fake_bot_api import FakeBotApi, FakeRequest
+from outbound import OutboundScheduler
+
+CHAT_A = -1001000000001
+CHAT_B = -1001000000002
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "условие не выполнилось вовремя"
+        await asyncio.sleep(0.01)
+
+
+def test_callback_answered_while_other_chat_bucket_is_empty(monkeypatch):
+    api = FakeBotApi()
+    # Одно сообщение в минуту на группу: второй вход в чат A ждёт лимита почти минуту
+    scheduler = OutboundScheduler(global_rate=1000, group_per_minute=1)
+    monkeypatch.setattr(Lyssa, "outbound_scheduler", scheduler)
+    monkeypatch.setattr(Lyssa, "application_builder", lambda: (
+        ApplicationBuilder().token("123:test").request(FakeRequest(api)).get_updates_request(FakeRequest(api))
+    ))
+    # Как в polling по умолчанию: обновления разбираются по одному
+    assert Lyssa.CONCURRENT_UPDATES == 1
+    app = Lyssa.build_application(updater=False)
+
+    async def scenario():
+        await app.initialize()
+        await app.start()
+        try:
+            await app.update_queue.put(join_update(app.bot, CHAT_A, [7001]))
+            await app.update_queue.put(join_update(app.bot, CHAT_A, [7002]))
+            # Оба новичка ограничены сразу, хотя текст второй капчи ещё ждёт лимита чата A
+            await wait_for(lambda: api.requests["restrictChatMember"] == 2 and scheduler.queue_depth(CHAT_A) == 1)
+            assert api.requests["sendMessage"] == 1
+
+            data = sign_callback("button", CHAT_B, 7003, 1, callback_expiry(60))
+            await app.update_queue.put(callback_update(app.bot, CHAT_B, 7003, 1, data))
+            await wait_for(lambda: api.requests["answerCallbackQuery"] == 1)
+            assert scheduler.queue_depth(CHAT_A) == 1
+        finally:
+            # Отменяет ожидающий лимита запрос, иначе остановка приложения ждала бы его
+            await scheduler.shutdown()
+            await app.stop()
+            await app.shutdown()
+
+    # Если обновления снова ждут друг друга, остановка приложения зависает на заблокированном обработчике
+    asyncio.run(asyncio.wait_for(scenario(), 15))
+
+
+def test_coalesced_waiters_retry_when_first_request_is_cancelled():
+    scheduler = OutboundScheduler(global_rate=1000)
+    calls = []
+
+    async def get_chat_member():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return True
+
+    async def scenario():
+        await scheduler.initialize()
+        try:
+            def request():
+                return scheduler.process_request(get_chat_member, (), {}, "getChatMember",
+                                                 {"chat_id": CHAT_A, "user_id": 7004}, None)
+
+            leader = asyncio.create_task(request())
+            await asyncio.sleep(0.01)
+            waiters = [asyncio.create_task(request()) for _ in range(3)]
+            await asyncio.sleep(0)
+            leader.cancel()
+            # Отмена первого запроса не доходит до ожидающих: один из них повторяет запрос
+            assert await asyncio.gather(*waiters) == [True] * 3
+        finally:
+            await scheduler.shutdown()
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert len(calls) == 2